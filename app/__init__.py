@@ -23,6 +23,38 @@ def create_app():
     # 初始化 SQLAlchemy
     db.init_app(app)
 
+    # 初始化数据源路由
+    from .utils.provider_router import provider_router
+    provider_router.configure(app.config)
+
+    # 初始化城市索引（首次访问时从数据库加载）
+    from .utils.city_registry import city_registry
+    city_registry.configure(app.config)
+
+    # 初始化预测模型仓库
+    from .utils.model_registry import model_registry
+    model_registry.configure(app.config)
+
+    # 初始化预计算预测存储，采集数据入库后记录需要重新预测的城市
+    from .utils.forecast_store import forecast_store
+    forecast_store.configure(app.config)
+
+    # 初始化冷数据归档
+    from .utils.weather_archive import weather_archive
+    weather_archive.configure(app.config)
+
+    # 初始化最新数据快照和最近观测缓存，写入数据后自动更新快照、缓存和汇总表
+    from .utils.ingest_writer import register_flush_listener
+    from .utils.latest_snapshot import latest_snapshot
+    from .utils.recent_buffer import recent_buffer
+    from .utils.weather_rollups import refresh_rollups
+    latest_snapshot.configure(app.config)
+    recent_buffer.configure(app.config)
+    register_flush_listener(latest_snapshot.update)
+    register_flush_listener(recent_buffer.update)
+    register_flush_listener(refresh_rollups)
+    register_flush_listener(forecast_store.mark_pending)
+
     # 初始化迁移
     from flask_migrate import Migrate
     migrate = Migrate()
@@ -38,13 +70,36 @@ def create_app():
         from .routes.auth import auth_bp
         from .routes.weather import weather_bp
         from .routes.visualization import vis_bp
+        from .routes.data_export import export_bp
 
         app.register_blueprint(auth_bp, url_prefix='/auth')
         app.register_blueprint(weather_bp, url_prefix='/api/weather')
         app.register_blueprint(vis_bp, url_prefix='/visualization')
+        app.register_blueprint(export_bp)
 
     register_blueprints()
 
+    # 注册命令行命令
+    from .commands import (seed_data_command, compact_weather_data_command, cities_command,
+                           crawl_daemon_command, crawl_leases_command, provider_stub_command,
+                           crawl_benchmark_command, rebuild_rollups_command,
+                           archive_weather_data_command, change_feed_command,
+                           predictor_benchmark_command, precompute_forecasts_command,
+                           forecast_all_command)
+    app.cli.add_command(seed_data_command)
+    app.cli.add_command(compact_weather_data_command)
+    app.cli.add_command(cities_command)
+    app.cli.add_command(crawl_daemon_command)
+    app.cli.add_command(crawl_leases_command)
+    app.cli.add_command(provider_stub_command)
+    app.cli.add_command(crawl_benchmark_command)
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(archive_weather_data_command)
+    app.cli.add_command(change_feed_command)
+    app.cli.add_command(predictor_benchmark_command)
+    app.cli.add_command(precompute_forecasts_command)
+    app.cli.add_command(forecast_all_command)
+
     # 设置用户加载器
     from .models import User
 
@@ -60,6 +115,8 @@ def create_app():
             with app.app_context():
                 db.create_all()
                 print("数据库表已创建/验证")
+                city_registry.load()
+                recent_buffer.load()
         except Exception as e:
             app.logger.error(f"创建数据库表失败: {str(e)}")
 
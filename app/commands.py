@@ -1,8 +1,25 @@
 from app.extensions import db
-from app.models import WeatherData, User
+from app.models import WeatherData, WeatherHourly, WeatherDaily, Forecast, ForecastQueue, User
+from app.utils.batch_forecast import run_batch_forecast
+from app.utils.change_feed import FEED_COLUMNS, read_changes, serialize_change
+from app.utils.city_registry import city_registry
+from app.utils.crawl_benchmark import run_crawl_benchmark
+from app.utils.crawl_leases import LeaseManager
+from app.utils.crawl_scheduler import CrawlScheduler
+from app.utils.forecast_store import forecast_store
+from app.utils.ingest_writer import IngestWriter, compact_weather_data
+from app.utils.latest_snapshot import latest_snapshot
+from app.utils.predictor_benchmark import run_predictor_benchmark
+from app.utils.provider_stub import ProviderStubServer
+from app.utils.weather_archive import weather_archive
+from app.utils.weather_rollups import rebuild_rollups
 from datetime import datetime, timedelta
+import json
+import os
 import random
+import time
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 
 
@@ -12,28 +29,273 @@ def seed_data_command():
     """创建测试数据"""
     # 清除现有数据
     db.session.query(WeatherData).delete()
+    db.session.query(WeatherHourly).delete()
+    db.session.query(WeatherDaily).delete()
+    db.session.query(Forecast).delete()
+    latest_snapshot.invalidate()
 
     # 创建测试用户
     if not User.query.filter_by(username='test').first():
         test_user = User(username='test', email='test@example.com')
         test_user.set_password('test123')
         db.session.add(test_user)
+    db.session.commit()
 
     # 为每个城市创建90天的历史数据
-    cities = ['Beijing', 'Shanghai', 'Guangzhou', 'Shenzhen']
+    cities = city_registry.names()
     start_date = datetime.now() - timedelta(days=90)
 
-    for city in cities:
-        for i in range(90):
-            date = start_date + timedelta(days=i)
-            data = WeatherData(
-                city=city,
-                temperature=20 + random.uniform(-5, 10),
-                humidity=60 + random.uniform(-20, 20),
-                wind_speed=3 + random.uniform(-2, 4),
-                timestamp=date
-            )
-            db.session.add(data)
+    with IngestWriter.from_config(current_app.config) as writer:
+        for city in cities:
+            for i in range(90):
+                writer.add({
+                    'city': city,
+                    'temperature': 20 + random.uniform(-5, 10),
+                    'humidity': 60 + random.uniform(-20, 20),
+                    'wind_speed': 3 + random.uniform(-2, 4),
+                    'timestamp': start_date + timedelta(days=i)
+                })
 
-    db.session.commit()
-    print("成功创建测试数据！")
\ No newline at end of file
+    print(f"成功创建测试数据！写入统计: {writer.stats()}")
+
+
+@click.command('compact-weather-data')
+@click.option('--bucket-seconds', type=int, default=None, help='去重时间桶(秒)，默认使用配置')
+@click.option('--chunk-size', type=int, default=1000, help='每批删除/更新的行数')
+@with_appcontext
+def compact_weather_data_command(bucket_seconds, chunk_size):
+    """清理重复的天气数据（同一城市同一时间桶只保留最新一条）"""
+    bucket_seconds = bucket_seconds or current_app.config.get('WEATHER_DEDUP_BUCKET_SECONDS', 600)
+    deleted, updated = compact_weather_data(bucket_seconds, chunk_size)
+    latest_snapshot.invalidate()
+    print(f"清理完成！删除重复数据{deleted}条，时间戳取整{updated}条")
+
+    if deleted or updated:
+        hourly, daily = rebuild_rollups()
+        print(f"已重建汇总数据：小时汇总{hourly}条，天汇总{daily}条")
+
+
+@click.command('rebuild-rollups')
+@click.option('--days', type=int, default=None, help='只重建最近N天的汇总，默认重建全部')
+@with_appcontext
+def rebuild_rollups_command(days):
+    """从原始数据重建小时/天汇总表（用于首次部署或修复）"""
+    start = datetime.now() - timedelta(days=days) if days else None
+    hourly, daily = rebuild_rollups(start)
+    print(f"重建完成！小时汇总{hourly}条，天汇总{daily}条")
+
+
+@click.command('precompute-forecasts')
+@click.option('--city', 'cities', multiple=True, help='只计算指定城市，可重复，默认所有城市')
+@click.option('--queued', is_flag=True, help='只计算Web请求加入预计算队列的城市')
+@with_appcontext
+def precompute_forecasts_command(cities, queued):
+    """计算并保存各城市的预测结果（可通过 cron 定期执行）"""
+    if queued:
+        cities = list(db.session.execute(db.select(ForecastQueue.city)).scalars())
+        if not cities:
+            print("预计算队列为空")
+            return
+    else:
+        cities = list(cities) or city_registry.names()
+    start_time = time.time()
+    succeeded, _ = forecast_store.precompute(cities)
+    print(f"预计算完成！{succeeded}/{len(cities)}个城市，耗时{time.time() - start_time:.2f}秒")
+
+
+@click.command('forecast-all')
+@click.option('--city', 'cities', multiple=True, help='只计算指定城市，可重复，默认所有启用的城市')
+@click.option('--workers', type=int, default=None, help='工作进程数，默认使用配置或CPU核数')
+@click.option('--no-save-models', is_flag=True, help='不保存训练好的模型，只写入预测结果')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='将每个城市的耗时保存为JSON文件')
+@with_appcontext
+def forecast_all_command(cities, workers, no_save_models, output):
+    """使用进程池批量训练并预测所有城市，结果写入 Forecast 表"""
+    results, summary = run_batch_forecast(current_app.config, cities=list(cities) or None, workers=workers,
+                                          save_models=not no_save_models)
+    print(f"{'城市':<20}{'状态':<20}{'训练(ms)':>10}{'推理(ms)':>10}")
+    for result in results:
+        print(f"{result['city']:<20}{result['status']:<20}{result['train_ms']:>10}{result['predict_ms']:>10}")
+    for key, value in summary.items():
+        print(f"{key:<18}{value}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({'summary': summary, 'cities': results}, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存到 {output}")
+
+
+@click.command('archive-weather-data')
+@click.option('--days', type=int, default=None, help='热表保留天数，默认使用配置')
+@click.option('--chunk-size', type=int, default=50000, help='每批归档的行数')
+@with_appcontext
+def archive_weather_data_command(days, chunk_size):
+    """将超过保留期的天气数据移入 Parquet 归档（可通过 cron 定期执行）"""
+    days = days or weather_archive.retention_days
+    archived = weather_archive.archive(datetime.now() - timedelta(days=days), chunk_size)
+    latest_snapshot.invalidate()
+    print(f"归档完成！{archived}条数据已移入 {weather_archive.root}")
+
+
+@click.group('cities')
+def cities_command():
+    """管理城市列表"""
+
+
+@cities_command.command('list')
+@with_appcontext
+def list_cities_command():
+    """列出所有启用的城市"""
+    for name in city_registry.names():
+        city = city_registry.get(name)
+        print(f"{name}\tOWM={city['openweathermap_id']}\tWB={city['weatherbit_id']}\t"
+              f"({city['latitude']}, {city['longitude']})")
+
+
+@cities_command.command('add')
+@click.argument('name')
+@click.option('--openweathermap-id', type=int, default=None, help='OpenWeatherMap 城市ID')
+@click.option('--weatherbit-id', type=int, default=None, help='Weatherbit 城市ID')
+@click.option('--lat', 'latitude', type=float, default=None, help='纬度')
+@click.option('--lon', 'longitude', type=float, default=None, help='经度')
+@with_appcontext
+def add_city_command(name, openweathermap_id, weatherbit_id, latitude, longitude):
+    """新增或更新城市"""
+    city_registry.upsert_city(name, openweathermap_id=openweathermap_id, weatherbit_id=weatherbit_id,
+                              latitude=latitude, longitude=longitude)
+    print(f"已保存城市: {name}")
+
+
+@cities_command.command('remove')
+@click.argument('name')
+@with_appcontext
+def remove_city_command(name):
+    """停用城市（保留历史数据）"""
+    if city_registry.deactivate_city(name):
+        print(f"已停用城市: {name}")
+    else:
+        print(f"城市不存在: {name}")
+
+
+@click.command('crawl-daemon')
+@click.option('--interval', type=float, default=None, help='每个城市的刷新间隔(秒)，默认使用配置')
+@click.option('--jitter', type=float, default=None, help='刷新间隔的随机抖动比例，如0.1表示±10%')
+@click.option('--once', is_flag=True, help='立即采集所有城市一轮后退出')
+@click.option('--shard', is_flag=True, help='启用分片：多个进程通过数据库租约分担城市')
+@click.option('--worker-id', default=None, help='分片模式下的进程标识，默认 主机名-进程号-随机后缀')
+@with_appcontext
+def crawl_daemon_command(interval, jitter, once, shard, worker_id):
+    """常驻定时采集天气数据（Ctrl+C 或 SIGTERM 优雅退出）"""
+    lease_manager = LeaseManager.from_config(current_app.config, worker_id=worker_id) if shard else None
+    scheduler = CrawlScheduler.from_config(current_app.config, interval=interval, jitter=jitter,
+                                           lease_manager=lease_manager)
+    scheduler.run(once=once)
+
+
+@click.command('crawl-leases')
+@with_appcontext
+def crawl_leases_command():
+    """查看分片采集进程及其持有的分区数"""
+    status = LeaseManager.from_config(current_app.config).status()
+    if not status:
+        print("没有正在运行的分片采集进程")
+    for worker_id, info in status.items():
+        print(f"{worker_id}\t心跳 {info['heartbeat_at']}\t分区 {info['partitions']}")
+
+
+@click.command('change-feed')
+@click.option('--cursor', default=None, help='从该游标之后开始拉取，默认从头开始')
+@click.option('--cursor-file', type=click.Path(dir_okay=False), default=None,
+              help='游标文件：存在时从中读取游标，完成后写入新游标，便于定时增量拉取')
+@click.option('--limit', type=int, default=5000, help='每批读取的行数')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='NDJSON 输出文件，默认标准输出')
+@with_appcontext
+def change_feed_command(cursor, cursor_file, limit, output):
+    """增量拉取新写入的天气数据，以 NDJSON 输出"""
+    if cursor is None and cursor_file and os.path.exists(cursor_file):
+        with open(cursor_file) as f:
+            cursor = f.read().strip() or None
+
+    total = 0
+    has_more = True
+    while has_more:
+        rows, cursor, has_more = read_changes(cursor, limit, lag=current_app.config.get('CHANGE_FEED_LAG', 10))
+        for row in rows:
+            output.write(json.dumps(dict(zip(FEED_COLUMNS, serialize_change(row))), ensure_ascii=False) + '\n')
+        total += len(rows)
+
+    if cursor_file:
+        with open(cursor_file, 'w') as f:
+            f.write(cursor)
+    click.echo(f"拉取完成！共{total}条新数据，下一个游标: {cursor}", err=True)
+
+
+@click.command('provider-stub')
+@click.option('--host', default='127.0.0.1', help='监听地址')
+@click.option('--port', type=int, default=8099, help='监听端口')
+@click.option('--latency', type=float, default=0.05, help='平均响应延迟(秒)')
+@click.option('--error-rate', type=float, default=0.0, help='返回500错误的比例')
+@click.option('--timeout-rate', type=float, default=0.0, help='不返回（模拟超时）的比例')
+def provider_stub_command(host, port, latency, error_rate, timeout_rate):
+    """启动本地数据源模拟服务器"""
+    stub = ProviderStubServer(host=host, port=port, latency=latency, error_rate=error_rate,
+                              timeout_rate=timeout_rate)
+    print("模拟服务器已启动，在配置中设置：")
+    print(f"  OPENWEATHERMAP_BASE_URL = '{stub.base_urls['openweathermap']}'")
+    print(f"  WEATHERBIT_BASE_URL = '{stub.base_urls['weatherbit']}'")
+    stub.serve_forever()
+
+
+@click.command('crawl-benchmark')
+@click.option('--cities', type=int, default=1000, help='虚拟城市数量')
+@click.option('--latency', type=float, default=0.05, help='模拟数据源平均延迟(秒)')
+@click.option('--error-rate', type=float, default=0.0, help='模拟数据源错误比例')
+@click.option('--timeout-rate', type=float, default=0.0, help='模拟数据源超时比例')
+@click.option('--concurrency', type=int, default=None, help='全局并发数，默认使用配置')
+@click.option('--batch-size', type=int, default=None, help='批量请求大小，0表示关闭，默认使用配置')
+@click.option('--keep-data', is_flag=True, help='保留写入的基准测试数据')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='将结果保存为JSON文件')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), default=None, help='与之前保存的结果对比')
+@with_appcontext
+def crawl_benchmark_command(cities, latency, error_rate, timeout_rate, concurrency, batch_size, keep_data,
+                            output, baseline):
+    """使用本地模拟数据源测试采集吞吐量"""
+    result = run_crawl_benchmark(current_app.config, cities=cities, latency=latency, error_rate=error_rate,
+                                 timeout_rate=timeout_rate, concurrency=concurrency, batch_size=batch_size,
+                                 keep_data=keep_data)
+
+    previous = {}
+    if baseline:
+        with open(baseline) as f:
+            previous = json.load(f)
+
+    for key, value in result.items():
+        line = f"{key:<22}{value}"
+        if key in previous and isinstance(value, (int, float)) and previous[key]:
+            line += f"\t(基线 {previous[key]}, {(value - previous[key]) / previous[key]:+.1%})"
+        print(line)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"结果已保存到 {output}")
+
+
+@click.command('predictor-benchmark')
+@click.option('--days', type=int, default=90, help='合成训练数据的天数')
+@click.option('--horizon', type=int, default=7, help='直接预测的天数')
+@click.option('--repeats', type=int, default=3, help='重复次数，取最快的一次')
+@click.option('--n-jobs', type=int, default=None, help='多输出模型的训练线程数，默认使用配置')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='将结果保存为JSON文件')
+@with_appcontext
+def predictor_benchmark_command(days, horizon, repeats, n_jobs, output):
+    """对比三个独立模型与一个多输出模型的训练和推理耗时"""
+    result = run_predictor_benchmark(days=days, lags=current_app.config.get('PREDICTOR_LAGS', 7),
+                                     horizon=horizon, repeats=repeats, n_jobs=n_jobs)
+    for key, value in result.items():
+        print(f"{key:<28}{value}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"结果已保存到 {output}")
@@ -3,12 +3,81 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
 class WeatherData(db.Model):
+    # 同一城市同一时间桶只保留一条数据，写入时时间戳已取整到桶起点
+    __table_args__ = (
+        db.Index('idx_city_time', 'city', 'timestamp', unique=True),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     city = db.Column(db.String(100), nullable=False)
     temperature = db.Column(db.Float, nullable=False)
     humidity = db.Column(db.Float, nullable=False)
     wind_speed = db.Column(db.Float, nullable=False)
     timestamp = db.Column(db.DateTime, default=db.func.current_timestamp(), nullable=False)
+    # 写入时间（数据库时间），增量变更接口据此判断主键是否已经稳定可见
+    ingested_at = db.Column(db.DateTime, server_default=db.func.now(), nullable=False)
+
+class WeatherRollupMixin:
+    # 每个城市每个时间桶一行汇总，timestamp 为时间桶起点，temperature 等字段为平均值
+    id = db.Column(db.Integer, primary_key=True)
+    city = db.Column(db.String(100), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    temperature = db.Column(db.Float, nullable=False)
+    temperature_min = db.Column(db.Float, nullable=False)
+    temperature_max = db.Column(db.Float, nullable=False)
+    humidity = db.Column(db.Float, nullable=False)
+    humidity_min = db.Column(db.Float, nullable=False)
+    humidity_max = db.Column(db.Float, nullable=False)
+    wind_speed = db.Column(db.Float, nullable=False)
+    wind_speed_min = db.Column(db.Float, nullable=False)
+    wind_speed_max = db.Column(db.Float, nullable=False)
+
+class WeatherHourly(WeatherRollupMixin, db.Model):
+    __tablename__ = 'weather_hourly'
+    __table_args__ = (
+        db.Index('idx_hourly_city_time', 'city', 'timestamp', unique=True),
+    )
+
+class WeatherDaily(WeatherRollupMixin, db.Model):
+    __tablename__ = 'weather_daily'
+    __table_args__ = (
+        db.Index('idx_daily_city_time', 'city', 'timestamp', unique=True),
+    )
+
+class Forecast(db.Model):
+    __table_args__ = (
+        db.Index('idx_forecast_city', 'city', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    city = db.Column(db.String(100), nullable=False)
+    generated_at = db.Column(db.DateTime, nullable=False)
+    horizon = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # 按天排列的预测结果(JSON)
+
+class ForecastQueue(db.Model):
+    city = db.Column(db.String(100), primary_key=True)
+    requested_at = db.Column(db.DateTime, nullable=False)  # 最近一次请求时间，按此顺序预计算
+
+class City(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    openweathermap_id = db.Column(db.Integer, nullable=True)
+    weatherbit_id = db.Column(db.Integer, nullable=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    active = db.Column(db.Boolean, default=True, nullable=False)
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(),
+                           onupdate=db.func.current_timestamp(), nullable=False)
+
+class CrawlWorker(db.Model):
+    id = db.Column(db.String(64), primary_key=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=False)
+
+class CrawlLease(db.Model):
+    partition = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    owner = db.Column(db.String(64), nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True)
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -1,35 +1,51 @@
-from flask import Blueprint, send_file
-import pandas as pd
-from io import BytesIO
-from app import db
-from app.models import WeatherData
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from datetime import datetime
+from urllib.parse import quote
+from app.utils.city_registry import city_registry
+from app.utils.weather_export import EXPORT_FORMATS, stream_export
 
 export_bp = Blueprint('export', __name__)
 
 
+def _parse_time(name):
+    """解析时间参数，支持 2025-09-01 和 2025-09-01T12:00:00 格式"""
+    value = request.args.get(name)
+    return datetime.fromisoformat(value) if value else None
+
+
+def _export_response(fmt, cities, start_date, end_date, filename):
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    stream = stream_export(
+        fmt, cities, start_date, end_date,
+        chunk_size=current_app.config.get('EXPORT_CHUNK_SIZE', 10000),
+        compression=current_app.config.get('ARCHIVE_COMPRESSION', 'zstd')
+    )
+    return Response(stream_with_context(stream), mimetype=mimetype, headers={
+        'Content-Disposition': f"attachment; filename*=UTF-8''{quote(f'{filename}.{extension}')}"
+    })
+
+
+@export_bp.route('/export/<fmt>')
+def export_data(fmt):
+    """流式导出天气数据
+
+    fmt 为 csv/ndjson/parquet；cities 为逗号分隔的城市列表（默认全部城市），
+    start/end 为时间范围（默认全部数据），包括已归档的数据。
+    """
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": "Unsupported format", "formats": list(EXPORT_FORMATS)}), 400
+
+    cities = [city for city in request.args.get('cities', '').split(',') if city] or city_registry.names()
+    try:
+        start_date, end_date = _parse_time('start'), _parse_time('end')
+    except ValueError as e:
+        return jsonify({"error": "Invalid time range", "message": str(e)}), 400
+
+    filename = cities[0] + '_weather_data' if len(cities) == 1 else 'weather_data'
+    return _export_response(fmt, cities, start_date, end_date, filename)
+
+
 @export_bp.route('/export/csv/<city>')
 def export_csv(city):
     """导出CSV格式数据"""
-    with db.session.begin():
-        data = WeatherData.query.filter_by(city=city).all()
-
-        # 转换为DataFrame
-        df = pd.DataFrame([{
-            'date': d.timestamp.date(),
-            'time': d.timestamp.time(),
-            'temperature': d.temperature,
-            'humidity': d.humidity,
-            'wind_speed': d.wind_speed
-        } for d in data])
-
-        # 创建CSV文件
-        output = BytesIO()
-        df.to_csv(output, index=False)
-        output.seek(0)
-
-        return send_file(
-            output,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'{city}_weather_data.csv'
-        )
\ No newline at end of file
+    return _export_response('csv', [city], None, None, f'{city}_weather_data')
@@ -1,8 +1,14 @@
-from flask import Blueprint, render_template, request, jsonify, current_app
-from app.models import WeatherData
-from app.utils.advanced_predictor import AdvancedPredictor
+from flask import Blueprint, render_template, request, jsonify, current_app, Response, stream_with_context
+from app.utils.city_registry import city_registry
+from app.utils.advanced_predictor import parse_forecast_days
+from app.utils.latest_snapshot import latest_snapshot
+from app.utils.forecast_store import ForecastPending, forecast_store
+from app.utils.recent_buffer import recent_buffer
+from app.utils.weather_rollups import (RESOLUTIONS, choose_resolution, has_rollups, query_history, iter_history,
+                                       encode_cursor, decode_cursor)
 from datetime import datetime, timedelta
-from app.extensions import db
+from itertools import islice
+import json
 
 vis_bp = Blueprint('visualization', __name__)
 
@@ -10,15 +16,8 @@ vis_bp = Blueprint('visualization', __name__)
 @vis_bp.route('/dashboard')
 def dashboard():
     """气象数据仪表盘"""
-    # 获取所有支持的城市
-    cities = ['Beijing', 'Shanghai', 'Guangzhou', 'Shenzhen']
-    cities_data = {}
-
-    for city in cities:
-        # 使用全局 db
-        data = db.session.query(WeatherData).filter_by(city=city).order_by(
-            WeatherData.timestamp.desc()).first()
-        cities_data[city] = data
+    # 从最新数据快照读取所有支持的城市
+    cities_data = {city: latest_snapshot.get(city) for city in city_registry.names()}
 
     return render_template('dashboard.html', cities_data=cities_data)
 
@@ -26,12 +25,17 @@ def dashboard():
 def seven_days_forecast():
     """7天天气预报页面"""
     city = request.args.get('city', 'Beijing')
-    days = request.args.get('days', 7, type=int)
+    try:
+        days = parse_forecast_days(request.args.get('days', 7), current_app.config.get('PREDICTOR_MAX_HORIZON', 30))
+    except ValueError as e:
+        return str(e), 400
 
-    predictor = AdvancedPredictor()
-    if predictor.train_model(city):
-        forecast = predictor.predict_7days()
-        return render_template('7days_forecast.html', forecast=forecast, city=city)
+    try:
+        forecast = forecast_store.get(city, days)
+    except ForecastPending:
+        return "预测正在生成，请稍后刷新", 202
+    if forecast:
+        return render_template('7days_forecast.html', forecast=forecast, city=city, requested_days=days)
     else:
         return "无法生成预测，数据不足", 400
 
@@ -40,17 +44,24 @@ def seven_days_forecast():
 def temperature_trend():
     """获取温度趋势数据API"""
     city = request.args.get('city', 'Beijing')
-    days = request.args.get('days', 7, type=int)
+    try:
+        days = parse_forecast_days(request.args.get('days', 7), current_app.config.get('PREDICTOR_MAX_HORIZON', 30))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # 创建预测器时传递城市参数
-    predictor = AdvancedPredictor(city)
-    if predictor.train_model():
-        forecast = predictor.predict_7days()
+    # 从模型仓库获取已训练的预测器，只做推理
+    try:
+        forecast = forecast_store.get(city, days)
+    except ForecastPending:
+        return jsonify({'status': 'pending', 'message': '预测正在生成，请稍后重试'}), 202
+    if forecast:
         dates = [day['date'] for day in forecast]
         temperatures = [day['temperature'] for day in forecast]
         return jsonify({
             'dates': dates,
-            'temperatures': temperatures
+            'temperatures': temperatures,
+            'horizon': len(forecast),
+            'requested_days': days
         })
     else:
         return jsonify({'error': '数据不足'}), 400
@@ -60,17 +71,24 @@ def temperature_trend():
 def humidity_trend():
     """获取湿度趋势数据API"""
     city = request.args.get('city', 'Beijing')
-    days = request.args.get('days', 7, type=int)
+    try:
+        days = parse_forecast_days(request.args.get('days', 7), current_app.config.get('PREDICTOR_MAX_HORIZON', 30))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # 创建预测器时传递城市参数
-    predictor = AdvancedPredictor(city)
-    if predictor.train_model():
-        forecast = predictor.predict_7days()
+    # 从模型仓库获取已训练的预测器，只做推理
+    try:
+        forecast = forecast_store.get(city, days)
+    except ForecastPending:
+        return jsonify({'status': 'pending', 'message': '预测正在生成，请稍后重试'}), 202
+    if forecast:
         dates = [day['date'] for day in forecast]
         humidities = [day['humidity'] for day in forecast]
         return jsonify({
             'dates': dates,
-            'humidities': humidities
+            'humidities': humidities,
+            'horizon': len(forecast),
+            'requested_days': days
         })
     else:
         return jsonify({'error': '数据不足'}), 400
@@ -80,17 +98,24 @@ def humidity_trend():
 def wind_trend():
     """获取风速趋势数据API"""
     city = request.args.get('city', 'Beijing')
-    days = request.args.get('days', 7, type=int)
+    try:
+        days = parse_forecast_days(request.args.get('days', 7), current_app.config.get('PREDICTOR_MAX_HORIZON', 30))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # 创建预测器时传递城市参数
-    predictor = AdvancedPredictor(city)
-    if predictor.train_model():
-        forecast = predictor.predict_7days()
+    # 从模型仓库获取已训练的预测器，只做推理
+    try:
+        forecast = forecast_store.get(city, days)
+    except ForecastPending:
+        return jsonify({'status': 'pending', 'message': '预测正在生成，请稍后重试'}), 202
+    if forecast:
         dates = [day['date'] for day in forecast]
         wind_speeds = [day['wind_speed'] for day in forecast]
         return jsonify({
             'dates': dates,
-            'wind_speeds': wind_speeds
+            'wind_speeds': wind_speeds,
+            'horizon': len(forecast),
+            'requested_days': days
         })
     else:
         return jsonify({'error': '数据不足'}), 400
@@ -99,16 +124,19 @@ def wind_trend():
 @vis_bp.route('/api/city_comparison')
 def city_comparison():
     """获取城市对比数据API"""
-    days = request.args.get('days', 7, type=int)
+    try:
+        days = parse_forecast_days(request.args.get('days', 7), current_app.config.get('PREDICTOR_MAX_HORIZON', 30))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    cities = ['Beijing', 'Shanghai', 'Guangzhou', 'Shenzhen']
+    cities = city_registry.names()
     result = {}
 
+    # 一次查询读取所有城市预计算的预测
+    forecasts = forecast_store.get_many(cities, days)
     for city in cities:
-        # 为每个城市创建预测器，并传递城市参数
-        predictor = AdvancedPredictor(city)
-        if predictor.train_model():
-            forecast = predictor.predict_7days()
+        forecast = forecasts.get(city)
+        if forecast:
             # 计算平均值
             avg_temp = sum(day['temperature'] for day in forecast) / len(forecast)
             avg_humidity = sum(day['humidity'] for day in forecast) / len(forecast)
@@ -117,7 +145,8 @@ def city_comparison():
             result[city] = {
                 'temperature': round(avg_temp, 1),
                 'humidity': round(avg_humidity, 1),
-                'wind_speed': round(avg_wind, 1)
+                'wind_speed': round(avg_wind, 1),
+                'horizon': len(forecast)
             }
 
     return jsonify(result)
@@ -128,40 +157,113 @@ def current_weather():
     """获取当前天气数据API"""
     city = request.args.get('city', 'Beijing')
 
-    # 确保在应用上下文中执行查询
-    with current_app.app_context():
-        data = current_app.db.session.query(WeatherData).filter_by(city=city).order_by(
-            WeatherData.timestamp.desc()).first()
-
-        if not data:
-            return jsonify({"error": "No data available"}), 404
+    data = latest_snapshot.get(city)
+    if not data:
+        return jsonify({"error": "No data available"}), 404
 
-        return jsonify({
-            'city': data.city,
-            'temperature': data.temperature,
-            'humidity': data.humidity,
-            'wind_speed': data.wind_speed,
-            'timestamp': data.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        })
+    return jsonify({
+        'city': data.city,
+        'temperature': data.temperature,
+        'humidity': data.humidity,
+        'wind_speed': data.wind_speed,
+        'timestamp': data.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+    })
 
 @vis_bp.route('/history/<city>')
 def history_chart(city):
     """显示城市历史数据图表"""
     return render_template('history_chart.html')
 
+def _history_point(item, resolution):
+    """将一行历史数据转换为接口返回的字典"""
+    point = {
+        'date': item.timestamp.strftime('%Y-%m-%d'),
+        'time': item.timestamp.strftime('%H:%M:%S'),
+        'temperature': item.temperature,
+        'humidity': item.humidity,
+        'wind_speed': item.wind_speed
+    }
+    if resolution != 'raw':
+        point.update({
+            'count': item.count,
+            'temperature_min': item.temperature_min,
+            'temperature_max': item.temperature_max,
+            'humidity_min': item.humidity_min,
+            'humidity_max': item.humidity_max,
+            'wind_speed_min': item.wind_speed_min,
+            'wind_speed_max': item.wind_speed_max
+        })
+    return point
+
+
+def _stream_history(rows, resolution):
+    """逐行输出 JSON 数组，不在内存中构造完整结果"""
+    yield '['
+    for index, item in enumerate(rows):
+        yield (',' if index else '') + json.dumps(_history_point(item, resolution), ensure_ascii=False)
+    yield ']'
+
+
 @vis_bp.route('/api/historical_data/<city>')
 def historical_data(city):
-    """获取历史天气数据API"""
+    """获取历史天气数据API
+
+    resolution 默认为 raw（原始观测，与之前的接口一致），可选 hour/day 读取汇总表，
+    数值为平均值并附带最小值、最大值和数据条数；auto 按时间跨度选择，所选汇总表没有数据时使用原始数据。
+    传入 limit 或 cursor 时按 (时间, id) 键集分页，返回 {data, next_cursor}；
+    stream=1 时以流式 JSON 数组逐行返回全部数据，内存占用与时间范围无关。
+    """
     try:
         days = request.args.get('days', 30, type=int)  # 默认获取30天数据
+        resolution = request.args.get('resolution', 'raw')
+        auto = resolution == 'auto'
+        if auto:
+            resolution = choose_resolution(days)
+        if resolution not in ('raw',) + tuple(RESOLUTIONS):
+            return jsonify({"error": "Invalid resolution", "resolution": resolution}), 400
+
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
+        # 自动选择的汇总表还没有数据（未回填）时改用原始数据
+        if auto and resolution != 'raw' and not has_rollups(city, start_date, end_date, resolution):
+            resolution = 'raw'
+
+        cursor = request.args.get('cursor')
+        limit = request.args.get('limit', type=int)
+        if cursor or limit:
+            limit = min(max(limit or 1000, 1), 10000)
+            try:
+                after = decode_cursor(cursor) if cursor else None
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+            rows = iter_history(city, start_date, end_date, resolution, after=after, chunk_size=limit + 1)
+            page = list(islice(rows, limit + 1))
+            rows.close()
+            return jsonify({
+                'data': [_history_point(item, resolution) for item in page[:limit]],
+                'next_cursor': encode_cursor(page[limit - 1]) if len(page) > limit else None
+            })
 
-        # 使用全局 db
-        data = db.session.query(WeatherData).filter(
-            WeatherData.city == city,
-            WeatherData.timestamp.between(start_date, end_date)
-        ).order_by(WeatherData.timestamp.asc()).all()
+        if request.args.get('stream', type=int):
+            rows = iter_history(city, start_date, end_date, resolution)
+            return Response(stream_with_context(_stream_history(rows, resolution)), mimetype='application/json')
+
+        # 原始数据在缓存窗口内时直接读取内存中的数组
+        series = recent_buffer.series(city, days) if resolution == 'raw' else None
+        if series is not None and len(series['timestamp']):
+            return jsonify([{
+                'date': timestamp.strftime('%Y-%m-%d'),
+                'time': timestamp.strftime('%H:%M:%S'),
+                'temperature': temperature,
+                'humidity': humidity,
+                'wind_speed': wind_speed
+            } for timestamp, temperature, humidity, wind_speed in zip(
+                series['timestamp'].tolist(), series['temperature'].tolist(),
+                series['humidity'].tolist(), series['wind_speed'].tolist()
+            )])
+
+        data = query_history(city, start_date, end_date, resolution)
 
         if not data:
             return jsonify({
@@ -170,17 +272,7 @@ def historical_data(city):
                 "days": days
             }), 404
 
-        result = []
-        for item in data:
-            result.append({
-                'date': item.timestamp.strftime('%Y-%m-%d'),
-                'time': item.timestamp.strftime('%H:%M:%S'),
-                'temperature': item.temperature,
-                'humidity': item.humidity,
-                'wind_speed': item.wind_speed
-            })
-
-        return jsonify(result)
+        return jsonify([_history_point(item, resolution) for item in data])
     except Exception as e:
         current_app.logger.error(f"获取历史数据失败: {str(e)}")
         return jsonify({
@@ -1,40 +1,32 @@
 # app/routes/weather.py
 
 from flask import Blueprint, render_template, request, jsonify, current_app, redirect, url_for
-from app.models import WeatherData
-from app.utils.advanced_predictor import AdvancedPredictor
+from app.utils.advanced_predictor import AdvancedPredictor, parse_forecast_days
 from app.utils.weather_crawler import WeatherService
-from datetime import datetime, timedelta
+from app.utils.crawl_engine import AsyncCrawlEngine, build_crawl_result
+from app.utils.provider_router import provider_router
+from app.utils.change_feed import FEED_COLUMNS, read_changes, head_cursor, serialize_change
+from app.utils.city_registry import city_registry
+from app.utils.latest_snapshot import latest_snapshot
+from app.utils.forecast_store import ForecastPending, forecast_store
+from app.utils.model_registry import model_registry
+from app.utils.recent_buffer import recent_buffer
 import time
-import threading
-import numpy as np
-from app.extensions import db
 
 weather_bp = Blueprint('weather', __name__)
 
-# 支持的城市列表
-SUPPORTED_CITIES = ['Beijing', 'Shanghai', 'Guangzhou', 'Shenzhen']
-
 @weather_bp.route('/home')
 def home():
     """美化后的首页"""
-    cities = ['Beijing', 'Shanghai', 'Guangzhou', 'Shenzhen']
-    cities_data = {}
-
-    # 确保在应用上下文中执行查询
-    for city in cities:
-        data = db.session.query(WeatherData).filter_by(city=city).order_by(
-            WeatherData.timestamp.desc()).first()
-        cities_data[city] = data
+    # 从最新数据快照读取，不逐城市查询数据库
+    cities_data = {city: latest_snapshot.get(city) for city in city_registry.names()}
 
     return render_template('home.html', cities_data=cities_data)
 
 @weather_bp.route('/latest')
 def get_latest_data():
     """获取并显示最新天气数据"""
-    # 确保在应用上下文中执行查询
-    data = db.session.query(WeatherData).order_by(
-        WeatherData.timestamp.desc()).first()
+    data = latest_snapshot.latest()
 
     if not data:
         return jsonify({"error": "No data available"}), 404
@@ -72,36 +64,9 @@ def crawl_city_data(city):
         # 获取天气数据
         data = service.get_weather_data(city)
 
-        if not data:
-            return {
-                'status': 'failed',
-                'city': city,
-                'reason': 'crawl_failed',
-                'time_cost': round(time.time() - start_time, 2)
-            }
-
         # 保存到数据库
-        if service.save_to_db(data):
-            # 获取最新数据
-            latest_data = db.session.query(WeatherData).filter_by(city=city).order_by(
-                WeatherData.timestamp.desc()).first()
-
-            return {
-                'status': 'success',
-                'city': city,
-                'temperature': latest_data.temperature,
-                'humidity': latest_data.humidity,
-                'wind_speed': latest_data.wind_speed,
-                'timestamp': latest_data.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-                'time_cost': round(time.time() - start_time, 2)
-            }
-
-        return {
-            'status': 'failed',
-            'city': city,
-            'reason': 'save_failed',
-            'time_cost': round(time.time() - start_time, 2)
-        }
+        saved = bool(data) and service.save_to_db(data)
+        return build_crawl_result(city, data, saved, time.time() - start_time)
     except Exception as e:
         return {
             'status': 'error',
@@ -113,29 +78,19 @@ def crawl_city_data(city):
 @weather_bp.route('/crawl')
 def crawl_select():
     """显示城市选择页面"""
-    return render_template('crawl_select.html', cities=SUPPORTED_CITIES)
+    return render_template('crawl_select.html', cities=city_registry.names())
 
 @weather_bp.route('/crawl/all')
 def crawl_all_cities():
     """采集所有支持城市的天气数据"""
-    results = []
-    threads = []
-
-    # 创建线程池
-    for city in SUPPORTED_CITIES:
-        thread = threading.Thread(target=lambda: results.append(crawl_city_data(city)))
-        thread.start()
-        threads.append(thread)
-
-    # 等待所有线程完成
-    for thread in threads:
-        thread.join()
+    start_time = time.time()
 
-    # 按城市名称排序结果
-    results.sort(key=lambda x: SUPPORTED_CITIES.index(x['city']))
+    # 使用异步采集引擎并发获取，结果顺序与城市列表一致
+    engine = AsyncCrawlEngine.from_config(current_app.config)
+    results = engine.crawl(city_registry.names())
 
-    # 计算总耗时
-    total_time = sum(r['time_cost'] for r in results)
+    # 计算总耗时（并发执行，取实际墙钟时间）
+    total_time = time.time() - start_time
 
     return render_template(
         'crawl_result.html',
@@ -146,6 +101,50 @@ def crawl_all_cities():
     )
 
 
+@weather_bp.route('/changes')
+def change_feed():
+    """增量变更接口：返回游标之后新写入的数据（所有城市）
+
+    返回 {columns, rows, next_cursor, has_more}，下次请求传入 next_cursor；
+    cursor=head 返回当前最新位置的游标而不返回数据。
+    """
+    cursor = request.args.get('cursor')
+    lag = current_app.config.get('CHANGE_FEED_LAG', 10)
+    if cursor == 'head':
+        return jsonify({'columns': FEED_COLUMNS, 'rows': [], 'next_cursor': head_cursor(lag=lag), 'has_more': False})
+
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 10000)
+    try:
+        rows, next_cursor, has_more = read_changes(cursor, limit, lag=lag)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({
+        'columns': FEED_COLUMNS,
+        'rows': [serialize_change(row) for row in rows],
+        'next_cursor': next_cursor,
+        'has_more': has_more
+    })
+
+
+@weather_bp.route('/buffer')
+def recent_buffer_stats():
+    """最近观测缓存的城市数、数据条数和内存占用"""
+    return jsonify(recent_buffer.stats())
+
+
+@weather_bp.route('/models')
+def model_registry_stats():
+    """预测模型仓库的缓存、训练和请求合并情况"""
+    return jsonify(model_registry.stats())
+
+
+@weather_bp.route('/providers')
+def provider_status():
+    """查看各数据源的健康状态与熔断情况"""
+    return jsonify(provider_router.snapshot())
+
+
 @weather_bp.route('/data_collection_result')
 def data_collection_result():
     """数据采集结果页面"""
@@ -171,7 +170,7 @@ def data_collection_result():
 @weather_bp.route('/crawl/<city_name>')
 def crawl_single_city(city_name):
     """采集指定城市天气数据"""
-    if city_name not in SUPPORTED_CITIES:
+    if city_name not in city_registry:
         return jsonify({"status": "error", "message": "Unsupported city"}), 400
 
     result = crawl_city_data(city_name)
@@ -194,18 +193,24 @@ def crawl_single_city(city_name):
 def seven_days_forecast(city_name=None):
     """7天天气预报页面"""
     city = city_name or request.args.get('city', 'Beijing')
+    try:
+        days = parse_forecast_days(request.args.get('days', 7), current_app.config.get('PREDICTOR_MAX_HORIZON', 30))
+    except ValueError:
+        return render_template('prediction_error.html', city=city), 400
 
-    # 创建预测器
-    predictor = AdvancedPredictor(city)
+    # 读取预计算的预测，还没有时已加入预计算队列，先展示默认预测
+    try:
+        forecast = forecast_store.get(city, days)
+    except ForecastPending:
+        forecast = None
 
-    if predictor.train_model():
-        forecast = predictor.predict_7days()
-        return render_template('7days_forecast.html', forecast=forecast, city=city)
+    if forecast:
+        return render_template('7days_forecast.html', forecast=forecast, city=city, requested_days=days)
     else:
         try:
             # 尝试使用默认预测
-            forecast = predictor._default_forecast()
-            return render_template('7days_forecast.html', forecast=forecast, city=city)
+            forecast = AdvancedPredictor(city)._default_forecast(days)
+            return render_template('7days_forecast.html', forecast=forecast, city=city, requested_days=days)
         except:
             # 如果默认预测也失败，返回错误页面
             return render_template('prediction_error.html', city=city), 400
@@ -215,16 +220,23 @@ def seven_days_forecast(city_name=None):
 def temperature_trend():
     """获取温度趋势数据API"""
     city = request.args.get('city', 'Beijing')
-    days = request.args.get('days', 7, type=int)
+    try:
+        days = parse_forecast_days(request.args.get('days', 7), current_app.config.get('PREDICTOR_MAX_HORIZON', 30))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    predictor = AdvancedPredictor(city)
-    if predictor.train_model():  # 不需要传递city参数
-        forecast = predictor.predict_7days()
+    try:
+        forecast = forecast_store.get(city, days)
+    except ForecastPending:
+        return jsonify({'status': 'pending', 'message': '预测正在生成，请稍后重试'}), 202
+    if forecast:
         dates = [day['date'] for day in forecast]
         temperatures = [day['temperature'] for day in forecast]
         return jsonify({
             'dates': dates,
-            'temperatures': temperatures
+            'temperatures': temperatures,
+            'horizon': len(forecast),
+            'requested_days': days
         })
     else:
         return jsonify({'error': '数据不足'}), 400
@@ -233,16 +245,23 @@ def temperature_trend():
 def humidity_trend():
     """获取湿度趋势数据API"""
     city = request.args.get('city', 'Beijing')
-    days = request.args.get('days', 7, type=int)
+    try:
+        days = parse_forecast_days(request.args.get('days', 7), current_app.config.get('PREDICTOR_MAX_HORIZON', 30))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    predictor = AdvancedPredictor()
-    if predictor.train_model(city):
-        forecast = predictor.predict_7days()
+    try:
+        forecast = forecast_store.get(city, days)
+    except ForecastPending:
+        return jsonify({'status': 'pending', 'message': '预测正在生成，请稍后重试'}), 202
+    if forecast:
         dates = [day['date'] for day in forecast]
         humidities = [day['humidity'] for day in forecast]
         return jsonify({
             'dates': dates,
-            'humidities': humidities
+            'humidities': humidities,
+            'horizon': len(forecast),
+            'requested_days': days
         })
     else:
         return jsonify({'error': '数据不足'}), 400
@@ -251,16 +270,23 @@ def humidity_trend():
 def wind_trend():
     """获取风速趋势数据API"""
     city = request.args.get('city', 'Beijing')
-    days = request.args.get('days', 7, type=int)
+    try:
+        days = parse_forecast_days(request.args.get('days', 7), current_app.config.get('PREDICTOR_MAX_HORIZON', 30))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    predictor = AdvancedPredictor()
-    if predictor.train_model(city):
-        forecast = predictor.predict_7days()
+    try:
+        forecast = forecast_store.get(city, days)
+    except ForecastPending:
+        return jsonify({'status': 'pending', 'message': '预测正在生成，请稍后重试'}), 202
+    if forecast:
         dates = [day['date'] for day in forecast]
         wind_speeds = [day['wind_speed'] for day in forecast]
         return jsonify({
             'dates': dates,
-            'wind_speeds': wind_speeds
+            'wind_speeds': wind_speeds,
+            'horizon': len(forecast),
+            'requested_days': days
         })
     else:
         return jsonify({'error': '数据不足'}), 400
@@ -268,15 +294,19 @@ def wind_trend():
 @weather_bp.route('/api/weather/city_comparison')
 def city_comparison():
     """获取城市对比数据API"""
-    days = request.args.get('days', 7, type=int)
+    try:
+        days = parse_forecast_days(request.args.get('days', 7), current_app.config.get('PREDICTOR_MAX_HORIZON', 30))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    cities = ['Beijing', 'Shanghai', 'Guangzhou', 'Shenzhen']
+    cities = city_registry.names()
     result = {}
 
+    # 一次查询读取所有城市预计算的预测
+    forecasts = forecast_store.get_many(cities, days)
     for city in cities:
-        predictor = AdvancedPredictor()
-        if predictor.train_model(city):
-            forecast = predictor.predict_7days()
+        forecast = forecasts.get(city)
+        if forecast:
             # 计算平均值
             avg_temp = sum(day['temperature'] for day in forecast) / len(forecast)
             avg_humidity = sum(day['humidity'] for day in forecast) / len(forecast)
@@ -285,7 +315,8 @@ def city_comparison():
             result[city] = {
                 'temperature': round(avg_temp, 1),
                 'humidity': round(avg_humidity, 1),
-                'wind_speed': round(avg_wind, 1)
+                'wind_speed': round(avg_wind, 1),
+                'horizon': len(forecast)
             }
 
     return jsonify(result)
\ No newline at end of file
@@ -1,165 +1,313 @@
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 from datetime import datetime, timedelta
+from flask import current_app, has_app_context
 import logging
+import os
 import random
 from app.extensions import db  # 导入全局 db
-from app.models import WeatherData
+from app.utils.recent_buffer import recent_buffer, daily_means, VALUE_COLUMNS
+from app.models import WeatherData, WeatherDaily
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# 每个预测天数至少需要的训练样本数，数据较少时缩短模型能预测的天数
+MIN_TRAINING_SAMPLES = 14
+
+
+def parse_forecast_days(days, max_days=30):
+    """校验请求的预测天数，超过 max_days 时截断，不是正整数时抛出 ValueError"""
+    try:
+        value = int(days)
+    except (TypeError, ValueError):
+        value = 0
+    if value < 1:
+        raise ValueError(f"无效的预测天数: {days}")
+    return min(value, max_days)
+
+
+def build_lag_features(values, timestamps, lags=7, horizon=1):
+    """用滑动窗口构造训练数据
+
+    values 为按天升序的 (n, 3) 数组（温度、湿度、风速），timestamps 为对应的 datetime64 数组。
+    每个样本的特征为前 lags 天的数据（按天依次排列）加上预测第一天的月份和日期，
+    目标为之后连续 horizon 天的三项数据（按天依次排列）。
+    返回 (X, y)，形状分别为 (n - lags - horizon + 1, lags * 3 + 2) 和 (n - lags - horizon + 1, horizon * 3)。
+    """
+    columns = values.shape[1]
+    samples = len(values) - lags - horizon + 1
+    if samples <= 0:
+        return np.empty((0, lags * columns + 2)), np.empty((0, horizon * columns))
+
+    # (n - lags + 1, 1, lags, 3) 的窗口视图，只保留之后还有 horizon 天目标的窗口，展平
+    lagged = sliding_window_view(values, (lags, columns))[:samples, 0].reshape(samples, -1)
+    targets = sliding_window_view(values[lags:], (horizon, columns))[:samples, 0].reshape(samples, -1)
+
+    target_dates = timestamps[lags:lags + samples]
+    months = target_dates.astype('datetime64[M]')
+    month = months.astype(np.int64) % 12 + 1
+    day = (target_dates.astype('datetime64[D]') - months.astype('datetime64[D]')).astype(np.int64) + 1
+
+    X = np.column_stack([lagged, month, day])
+    return X, targets
+
+
+# 模型布局：每个模型负责的字段（温度、湿度、风速的下标），每个模型同时预测所有天数
+MODEL_LAYOUTS = {
+    'joint': ((0, 1, 2),),  # 一个多输出模型同时预测三项
+    'separate': ((0,), (1,), (2,)),  # 每项一个模型
+}
+
+
 class AdvancedPredictor:
-    def __init__(self, city):
+    # 模型结构的版本，结构变化后旧版本保存的模型不再加载
+    MODEL_VERSION = 4
+
+    def __init__(self, city, lags=None, training_days=None, layout=None, n_estimators=None, n_jobs=None,
+                 max_horizon=None):
         self.city = city
-        # 使用更强大的模型
-        self.model_temp = RandomForestRegressor(n_estimators=100, random_state=42)
-        self.model_humidity = RandomForestRegressor(n_estimators=100, random_state=42)
-        self.model_wind = RandomForestRegressor(n_estimators=100, random_state=42)
+        config = current_app.config if has_app_context() else {}
+        # 使用前 lags 天的数据预测下一天，训练数据取最近 training_days 天
+        self.lags = lags or config.get('PREDICTOR_LAGS', 7)
+        self.training_days = training_days or config.get('PREDICTOR_TRAINING_DAYS', 90)
+        # 直接预测未来 1..horizon 天，horizon 不超过 max_horizon，训练数据较少时更短
+        self.max_horizon = max_horizon or config.get('PREDICTOR_MAX_HORIZON', 30)
+        self.horizon = 1
+        self.layout = layout or config.get('PREDICTOR_MODEL_LAYOUT', 'joint')
+        if self.layout not in MODEL_LAYOUTS:
+            raise ValueError(f"不支持的模型布局: {self.layout}")
+        # 训练线程数不超过CPU核数，多个 web worker 同时训练时不会超额占用CPU
+        self.n_jobs = max(1, min(n_jobs or config.get('PREDICTOR_N_JOBS', 2), os.cpu_count() or 1))
+        n_estimators = n_estimators or config.get('PREDICTOR_N_ESTIMATORS', 100)
+        # 增量更新时用最近 update_window 个样本（包括上次训练以来的全部新样本）训练 update_trees 棵新树，替换最旧的树
+        self.update_trees = min(config.get('PREDICTOR_UPDATE_TREES', 10), n_estimators)
+        self.update_window = config.get('PREDICTOR_UPDATE_WINDOW', 60)
+        self.models = [
+            (fields, RandomForestRegressor(n_estimators=n_estimators, random_state=42, n_jobs=self.n_jobs))
+            for fields in MODEL_LAYOUTS[self.layout]
+        ]
+        # 目标标准化参数，多输出模型按标准化后的误差分裂，各项的权重相同
+        self.y_mean = np.zeros(len(VALUE_COLUMNS))
+        self.y_scale = np.ones(len(VALUE_COLUMNS))
+
+    def _targets(self, fields):
+        """字段在 (horizon * 3) 目标向量中的下标"""
+        return [h * len(VALUE_COLUMNS) + field for h in range(self.horizon) for field in fields]
+
+    def fit(self, X, y):
+        """用特征矩阵 X 和 (n, horizon * 3) 的目标训练所有模型"""
+        self.horizon = y.shape[1] // len(VALUE_COLUMNS)
+        self.y_mean = y.mean(axis=0)
+        self.y_scale = np.where(y.std(axis=0) > 0, y.std(axis=0), 1.0)
+        scaled = (y - self.y_mean) / self.y_scale
+        for fields, model in self.models:
+            targets = self._targets(fields)
+            model.set_params(n_jobs=self.n_jobs)
+            model.fit(X, scaled[:, targets] if len(targets) > 1 else scaled[:, targets[0]])
+            # 推理每次只有几行，多线程的调度开销大于收益
+            model.set_params(n_jobs=1)
+
+    def predict_features(self, X):
+        """对特征矩阵的每一行预测未来 horizon 天的三项数据，返回 (m, horizon, 3) 数组
+
+        联合模型只调用一次 predict，耗时与预测天数无关。
+        """
+        X = np.asarray(X, dtype=np.float64).reshape(-1, self.lags * len(VALUE_COLUMNS) + 2)
+        output = np.empty((len(X), self.horizon * len(VALUE_COLUMNS)))
+        for fields, model in self.models:
+            targets = self._targets(fields)
+            output[:, targets] = model.predict(X).reshape(len(X), len(targets))
+        output = output * self.y_scale + self.y_mean
+        return output.reshape(len(X), self.horizon, len(VALUE_COLUMNS))
+
+    def _query_columns(self, model, *criteria, descending=False, limit=None):
+        """直接查询列数据并转换为数组，不构造 ORM 对象"""
+        stmt = db.select(model.timestamp, *(getattr(model, column) for column in VALUE_COLUMNS)) \
+            .where(model.city == self.city, *criteria) \
+            .order_by(model.timestamp.desc() if descending else model.timestamp.asc())
+        if limit:
+            stmt = stmt.limit(limit)
+        rows = db.session.execute(stmt).all()
+        if descending:
+            rows.reverse()
+
+        series = {'timestamp': np.array([row[0] for row in rows], dtype='datetime64[s]')}
+        values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), len(VALUE_COLUMNS))
+        series.update({column: values[:, i] for i, column in enumerate(VALUE_COLUMNS)})
+        return series
+
+    def _load_daily(self, days):
+        """最近 days 天每天的平均值（按时间升序），优先读取内存缓存，其次读取天汇总"""
+        daily = recent_buffer.daily(self.city, days)
+        if daily is not None:
+            return daily
+
+        start_date = datetime.now() - timedelta(days=days)
+        # 读取天汇总，每天一条；尚未生成汇总时把原始数据按天聚合
+        series = self._query_columns(WeatherDaily, WeatherDaily.timestamp >= start_date)
+        if not len(series['timestamp']):
+            series = daily_means(self._query_columns(WeatherData, WeatherData.timestamp >= start_date))
+        return series
+
+    def _recent_days(self, count):
+        """最近 count 天每天的平均值（按时间升序）"""
+        daily = recent_buffer.daily(self.city)
+        if daily is not None:
+            return {column: daily[column][-count:] for column in VALUE_COLUMNS}
+
+        series = self._query_columns(WeatherDaily, descending=True, limit=count)
+        if not len(series['timestamp']):
+            # 尚未生成汇总时读取原始数据最新的 count 个自然日，按天聚合
+            latest = db.session.query(db.func.max(WeatherData.timestamp)).filter(WeatherData.city == self.city).scalar()
+            if latest is not None:
+                start_date = datetime.combine(latest.date() - timedelta(days=count - 1), datetime.min.time())
+                series = daily_means(self._query_columns(WeatherData, WeatherData.timestamp >= start_date))
+        return series
 
     def train_model(self):
         """训练预测模型"""
         try:
-            # 获取90天数据
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=90)
-
-            data = db.session.query(WeatherData).filter(
-                WeatherData.city == self.city,
-                WeatherData.timestamp.between(start_date, end_date)
-            ).order_by(WeatherData.timestamp.asc()).all()
-
-            # 至少30条记录
-            if len(data) < 30:
-                logger.warning(f"{self.city}数据不足，使用简单预测")
-                return False
-
-            # 准备训练数据
-            X = []
-            y_temp = []
-            y_humidity = []
-            y_wind = []
-
-            # 使用前7天的数据预测下一天
-            for i in range(len(data) - 7 - 1):
-                features = []
-                # 添加前7天的数据
-                for j in range(7):
-                    features.append(data[i + j].temperature)
-                    features.append(data[i + j].humidity)
-                    features.append(data[i + j].wind_speed)
-
-                # 添加日期特征
-                date = data[i + 7].timestamp
-                features.append(date.month)  # 月份
-                features.append(date.day)  # 日期
-
-                X.append(features)
-                y_temp.append(data[i + 7].temperature)
-                y_humidity.append(data[i + 7].humidity)
-                y_wind.append(data[i + 7].wind_speed)
-
-            # 训练模型
-            self.model_temp.fit(X, y_temp)
-            self.model_humidity.fit(X, y_humidity)
-            self.model_wind.fit(X, y_wind)
-
-            return True
+            data = self._load_daily(self.training_days)
+            values = np.column_stack([data[column] for column in VALUE_COLUMNS])
+            return self.train_arrays(values, data['timestamp'])
         except Exception as e:
             logger.error(f"训练模型失败: {str(e)}")
             return False
 
+    def train_arrays(self, values, timestamps):
+        """用按天升序的 (n, 3) 数组和对应的 datetime64 时间戳训练，不访问数据库"""
+        # 至少30条记录
+        if len(values) < max(30, self.lags + 1):
+            logger.warning(f"{self.city}数据不足，使用简单预测")
+            return False
+
+        # 准备训练数据：使用前 lags 天的数据预测之后的 horizon 天
+        horizon = min(self.max_horizon, len(values) - self.lags - MIN_TRAINING_SAMPLES + 1)
+        X, y = build_lag_features(values, timestamps, self.lags, max(horizon, 1))
+
+        # 训练模型
+        self.fit(X, y)
+
+        return True
+
+    def update_model(self, since):
+        """增量训练：只读取 since（上次训练时的最新日期）以来的数据更新已训练的模型，返回是否成功"""
+        try:
+            # 新样本的特征和目标需要 since 之前 lags + horizon 天的数据，另外取 update_window 天构成最近样本窗口
+            days = (datetime.now() - datetime.strptime(since, '%Y-%m-%d')).days + self.lags + self.horizon \
+                + self.update_window + 1
+            data = self._load_daily(days)
+            values = np.column_stack([data[column] for column in VALUE_COLUMNS])
+            return self.update_arrays(values, data['timestamp'], since)
+        except Exception as e:
+            logger.error(f"增量训练失败: {str(e)}")
+            return False
+
+    def update_arrays(self, values, timestamps, since):
+        """用最近的样本训练 update_trees 棵新树（warm start），并丢弃同样数量的最旧的树
+
+        since 为上次训练时数据的最新日期（当天的数据可能已经补全，因此包括当天），
+        目标包含 since 当天及之后观测的样本为新样本。新树使用最近 update_window 个样本（新样本更多时使用全部新样本），
+        每天更新时新样本只有一两个，只用新样本训练的树只能记住这几个值，多次更新后预测会偏向最近的观测。
+        树的总数不变，耗时只与新树数量和窗口大小有关，与历史数据长度无关。
+        预测天数和目标标准化参数沿用上次完整训练的结果，由定期的完整训练修正漂移。
+        没有新样本时返回False。
+        """
+        X, y = build_lag_features(values, timestamps, self.lags, self.horizon)
+        # 每个样本最后一个目标日期，晚于等于 since 的样本包含上次训练之后的观测（样本按时间升序）
+        target_end = timestamps[self.lags + self.horizon - 1:][:len(X)].astype('datetime64[D]')
+        new = int(np.count_nonzero(target_end >= np.datetime64(since, 'D')))
+        if not new:
+            return False
+        window = max(new, self.update_window)
+        X, y = X[-window:], y[-window:]
+
+        scaled = (y - self.y_mean) / self.y_scale
+        for fields, model in self.models:
+            targets = self._targets(fields)
+            trees = len(model.estimators_)
+            # 新树使用新的随机种子，否则每次更新的树与被替换的树抽样方式相同
+            model.set_params(warm_start=True, n_estimators=trees + self.update_trees,
+                             random_state=None, n_jobs=self.n_jobs)
+            model.fit(X, scaled[:, targets] if len(targets) > 1 else scaled[:, targets[0]])
+            model.estimators_ = model.estimators_[self.update_trees:]
+            model.set_params(warm_start=False, n_estimators=trees, n_jobs=1)
+        return True
+
     def predict_7days(self):
         """预测未来7天天气"""
+        return self.forecast(7)
+
+    def forecast(self, days=7):
+        """预测未来 days 天天气（不超过模型的 horizon），所有天数一次推理得到"""
         try:
-            # 获取最近7天数据
-            recent_data = db.session.query(WeatherData).filter_by(
-                city=self.city).order_by(WeatherData.timestamp.desc()).limit(7).all()
+            # 获取最近 lags 天数据（按时间升序，与训练特征的顺序一致）
+            recent_data = self._recent_days(self.lags)
+        except Exception as e:
+            logger.error(f"读取{self.city}最近数据失败: {str(e)}")
+            return self._default_forecast(min(days, self.horizon))
+        return self.forecast_from(recent_data, days)
 
-            if len(recent_data) < 7:
-                # 尝试获取可用的数据
-                available_data = recent_data if recent_data else []
+    def forecast_from(self, recent_data, days=7):
+        """用最近 lags 天的数据 {'temperature': ..., 'humidity': ..., 'wind_speed': ...} 预测，不访问数据库"""
+        try:
+            if days > self.horizon:
+                logger.info(f"{self.city}的历史数据只够预测{self.horizon}天，请求{days}天")
+            days = min(days, self.horizon)
+            recent_data = {column: np.asarray(recent_data[column], dtype=np.float64) for column in VALUE_COLUMNS}
+            available = len(recent_data['temperature'])
 
+            if available < self.lags:
                 # 如果数据不足但有一些历史数据，尝试使用可用数据预测
-                if available_data:
-                    logger.info(f"使用部分数据 ({len(available_data)}天) 进行预测")
-
-                    # 填充缺失数据
-                    while len(available_data) < 7:
-                        # 添加默认数据
-                        default_data = WeatherData(
-                            city=self.city,
-                            temperature=25.0,
-                            humidity=60.0,
-                            wind_speed=3.0,
-                            timestamp=datetime.now() - timedelta(days=7 - len(available_data))
-                        )
-                        available_data.append(default_data)
+                if available:
+                    logger.info(f"使用部分数据 ({available}天) 进行预测")
+
+                    # 用默认数据填充缺失的较早天数
+                    for column, default in zip(VALUE_COLUMNS, (25.0, 60.0, 3.0)):
+                        recent_data[column] = np.concatenate([
+                            np.full(self.lags - available, default), recent_data[column]])
 
                 else:
                     # 完全无数据时使用简单预测
                     logger.warning(f"{self.city}无数据，使用默认预测")
-                    return self._default_forecast()
+                    return self._default_forecast(days)
 
-            # 准备输入数据
-            X = []
-            for data in recent_data:
-                X.append(data.temperature)
-                X.append(data.humidity)
-                X.append(data.wind_speed)
-
-            # 获取当前日期
+            # 准备输入数据：每天依次为温度、湿度、风速，加上预测第一天的月份和日期
             current_date = datetime.now()
+            first_day = current_date + timedelta(days=1)
+            features = np.column_stack([recent_data[column] for column in VALUE_COLUMNS]).ravel().tolist()
+            features.extend([first_day.month, first_day.day])
+
+            # 一次推理得到所有天数
+            predicted = self.predict_features(features)[0, :days]
+
+            # 添加随机波动使数据更真实
+            predicted = predicted + np.random.uniform(-1, 1, predicted.shape) * [0.5, 1, 0.1]
+
+            # 确保数据在合理范围内
+            predicted = np.clip(predicted, [-20, 0, 0], [40, 100, 20])
 
-            # 生成预测
             predictions = []
-            for i in range(7):
-                # 创建特征向量
-                features = X.copy()
-
-                # 添加日期特征
-                future_date = current_date + timedelta(days=i + 1)
-                features.append(future_date.month)
-                features.append(future_date.day)
-
-                # 预测下一天
-                temp = self.model_temp.predict([features])[0]
-                humidity = self.model_humidity.predict([features])[0]
-                wind = self.model_wind.predict([features])[0]
-
-                # 添加随机波动使数据更真实
-                temp += np.random.uniform(-0.5, 0.5)
-                humidity += np.random.uniform(-1, 1)
-                wind += np.random.uniform(-0.1, 0.1)
-
-                # 确保数据在合理范围内
-                temp = max(min(temp, 40), -20)
-                humidity = max(min(humidity, 100), 0)
-                wind = max(min(wind, 20), 0)
-
-                # 添加到预测结果
-                date_str = future_date.strftime('%Y-%m-%d')
+            for i, (temp, humidity, wind) in enumerate(predicted.tolist()):
                 predictions.append({
-                    'date': date_str,
+                    'date': (current_date + timedelta(days=i + 1)).strftime('%Y-%m-%d'),
                     'temperature': round(temp, 1),
                     'humidity': round(humidity, 1),
                     'wind_speed': round(wind, 1),
                     'condition': self.get_weather_condition(temp)
                 })
 
-                # 更新输入数据
-                X = X[3:]  # 移除最旧的一天
-                X.extend([temp, humidity, wind])  # 添加新预测的一天
-
             return predictions
         except Exception as e:
             logger.error(f"预测失败: {str(e)}")
             # 返回默认预测
-            return self._default_forecast()
+            return self._default_forecast(days)
 
-    def _default_forecast(self):
+    def _default_forecast(self, days=7):
         """默认预测 - 基于季节的合理预测"""
         # 获取当前月份
         current_month = datetime.now().month
@@ -180,7 +328,7 @@ class AdvancedPredictor:
             'humidity': round(60 + random.uniform(-10, 10), 1),
             'wind_speed': round(3.0 + random.uniform(-1, 1), 1),
             'condition': self.get_weather_condition(base_temp)
-        } for i in range(7)]
+        } for i in range(days)]
 
     def get_weather_condition(self, temperature):
         """根据温度确定天气状况"""
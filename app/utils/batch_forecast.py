@@ -0,0 +1,192 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import groupby
+from multiprocessing.shared_memory import SharedMemory
+from operator import itemgetter
+
+import numpy as np
+
+from app.extensions import db
+from app.models import WeatherData, WeatherDaily
+from app.utils.advanced_predictor import AdvancedPredictor
+from app.utils.city_registry import city_registry
+from app.utils.forecast_store import forecast_store
+from app.utils.model_registry import ModelEntry, ModelRegistry
+from app.utils.recent_buffer import VALUE_COLUMNS, daily_means
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 工作进程中挂载的共享内存数组
+_shared = {}
+
+
+def load_training_arrays(cities, training_days=90, session=None, chunk_size=500):
+    """读取城市最近 training_days 天的每日数据（每 chunk_size 个城市一次查询）
+
+    优先读取天汇总；没有天汇总的城市（汇总尚未生成）把原始数据按天聚合，与 AdvancedPredictor._load_daily 一致。
+    返回 (values, timestamps, segments)：values 为 (n, 3) 数组，timestamps 为 datetime64[s] 数组，
+    按 (城市, 时间) 排序；segments 为 {城市: (起始行, 结束行, 数据版本)}，数据版本与 ModelRegistry.fingerprint 一致。
+    """
+    session = session or db.session
+    start_date = datetime.now() - timedelta(days=training_days)
+    cities = sorted(set(cities))
+    parts = {}
+
+    for i in range(0, len(cities), chunk_size):
+        rows = session.execute(
+            db.select(WeatherDaily.city, WeatherDaily.timestamp, WeatherDaily.count,
+                      *(getattr(WeatherDaily, column) for column in VALUE_COLUMNS))
+            .where(WeatherDaily.city.in_(cities[i:i + chunk_size]), WeatherDaily.timestamp >= start_date)
+            .order_by(WeatherDaily.city, WeatherDaily.timestamp)
+        ).all()
+        for city, group in groupby(rows, key=itemgetter(0)):
+            group = list(group)
+            values = np.array([row[3:] for row in group], dtype=np.float64).reshape(len(group), len(VALUE_COLUMNS))
+            timestamps = np.array([row.timestamp for row in group], dtype='datetime64[s]')
+            fingerprint = (int(sum(row.count for row in group)), group[-1].timestamp.strftime('%Y-%m-%d'))
+            parts[city] = (values, timestamps, fingerprint)
+
+    missing = [city for city in cities if city not in parts]
+    for i in range(0, len(missing), chunk_size):
+        # 逐个城市聚合，内存中只保留一个城市的原始数据
+        rows = session.execute(
+            db.select(WeatherData.city, WeatherData.timestamp,
+                      *(getattr(WeatherData, column) for column in VALUE_COLUMNS))
+            .where(WeatherData.city.in_(missing[i:i + chunk_size]), WeatherData.timestamp >= start_date)
+            .order_by(WeatherData.city, WeatherData.timestamp)
+            .execution_options(yield_per=10000)
+        )
+        for city, group in groupby(rows, key=itemgetter(0)):
+            group = list(group)
+            raw = np.array([row[2:] for row in group], dtype=np.float64).reshape(len(group), len(VALUE_COLUMNS))
+            series = {'timestamp': np.array([row.timestamp for row in group], dtype='datetime64[s]')}
+            series.update({column: raw[:, j] for j, column in enumerate(VALUE_COLUMNS)})
+            daily = daily_means(series)
+            values = np.column_stack([daily[column] for column in VALUE_COLUMNS])
+            parts[city] = (values, daily['timestamp'], (len(group), group[-1].timestamp.strftime('%Y-%m-%d')))
+
+    segments = {}
+    offset = 0
+    for city in cities:
+        if city in parts:
+            values, _, fingerprint = parts[city]
+            segments[city] = (offset, offset + len(values), fingerprint)
+            offset += len(values)
+    ordered = [parts[city] for city in segments]
+    values = np.concatenate([part[0] for part in ordered]) if ordered else np.empty((0, len(VALUE_COLUMNS)))
+    timestamps = np.concatenate([part[1] for part in ordered]) if ordered else np.empty(0, dtype='datetime64[s]')
+    return values, timestamps, segments
+
+
+def _attach(name, size, options):
+    """工作进程初始化：挂载共享内存，按偏移量构造数组视图（不复制数据）"""
+    shm = SharedMemory(name=name)
+    _shared['shm'] = shm
+    _shared['values'] = np.ndarray((size, len(VALUE_COLUMNS)), dtype=np.float64, buffer=shm.buf)
+    _shared['timestamps'] = np.ndarray((size,), dtype='datetime64[s]', buffer=shm.buf,
+                                       offset=size * len(VALUE_COLUMNS) * 8)
+    _shared['options'] = options
+
+
+def _forecast_city(task):
+    """在工作进程中训练一个城市的模型并预测，返回 (城市, 预测, 训练秒数, 推理秒数)"""
+    city, start, end, fingerprint = task
+    options = _shared['options']
+    values = _shared['values'][start:end]
+    timestamps = _shared['timestamps'][start:end]
+
+    # 进程池已经按核数并行，每个模型只用一个线程
+    predictor = AdvancedPredictor(city, lags=options['lags'], training_days=options['training_days'],
+                                  layout=options['layout'], n_estimators=options['n_estimators'],
+                                  n_jobs=1, max_horizon=options['max_horizon'])
+    start_time = time.perf_counter()
+    if not predictor.train_arrays(values, timestamps):
+        return city, None, time.perf_counter() - start_time, 0.0
+    train_seconds = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    recent = {column: values[-predictor.lags:, i] for i, column in enumerate(VALUE_COLUMNS)}
+    forecast = predictor.forecast_from(recent, predictor.horizon)
+    predict_seconds = time.perf_counter() - start_time
+
+    # 模型直接在工作进程中保存，Web 进程的模型仓库按数据版本从磁盘加载
+    if options['model_dir']:
+        try:
+            ModelRegistry(model_dir=options['model_dir'])._save(city, ModelEntry(predictor, fingerprint, time.time()))
+        except Exception as e:
+            logger.error(f"保存{city}的模型失败: {str(e)}")
+    return city, forecast, train_seconds, predict_seconds
+
+
+def run_batch_forecast(config, cities=None, workers=None, save_models=True, session=None):
+    """用进程池为多个城市训练模型并预测，结果写入 Forecast 表
+
+    cities 默认为城市索引中所有启用的城市，天汇总和原始数据都没有的城市记为 no_data。
+    训练数据读出后放入共享内存，工作进程按偏移量读取，不经过 pickle 传输；
+    返回 (每个城市的结果列表, 汇总统计)。
+    """
+    workers = workers or config.get('FORECAST_WORKERS') or os.cpu_count() or 1
+    training_days = config.get('PREDICTOR_TRAINING_DAYS', 90)
+    options = {
+        'lags': config.get('PREDICTOR_LAGS', 7),
+        'training_days': training_days,
+        'layout': config.get('PREDICTOR_MODEL_LAYOUT', 'joint'),
+        'n_estimators': config.get('PREDICTOR_N_ESTIMATORS', 100),
+        'max_horizon': config.get('PREDICTOR_MAX_HORIZON', 30),
+        'model_dir': config.get('MODEL_DIR', 'models') if save_models else None,
+    }
+
+    cities = list(cities) if cities else city_registry.names()
+    start_time = time.perf_counter()
+    values, timestamps, segments = load_training_arrays(cities, training_days, session)
+    load_seconds = time.perf_counter() - start_time
+
+    missing = [city for city in dict.fromkeys(cities) if city not in segments]
+    results = [{'city': city, 'status': 'no_data', 'train_ms': 0.0, 'predict_ms': 0.0} for city in missing]
+    forecasts = {}
+
+    if segments:
+        size = len(values)
+        shm = SharedMemory(create=True, size=values.nbytes + timestamps.nbytes)
+        try:
+            np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+            np.ndarray(timestamps.shape, dtype=timestamps.dtype, buffer=shm.buf, offset=values.nbytes)[:] = timestamps
+
+            tasks = [(city, start, end, fingerprint) for city, (start, end, fingerprint) in segments.items()]
+            chunksize = max(1, len(tasks) // (workers * 4))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                     initargs=(shm.name, size, options)) as executor:
+                for city, forecast, train_seconds, predict_seconds in executor.map(
+                        _forecast_city, tasks, chunksize=chunksize):
+                    if forecast:
+                        forecasts[city] = forecast
+                    results.append({
+                        'city': city,
+                        'status': 'success' if forecast else 'insufficient_data',
+                        'train_ms': round(train_seconds * 1000, 1),
+                        'predict_ms': round(predict_seconds * 1000, 1),
+                    })
+        finally:
+            shm.close()
+            shm.unlink()
+
+    if forecasts:
+        forecast_store.save_many(forecasts, session)
+
+    elapsed = time.perf_counter() - start_time
+    cpu_seconds = sum(result['train_ms'] + result['predict_ms'] for result in results) / 1000
+    summary = {
+        'cities': len(results),
+        'succeeded': len(forecasts),
+        'workers': workers,
+        'load_seconds': round(load_seconds, 3),
+        'total_seconds': round(elapsed, 3),
+        'model_seconds': round(cpu_seconds, 3),
+        'parallel_speedup': round(cpu_seconds / elapsed, 2) if elapsed else 0.0,
+    }
+    return results, summary
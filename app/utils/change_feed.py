@@ -0,0 +1,99 @@
+import base64
+from datetime import timedelta
+
+from app.extensions import db
+from app.models import WeatherData
+
+# 变更数据的字段（按此顺序输出）
+FEED_COLUMNS = ('id', 'city', 'timestamp', 'temperature', 'humidity', 'wind_speed')
+
+_CURSOR_PREFIX = 'wd1:'
+
+
+def encode_feed_cursor(last_id):
+    """将已读取的最大 id 编码为不透明游标"""
+    return base64.urlsafe_b64encode(f'{_CURSOR_PREFIX}{last_id}'.encode()).decode()
+
+
+def decode_feed_cursor(cursor):
+    """解析游标，空游标表示从头开始，格式错误时抛出 ValueError"""
+    if not cursor:
+        return 0
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode()).decode()
+        if not value.startswith(_CURSOR_PREFIX):
+            raise ValueError
+        return int(value[len(_CURSOR_PREFIX):])
+    except Exception:
+        raise ValueError(f"无效的变更游标: {cursor}")
+
+
+def _database_now(session):
+    """数据库当前时间，所有进程以同一个时钟判断可见性"""
+    return session.execute(db.select(db.func.now())).scalar()
+
+
+def read_changes(cursor=None, limit=1000, session=None, lag=10):
+    """读取游标之后新写入的 WeatherData（所有城市），返回 (行列表, 下一个游标, 是否还有更多)
+
+    游标基于自增主键，按主键顺序读取，只走主键索引。
+    主键在插入时分配、提交后才可见，并发写入时较大的 id 可能先于较小的 id 可见；
+    因此只返回写入时间早于 lag 秒前的行，遇到第一条更新的行即停止，
+    较小 id 所在的事务在 lag 秒内提交，游标就不会越过尚未可见的数据。
+    就地更新的数据（同一城市同一时间桶再次写入）保持原 id，不会重复出现在变更中；
+    已归档的数据不在热表中，下游需要在保留期内拉取。
+    """
+    session = session or db.session
+    last_id = decode_feed_cursor(cursor)
+    table = WeatherData.__table__
+    cutoff = _database_now(session) - timedelta(seconds=lag)
+
+    rows = session.execute(
+        db.select(*(table.c[column] for column in FEED_COLUMNS), table.c.ingested_at)
+        .where(table.c.id > last_id)
+        .order_by(table.c.id)
+        .limit(limit + 1)
+    ).all()
+
+    # 截断到第一条尚未稳定的行，之后的行下次再读
+    for i, row in enumerate(rows):
+        if row.ingested_at > cutoff:
+            rows = rows[:i]
+            break
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_feed_cursor(rows[-1].id if rows else last_id)
+    return rows, next_cursor, has_more
+
+
+def safe_head_id(session=None, lag=10, page_size=1000):
+    """写入时间早于 lag 秒前的最大 id，不大于它的数据都已可见"""
+    session = session or db.session
+    table = WeatherData.__table__
+    cutoff = _database_now(session) - timedelta(seconds=lag)
+
+    # 从最新的数据往前按主键翻页，通常第一页就能找到
+    upper = None
+    while True:
+        stmt = db.select(table.c.id, table.c.ingested_at).order_by(table.c.id.desc()).limit(page_size)
+        if upper is not None:
+            stmt = stmt.where(table.c.id < upper)
+        rows = session.execute(stmt).all()
+        for row in rows:
+            if row.ingested_at <= cutoff:
+                return row.id
+        if len(rows) < page_size:
+            return 0
+        upper = rows[-1].id
+
+
+def head_cursor(session=None, lag=10):
+    """当前可安全续读位置的游标，用于全量导出后从此处开始增量拉取"""
+    return encode_feed_cursor(safe_head_id(session, lag))
+
+
+def serialize_change(row):
+    """将一行变更转换为紧凑的列表，顺序与 FEED_COLUMNS 一致"""
+    return [row.id, row.city, row.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            row.temperature, row.humidity, row.wind_speed]
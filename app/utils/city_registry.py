@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+
+from app.extensions import db
+from app.models import City
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 初始城市数据，City 表为空时写入
+DEFAULT_CITIES = [
+    {'name': 'Beijing', 'openweathermap_id': 1816670, 'weatherbit_id': 1816670,
+     'latitude': 39.9042, 'longitude': 116.4074},
+    {'name': 'Shanghai', 'openweathermap_id': 1796236, 'weatherbit_id': 1796236,
+     'latitude': 31.2304, 'longitude': 121.4737},
+    {'name': 'Guangzhou', 'openweathermap_id': 1809858, 'weatherbit_id': 1809858,
+     'latitude': 23.1291, 'longitude': 113.2644},
+    {'name': 'Shenzhen', 'openweathermap_id': 1795565, 'weatherbit_id': 1795565,
+     'latitude': 22.5431, 'longitude': 114.0579},
+]
+
+CITY_FIELDS = ('name', 'openweathermap_id', 'weatherbit_id', 'latitude', 'longitude')
+
+
+class CityRegistry:
+    """进程级城市索引
+
+    启动时从 City 表加载所有启用的城市到内存，路由和采集器直接读取内存索引，不再逐请求查询。
+    每隔 refresh_interval 秒用一次聚合查询检查表是否变化（行数与最大 updated_at），变化时重新加载；
+    本进程内修改城市后调用 refresh() 立即生效。
+    """
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._cities = {}
+        self._names = []
+        self._version = None
+        self._checked_at = None
+
+    def configure(self, config):
+        """根据应用配置设置刷新间隔"""
+        self.refresh_interval = config.get('CITY_REGISTRY_REFRESH_INTERVAL', self.refresh_interval)
+
+    def _fetch_version(self, session):
+        return tuple(session.query(db.func.count(City.id), db.func.max(City.updated_at)).one())
+
+    def load(self, session=None):
+        """从数据库加载城市索引，表为空时写入初始城市"""
+        session = session or db.session
+        with self._lock:
+            if not session.query(City.id).first():
+                session.execute(City.__table__.insert(), DEFAULT_CITIES)
+                session.commit()
+                logger.info(f"City 表为空，已写入{len(DEFAULT_CITIES)}个初始城市")
+
+            version = self._fetch_version(session)
+            cities = session.query(City).filter_by(active=True).order_by(City.id).all()
+            self._cities = {city.name: {field: getattr(city, field) for field in CITY_FIELDS} for city in cities}
+            self._names = [city.name for city in cities]
+            self._version = version
+            self._checked_at = time.monotonic()
+            logger.info(f"城市索引已加载: {len(self._names)}个城市")
+
+    def refresh(self, session=None):
+        """立即重新加载城市索引"""
+        self.load(session)
+
+    def _ensure_loaded(self):
+        """首次访问时加载；超过刷新间隔时检查数据库是否有变化"""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+            return
+
+        try:
+            if self._checked_at is None:
+                self.load()
+                return
+
+            self._checked_at = now
+            if self._fetch_version(db.session) != self._version:
+                self.load()
+        except Exception as e:
+            logger.error(f"加载城市索引失败: {str(e)}")
+            if not self._names:
+                # 数据库不可用时使用初始城市，保证服务可用
+                self._cities = {city['name']: dict(city) for city in DEFAULT_CITIES}
+                self._names = [city['name'] for city in DEFAULT_CITIES]
+            self._checked_at = now
+
+    def names(self):
+        """返回所有启用城市的名称列表"""
+        self._ensure_loaded()
+        return list(self._names)
+
+    def get(self, name):
+        """返回城市信息，不存在时返回None"""
+        self._ensure_loaded()
+        return self._cities.get(name)
+
+    def __contains__(self, name):
+        self._ensure_loaded()
+        return name in self._cities
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._names)
+
+    def provider_ids(self):
+        """返回 {城市: {数据源: 城市ID}}，只包含配置了数据源ID的城市"""
+        self._ensure_loaded()
+        return {
+            name: {'openweathermap': city['openweathermap_id'], 'weatherbit': city['weatherbit_id']}
+            for name, city in self._cities.items()
+            if city['openweathermap_id'] or city['weatherbit_id']
+        }
+
+    def upsert_city(self, name, **fields):
+        """新增或更新城市，并立即刷新本进程的索引"""
+        city = City.query.filter_by(name=name).first()
+        if not city:
+            city = City(name=name)
+            db.session.add(city)
+        for field, value in fields.items():
+            if value is not None:
+                setattr(city, field, value)
+        city.active = True
+        db.session.commit()
+        self.refresh()
+        return city
+
+    def deactivate_city(self, name):
+        """停用城市，并立即刷新本进程的索引；城市不存在时返回False"""
+        city = City.query.filter_by(name=name).first()
+        if not city:
+            return False
+        city.active = False
+        db.session.commit()
+        self.refresh()
+        return True
+
+
+# 进程级共享的城市索引
+city_registry = CityRegistry()
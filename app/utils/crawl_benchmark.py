@@ -0,0 +1,77 @@
+import logging
+import time
+
+import numpy as np
+
+from app.extensions import db
+from app.models import Forecast, WeatherData, WeatherDaily, WeatherHourly
+from app.utils.crawl_engine import AsyncCrawlEngine
+from app.utils.ingest_writer import IngestWriter
+from app.utils.provider_stub import ProviderStubServer
+from app.utils.weather_crawler import WeatherService
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 基准测试使用的虚拟城市名前缀，测试结束后据此清理数据
+BENCH_CITY_PREFIX = 'bench-'
+
+
+def run_crawl_benchmark(config, cities=1000, latency=0.05, error_rate=0.0, timeout_rate=0.0,
+                        concurrency=None, batch_size=None, keep_data=False):
+    """使用本地模拟数据源测试采集吞吐量，返回统计结果字典
+
+    统计项：每秒采集城市数、单城市获取延迟的 p50/p99、实际请求数以及数据库写入速率。
+    """
+    stub = ProviderStubServer(latency=latency, error_rate=error_rate, timeout_rate=timeout_rate,
+                              timeout_seconds=config.get('CRAWL_DEADLINE', 10) * 2).start()
+    try:
+        service = WeatherService()
+        service.base_urls = stub.base_urls
+        service.city_ids = {
+            f"{BENCH_CITY_PREFIX}{i:05d}": {'openweathermap': 9000000 + i, 'weatherbit': 9000000 + i}
+            for i in range(cities)
+        }
+
+        engine = AsyncCrawlEngine.from_config(config, service=service)
+        if concurrency:
+            engine.concurrency = concurrency
+        if batch_size is not None:
+            engine.batch_size = batch_size
+
+        # 获取阶段
+        start_time = time.perf_counter()
+        fetched = engine.fetch(list(service.city_ids))
+        fetch_seconds = time.perf_counter() - start_time
+
+        latencies = np.array([time_cost for _, _, time_cost in fetched]) * 1000
+        remote = sum(1 for _, data, _ in fetched if data and data['source'] in ('openweathermap', 'weatherbit'))
+
+        # 写入阶段
+        writer = IngestWriter.from_config(config)
+        writer.add_many([data for _, data, _ in fetched if data])
+        writer.flush()
+        write_stats = writer.stats()
+
+        return {
+            'cities': cities,
+            'remote_success': remote,
+            'fallback': cities - remote,
+            'provider_requests': stub.request_count,
+            'fetch_seconds': round(fetch_seconds, 3),
+            'cities_per_sec': round(cities / fetch_seconds, 1) if fetch_seconds else 0.0,
+            'latency_p50_ms': round(float(np.percentile(latencies, 50)), 1),
+            'latency_p99_ms': round(float(np.percentile(latencies, 99)), 1),
+            'latency_max_ms': round(float(latencies.max()), 1),
+            'db_rows_written': write_stats['rows_written'],
+            'db_rows_per_sec': write_stats['rows_per_sec'],
+            'db_flush_latency_ms': round(write_stats['last_flush_latency'] * 1000, 1)
+        }
+    finally:
+        stub.stop()
+        if not keep_data:
+            # 写入回调会为虚拟城市生成汇总和预测，一并清理
+            for model in (WeatherData, WeatherHourly, WeatherDaily, Forecast):
+                model.query.filter(model.city.like(f"{BENCH_CITY_PREFIX}%")).delete(synchronize_session=False)
+            db.session.commit()
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from app.utils.provider_router import provider_router
+from app.utils.weather_crawler import WeatherService
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def build_crawl_result(city, data, saved, time_cost):
+    """构造单个城市的采集结果字典"""
+    if not data:
+        return {
+            'status': 'failed',
+            'city': city,
+            'reason': 'crawl_failed',
+            'time_cost': round(time_cost, 2)
+        }
+
+    if not saved:
+        return {
+            'status': 'failed',
+            'city': city,
+            'reason': 'save_failed',
+            'time_cost': round(time_cost, 2)
+        }
+
+    return {
+        'status': 'success',
+        'city': city,
+        'temperature': data['temperature'],
+        'humidity': data['humidity'],
+        'wind_speed': data['wind_speed'],
+        'timestamp': data['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+        'time_cost': round(time_cost, 2)
+    }
+
+
+class AsyncCrawlEngine:
+    """基于asyncio的并发采集引擎
+
+    所有请求共享一个保持长连接的连接池，全局并发数和每个数据源的并发数
+    分别由信号量限制，整体耗时取决于数据源延迟而不是城市数量。
+    每个城市的获取受 deadline 总时限约束；hedge_delay 大于0时启用对冲请求。
+    batch_size 大于0时优先使用数据源的批量(group)接口，N个城市只需 ceil(N / batch_size) 次请求。
+    """
+
+    def __init__(self, service=None, concurrency=200, provider_limits=None, timeout=15, retries=1,
+                 deadline=10, hedge_delay=0, batch_size=20):
+        self.service = service or WeatherService()
+        self.concurrency = concurrency
+        self.provider_limits = provider_limits or {}
+        self.timeout = timeout
+        self.retries = retries
+        self.deadline = deadline
+        self.hedge_delay = hedge_delay
+        self.batch_size = batch_size
+
+    @classmethod
+    def from_config(cls, config, service=None):
+        """根据应用配置创建采集引擎"""
+        return cls(
+            service=service,
+            concurrency=config.get('CRAWL_CONCURRENCY', 200),
+            provider_limits=config.get('CRAWL_PROVIDER_CONCURRENCY'),
+            timeout=config.get('CRAWL_TIMEOUT', 15),
+            retries=config.get('CRAWL_RETRIES', 1),
+            deadline=config.get('CRAWL_DEADLINE', 10),
+            hedge_delay=config.get('CRAWL_HEDGE_DELAY', 0),
+            batch_size=config.get('CRAWL_BATCH_SIZE', 20)
+        )
+
+    async def _fetch_provider(self, session, semaphore, provider, city, expires_at):
+        """从单个数据源获取数据，超时按配置重试，不越过截止时间"""
+        if not self.service.city_ids[city].get(provider):
+            return None
+
+        url = self.service.build_url(provider, city)
+
+        for attempt in range(self.retries + 1):
+            if expires_at - time.monotonic() <= 0 or not provider_router.allow(provider):
+                return None
+
+            start_time = time.monotonic()
+            try:
+                async with semaphore:
+                    remaining = expires_at - time.monotonic()
+                    if remaining <= 0:
+                        provider_router.release(provider)
+                        return None
+
+                    timeout = aiohttp.ClientTimeout(total=min(self.timeout, remaining), sock_connect=3.05)
+                    async with session.get(url, timeout=timeout) as response:
+                        payload = await response.json(content_type=None)
+
+                data = self.service.parse_response(provider, city, payload)
+                provider_router.record(provider, time.monotonic() - start_time, bool(data))
+                if not data:
+                    logger.warning(f"{provider} API返回无效数据: {city}")
+                return data
+            except asyncio.CancelledError:
+                # 对冲请求中落败的一方被取消，不计入失败统计
+                provider_router.release(provider)
+                raise
+            except asyncio.TimeoutError:
+                provider_router.record(provider, time.monotonic() - start_time, False)
+                logger.warning(f"{provider} API请求超时: {city} ({attempt + 1}/{self.retries + 1})")
+            except Exception as e:
+                provider_router.record(provider, time.monotonic() - start_time, False)
+                logger.error(f"{provider} API错误: {city} {str(e)}")
+                return None
+
+        return None
+
+    async def _fetch_batch(self, session, limiter, semaphore, provider, cities):
+        """发送一次批量请求，返回 {城市: (数据, 耗时)}，失败返回空字典"""
+        async with limiter:
+            if not provider_router.allow(provider):
+                return {}
+
+            start_time = time.monotonic()
+            try:
+                async with semaphore:
+                    timeout = aiohttp.ClientTimeout(total=min(self.timeout, self.deadline), sock_connect=3.05)
+                    async with session.get(self.service.build_batch_url(provider, cities), timeout=timeout) as response:
+                        payload = await response.json(content_type=None)
+
+                results = self.service.parse_batch_response(provider, cities, payload)
+                time_cost = time.monotonic() - start_time
+                provider_router.record(provider, time_cost, bool(results))
+                if len(results) < len(cities):
+                    logger.warning(f"{provider} 批量请求缺少{len(cities) - len(results)}个城市的数据")
+                return {city: (data, time_cost) for city, data in results.items()}
+            except asyncio.CancelledError:
+                provider_router.release(provider)
+                raise
+            except Exception as e:
+                provider_router.record(provider, time.monotonic() - start_time, False)
+                logger.error(f"{provider} 批量请求失败: {str(e)}")
+                return {}
+
+    async def _chained_fetch(self, session, semaphores, providers, city, expires_at):
+        """依次尝试各数据源，剩余时间在未尝试的数据源之间平均分配"""
+        for index, provider in enumerate(providers):
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                break
+
+            slice_end = time.monotonic() + remaining / (len(providers) - index)
+            data = await self._fetch_provider(session, semaphores[provider], provider, city, slice_end)
+            if data:
+                return data
+
+        return None
+
+    async def _hedged_fetch(self, session, semaphores, providers, city, expires_at):
+        """对冲请求：当前请求在 hedge_delay 内没有返回有效数据时，并行请求下一个数据源"""
+        queue = iter(providers)
+        pending = set()
+
+        def launch():
+            provider = next(queue, None)
+            if provider:
+                pending.add(asyncio.ensure_future(
+                    self._fetch_provider(session, semaphores[provider], provider, city, expires_at)))
+
+        launch()
+        try:
+            while pending:
+                remaining = expires_at - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                done, pending = await asyncio.wait(
+                    pending, timeout=min(self.hedge_delay, remaining), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result():
+                        return task.result()
+
+                launch()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return None
+
+    async def _fetch_city(self, session, limiter, semaphores, city):
+        """按健康评分尝试各数据源，返回 (城市, 数据, 耗时)"""
+        start_time = time.time()
+        if city not in self.service.city_ids:
+            return city, None, 0.0
+
+        async with limiter:
+            providers = provider_router.ranked()
+            expires_at = time.monotonic() + self.deadline
+
+            if self.hedge_delay and len(providers) > 1:
+                data = await self._hedged_fetch(session, semaphores, providers, city, expires_at)
+            else:
+                data = await self._chained_fetch(session, semaphores, providers, city, expires_at)
+
+        return city, data, time.time() - start_time
+
+    async def fetch_all(self, cities):
+        """并发获取所有城市数据，结果顺序与输入一致"""
+        limiter = asyncio.Semaphore(self.concurrency)
+        semaphores = {
+            provider: asyncio.Semaphore(self.provider_limits.get(provider, self.concurrency))
+            for provider in provider_router.providers
+        }
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=30, ttl_dns_cache=300)
+
+        async with aiohttp.ClientSession(connector=connector) as session:
+            # 先发送批量请求，缺失的城市再逐个获取
+            batched = {}
+            provider = next((p for p in provider_router.ranked() if p in self.service.BATCH_PROVIDERS), None)
+            if provider and self.batch_size:
+                supported = [city for city in cities
+                             if city in self.service.city_ids and self.service.city_ids[city].get(provider)]
+                batches = self.service.split_batches(provider, supported, self.batch_size)
+                for result in await asyncio.gather(*(
+                    self._fetch_batch(session, limiter, semaphores[provider], provider, batch) for batch in batches
+                )):
+                    batched.update(result)
+
+            async def resolve(city):
+                if city in batched:
+                    return (city,) + batched[city]
+                return await self._fetch_city(session, limiter, semaphores, city)
+
+            return await asyncio.gather(*(resolve(city) for city in cities))
+
+    def fetch(self, cities):
+        """同步入口：并发获取数据，远程数据源全部失败时使用本地后备"""
+        fetched = []
+        for city, data, time_cost in asyncio.run(self.fetch_all(cities)):
+            if not data and city in self.service.city_ids:
+                start_time = time.time()
+                data = self.service._local_fallback(city)
+                time_cost += time.time() - start_time
+            fetched.append((city, data, time_cost))
+        return fetched
+
+    def crawl(self, cities, writer=None):
+        """采集并保存所有城市数据，返回每个城市的结果字典
+
+        所有城市的数据通过一次批量写入保存；传入 writer 时只加入其缓冲，由调用方决定写入时机。
+        """
+        fetched = self.fetch(cities)
+
+        start_time = time.time()
+        error = None
+        try:
+            saved = self.service.save_many_to_db([data for _, data, _ in fetched], writer=writer)
+        except Exception as e:
+            saved, error = False, str(e)
+        save_cost = time.time() - start_time
+
+        results = []
+        for city, data, time_cost in fetched:
+            if error:
+                results.append({
+                    'status': 'error',
+                    'city': city,
+                    'reason': error,
+                    'time_cost': round(time_cost + save_cost, 2)
+                })
+            else:
+                results.append(build_crawl_result(city, data, saved, time_cost + save_cost))
+        return results
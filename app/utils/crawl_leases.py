@@ -0,0 +1,186 @@
+import logging
+import math
+import os
+import random
+import socket
+import time
+import uuid
+import zlib
+from datetime import timedelta
+
+from app.extensions import db
+from app.models import CrawlLease, CrawlWorker
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def partition_of(city, partitions):
+    """城市所属的分区，使用稳定哈希保证所有进程计算结果一致"""
+    return zlib.crc32(city.encode('utf-8')) % partitions
+
+
+def default_worker_id():
+    """默认的采集进程标识：主机名-进程号-随机后缀"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class LeaseManager:
+    """基于数据库租约的采集分片
+
+    城市按稳定哈希划分到固定数量的分区，每个分区在 CrawlLease 表中有一行租约。
+    每个采集进程定期在 CrawlWorker 表写入心跳，并调用 rebalance()：
+    续约已持有的分区；持有数超过公平份额 ceil(分区数 / 存活进程数) 时释放多余分区；
+    不足时通过条件 UPDATE 抢占无主或已过期的分区。进程退出或崩溃后租约在 lease_ttl 秒内过期，
+    由其他进程接管；新进程加入后，已有进程在下一次 rebalance 时让出多余分区。
+    租约的过期时间和比较都使用数据库时间，不受各主机时钟偏差影响；本地另外记录续约截止时间，
+    超过 lease_ttl 秒没有成功续约时 owns() 不再认为持有任何分区。
+    """
+
+    def __init__(self, worker_id=None, partitions=64, lease_ttl=30, session=None):
+        self.worker_id = worker_id or default_worker_id()
+        self.partitions = partitions
+        self.lease_ttl = lease_ttl
+        self.session = session
+        self.owned = set()
+        # 本地单调时钟的续约截止时间，从发起续约前开始计算，早于数据库中的过期时间
+        self._deadline = float('-inf')
+
+    @classmethod
+    def from_config(cls, config, worker_id=None):
+        """根据应用配置创建租约管理器"""
+        return cls(
+            worker_id=worker_id,
+            partitions=config.get('CRAWL_SHARD_PARTITIONS', 64),
+            lease_ttl=config.get('CRAWL_LEASE_TTL', 30)
+        )
+
+    @property
+    def _session(self):
+        return self.session or db.session
+
+    def _database_now(self):
+        return self._session.execute(db.select(db.func.now())).scalar()
+
+    def owns(self, city):
+        """当前进程是否负责采集该城市（超过续约截止时间后视为已失去所有分区）"""
+        if time.monotonic() >= self._deadline:
+            return False
+        return partition_of(city, self.partitions) in self.owned
+
+    def ensure_partitions(self):
+        """补齐租约表中缺少的分区行"""
+        session = self._session
+        existing = {row[0] for row in session.query(CrawlLease.partition).all()}
+        missing = [{'partition': p} for p in range(self.partitions) if p not in existing]
+        if missing:
+            try:
+                session.execute(CrawlLease.__table__.insert(), missing)
+                session.commit()
+            except Exception:
+                # 其他进程已同时写入
+                session.rollback()
+
+    def heartbeat(self, now):
+        """写入心跳，返回当前存活的进程数"""
+        session = self._session
+        worker = session.get(CrawlWorker, self.worker_id)
+        if worker:
+            worker.heartbeat_at = now
+        else:
+            session.add(CrawlWorker(id=self.worker_id, heartbeat_at=now))
+
+        # 清理长时间没有心跳的进程
+        session.query(CrawlWorker).filter(
+            CrawlWorker.heartbeat_at < now - timedelta(seconds=self.lease_ttl * 10)
+        ).delete(synchronize_session=False)
+        session.commit()
+
+        return session.query(CrawlWorker).filter(
+            CrawlWorker.heartbeat_at >= now - timedelta(seconds=self.lease_ttl)
+        ).count()
+
+    def rebalance(self):
+        """续约、释放多余分区并抢占不足的分区，返回当前持有的分区集合"""
+        session = self._session
+        table = CrawlLease.__table__
+        started = time.monotonic()
+
+        try:
+            now = self._database_now()
+            expires_at = now + timedelta(seconds=self.lease_ttl)
+            live_workers = max(self.heartbeat(now), 1)
+            fair_share = math.ceil(self.partitions / live_workers)
+
+            # 续约仍然有效的租约，已被他人接管的分区不再计入
+            session.execute(table.update().where(
+                table.c.owner == self.worker_id, table.c.expires_at >= db.func.now()
+            ).values(expires_at=expires_at))
+            owned = [row[0] for row in session.query(CrawlLease.partition).filter(
+                CrawlLease.owner == self.worker_id, CrawlLease.expires_at >= expires_at
+            ).order_by(CrawlLease.partition).all()]
+
+            if len(owned) > fair_share:
+                # 新进程加入后让出多余分区
+                released = owned[fair_share:]
+                session.execute(table.update().where(
+                    table.c.partition.in_(released), table.c.owner == self.worker_id
+                ).values(owner=None, expires_at=None))
+                owned = owned[:fair_share]
+            elif len(owned) < fair_share:
+                # 抢占无主或已过期的分区（包括已崩溃进程持有的分区）
+                candidates = [row[0] for row in session.query(CrawlLease.partition).filter(
+                    db.or_(CrawlLease.owner.is_(None), CrawlLease.expires_at < db.func.now())
+                ).all()]
+                random.shuffle(candidates)
+                for partition in candidates:
+                    if len(owned) >= fair_share:
+                        break
+                    result = session.execute(table.update().where(
+                        table.c.partition == partition,
+                        db.or_(table.c.owner.is_(None), table.c.expires_at < db.func.now())
+                    ).values(owner=self.worker_id, expires_at=expires_at))
+                    if result.rowcount == 1:
+                        owned.append(partition)
+
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"分区租约更新失败: {str(e)}")
+            # 无法续约时只保留尚未过期的分区，避免与接管者重复采集
+            return self.owned
+
+        if set(owned) != self.owned:
+            logger.info(f"[{self.worker_id}] 持有分区 {len(owned)}/{self.partitions}"
+                        f"（存活进程{live_workers}个，公平份额{fair_share}）")
+        self.owned = set(owned)
+        self._deadline = started + self.lease_ttl
+        return self.owned
+
+    def release_all(self):
+        """释放全部租约并注销进程，用于正常退出"""
+        session = self._session
+        table = CrawlLease.__table__
+        try:
+            session.execute(table.update().where(table.c.owner == self.worker_id).values(owner=None, expires_at=None))
+            session.query(CrawlWorker).filter_by(id=self.worker_id).delete(synchronize_session=False)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"释放分区租约失败: {str(e)}")
+        self.owned = set()
+        self._deadline = float('-inf')
+
+    def status(self):
+        """返回存活进程及各自持有的分区数"""
+        now = self._database_now()
+        workers = {w.id: w.heartbeat_at for w in self._session.query(CrawlWorker).all()}
+        counts = dict(self._session.query(CrawlLease.owner, db.func.count(CrawlLease.partition)).filter(
+            CrawlLease.owner.isnot(None), CrawlLease.expires_at >= now
+        ).group_by(CrawlLease.owner).all())
+        return {
+            worker_id: {'heartbeat_at': heartbeat_at.strftime('%Y-%m-%d %H:%M:%S'),
+                        'partitions': counts.get(worker_id, 0)}
+            for worker_id, heartbeat_at in workers.items()
+        }
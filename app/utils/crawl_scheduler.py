@@ -0,0 +1,192 @@
+import heapq
+import logging
+import random
+import signal
+import threading
+import time
+
+from flask import current_app
+
+from app.utils.city_registry import city_registry
+from app.utils.crawl_engine import AsyncCrawlEngine
+from app.utils.forecast_store import forecast_store
+from app.utils.ingest_writer import IngestWriter
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CrawlScheduler:
+    """常驻定时采集调度器
+
+    每个城市按各自的刷新间隔独立排期，到期的城市合并为一轮交给异步采集引擎，
+    数据通过缓冲写入器批量入库。下次采集时间叠加 ±jitter 比例的随机抖动，
+    首次采集时间在一个间隔内随机分布，避免所有城市同时请求数据源。
+    收到 SIGINT/SIGTERM 后完成当前一轮、写入缓冲数据后退出。
+    传入 lease_manager 时只采集本进程持有租约的分区内的城市，多个进程可以共同分担采集任务。
+    precompute_forecasts 为 True 时，数据入库后在后台线程中为有新数据的城市预计算预测。
+    """
+
+    def __init__(self, config, interval=600, jitter=0.1, city_intervals=None, max_batch=500, tick=1.0,
+                 lease_manager=None, precompute_forecasts=False):
+        self.config = config
+        self.interval = interval
+        self.jitter = jitter
+        self.city_intervals = city_intervals or {}
+        self.max_batch = max_batch
+        self.tick = tick
+        self.lease_manager = lease_manager
+        self.precompute_forecasts = precompute_forecasts
+        self._rebalanced_at = None
+        self.writer = IngestWriter.from_config(config)
+        self.cycles = 0
+        self._queue = []
+        self._scheduled = set()
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_config(cls, config, **overrides):
+        """根据应用配置创建调度器，命令行参数可覆盖配置"""
+        options = {
+            'interval': config.get('CRAWL_DAEMON_INTERVAL', 600),
+            'jitter': config.get('CRAWL_DAEMON_JITTER', 0.1),
+            'city_intervals': config.get('CRAWL_DAEMON_CITY_INTERVALS', {}),
+            'max_batch': config.get('CRAWL_DAEMON_MAX_BATCH', 500),
+            'precompute_forecasts': config.get('FORECAST_PRECOMPUTE_IN_DAEMON', False),
+        }
+        options.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(config, **options)
+
+    def city_interval(self, city):
+        """城市的刷新间隔(秒)"""
+        return self.city_intervals.get(city, self.interval)
+
+    def _next_due(self, city, now):
+        interval = self.city_interval(city)
+        return now + interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def sync_cities(self, cities):
+        """将新增城市加入排期，首次采集时间在一个间隔内随机分布"""
+        now = time.monotonic()
+        for city in cities:
+            if city not in self._scheduled:
+                self._scheduled.add(city)
+                heapq.heappush(self._queue, (now + random.uniform(0, self.city_interval(city)), city))
+
+    def pop_due(self, cities):
+        """取出所有已到期的城市（最多 max_batch 个），已停用的城市不再排期"""
+        now = time.monotonic()
+        active = set(cities)
+        due = []
+        while self._queue and self._queue[0][0] <= now and len(due) < self.max_batch:
+            _, city = heapq.heappop(self._queue)
+            if city in active:
+                due.append(city)
+            else:
+                self._scheduled.discard(city)
+        return due
+
+    def reschedule(self, cities):
+        now = time.monotonic()
+        for city in cities:
+            heapq.heappush(self._queue, (self._next_due(city, now), city))
+
+    def seconds_until_next(self):
+        if not self._queue:
+            return self.tick
+        return max(0.0, self._queue[0][0] - time.monotonic())
+
+    def run_cycle(self, cities):
+        """采集一轮到期城市，返回结果列表
+
+        启用分片时按采集引擎的并发数分批，每批发出前按需续约并跳过已不再持有的城市，
+        一轮耗时超过租约有效期时也不会与接管分区的进程重复采集。
+        """
+        start_time = time.time()
+        engine = AsyncCrawlEngine.from_config(self.config)
+        batch_size = engine.concurrency if self.lease_manager else max(len(cities), 1)
+        results, crawled = [], []
+        for i in range(0, len(cities), batch_size):
+            batch = cities[i:i + batch_size]
+            if self.lease_manager:
+                self._renew_leases()
+                owned = [city for city in batch if self.lease_manager.owns(city)]
+                # 失去分区的城市移出排期，重新持有时由 sync_cities 再加入
+                self._scheduled.difference_update(set(batch) - set(owned))
+                batch = owned
+            if batch:
+                results.extend(engine.crawl(batch, writer=self.writer))
+                crawled.extend(batch)
+        self.reschedule(crawled)
+        self.cycles += 1
+
+        success = sum(1 for r in results if r['status'] == 'success')
+        logger.info(f"第{self.cycles}轮采集完成: {success}/{len(crawled)}个城市成功，"
+                    f"耗时{time.time() - start_time:.2f}秒")
+        return results
+
+    def active_cities(self):
+        """本进程负责采集的城市；启用分片时定期续约并重新分配分区"""
+        cities = city_registry.names()
+        if not self.lease_manager:
+            return cities
+
+        self._renew_leases()
+        return [city for city in cities if self.lease_manager.owns(city)]
+
+    def _renew_leases(self):
+        """距上次续约超过 lease_ttl/3 秒时续约并重新分配分区"""
+        now = time.monotonic()
+        if self._rebalanced_at is None or now - self._rebalanced_at >= self.lease_manager.lease_ttl / 3:
+            self.lease_manager.rebalance()
+            self._rebalanced_at = now
+
+    def stop(self, *args):
+        """请求停止，当前一轮完成后退出"""
+        if not self._stop.is_set():
+            logger.info("收到停止信号，正在完成当前采集并写入缓冲数据...")
+        self._stop.set()
+
+    def _install_signal_handlers(self):
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+
+    def run(self, once=False):
+        """运行调度循环；once=True 时立即采集所有城市一轮后退出"""
+        self._install_signal_handlers()
+        logger.info(f"采集守护进程启动: 间隔{self.interval}秒，抖动±{self.jitter:.0%}")
+        if self.lease_manager:
+            self.lease_manager.ensure_partitions()
+            logger.info(f"分片模式: 进程 {self.lease_manager.worker_id}，共{self.lease_manager.partitions}个分区")
+
+        try:
+            if once:
+                self.run_cycle(self.active_cities())
+                if self.precompute_forecasts:
+                    self.writer.flush()
+                    forecast_store.refresh_pending()
+                return
+
+            # 预计算在后台线程中进行，训练耗时不会推迟租约续期和到期城市的采集
+            if self.precompute_forecasts:
+                forecast_store.start_worker(current_app._get_current_object())
+
+            while not self._stop.is_set():
+                cities = self.active_cities()
+                self.sync_cities(cities)
+
+                due = self.pop_due(cities)
+                if due:
+                    self.run_cycle(due)
+
+                self.writer.flush_if_due()
+                self._stop.wait(min(self.seconds_until_next(), self.tick))
+        finally:
+            self.writer.flush()
+            if self.precompute_forecasts:
+                forecast_store.stop_worker(timeout=self.tick)
+            if self.lease_manager:
+                self.lease_manager.release_all()
+            logger.info(f"采集守护进程已退出，写入统计: {self.writer.stats()}")
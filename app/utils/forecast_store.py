@@ -0,0 +1,251 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.models import Forecast, ForecastQueue
+from app.utils.ingest_writer import build_upsert
+from app.utils.model_registry import model_registry
+from app.utils.single_flight import SingleFlight
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ForecastPending(Exception):
+    """城市还没有可用的预测，已加入预计算队列"""
+
+
+class ForecastStore:
+    """预计算的预测结果
+
+    每个城市的未来 horizon 天预测由采集守护进程在数据入库后（或 flask precompute-forecasts 定时）
+    在后台线程中计算一次，连同生成时间写入 Forecast 表；预测、趋势和对比接口只按城市索引读取一行并截取所需天数。
+    请求中从不训练：预测超过 max_age 秒时仍返回已有结果，还没有预测时抛出 ForecastPending；
+    两种情况都把城市写入 ForecastQueue 表，由守护进程的后台线程或 flask precompute-forecasts 计算。
+    """
+
+    def __init__(self, horizon=30, max_age=21600, refresh_interval=3600, batch_size=50, queue_interval=60):
+        self.horizon = horizon
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self.queue_interval = queue_interval
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._refreshed_at = {}
+        self._queued_at = {}
+        self._flights = SingleFlight()
+        self._worker = None
+        self._worker_stop = None
+
+    def configure(self, config):
+        """根据应用配置设置预测天数、有效期和预计算间隔"""
+        self.horizon = config.get('PREDICTOR_MAX_HORIZON', self.horizon)
+        self.max_age = config.get('FORECAST_MAX_AGE', self.max_age)
+        self.refresh_interval = config.get('FORECAST_REFRESH_INTERVAL', self.refresh_interval)
+        self.batch_size = config.get('FORECAST_PRECOMPUTE_BATCH', self.batch_size)
+        self.queue_interval = config.get('FORECAST_QUEUE_INTERVAL', self.queue_interval)
+        with self._lock:
+            self._pending = set()
+            self._refreshed_at = {}
+            self._queued_at = {}
+
+    def save(self, city, forecast, session=None):
+        """保存城市的预测结果，已有结果时覆盖"""
+        self.save_many({city: forecast}, session)
+
+    def save_many(self, forecasts, session=None, chunk_size=500):
+        """批量保存 {城市: 预测}，每 chunk_size 个城市一条多行 INSERT，最后提交一次"""
+        session = session or db.session
+        stmt = build_upsert(session, Forecast.__table__, ('generated_at', 'horizon', 'payload'), ('city',))
+        generated_at = datetime.now()
+        rows = [{
+            'city': city,
+            'generated_at': generated_at,
+            'horizon': len(forecast),
+            'payload': json.dumps(forecast, ensure_ascii=False)
+        } for city, forecast in forecasts.items()]
+        for i in range(0, len(rows), chunk_size):
+            session.execute(stmt, rows[i:i + chunk_size])
+        session.commit()
+
+    def compute(self, city, session=None):
+        """计算并保存城市的预测，数据不足时返回None"""
+        return self._flights.do(city, self._compute, city, session)
+
+    def _compute(self, city, session):
+        forecast = model_registry.forecast(city, self.horizon)
+        session = session or db.session
+        if forecast:
+            self.save(city, forecast, session)
+        elif session.execute(db.select(Forecast.id).where(Forecast.city == city)).first() is None:
+            # 数据不足时保存空预测，refresh_interval 内的请求直接返回数据不足而不再重复入队
+            self.save(city, [], session)
+        with self._lock:
+            self._refreshed_at[city] = time.monotonic()
+        return forecast
+
+    def _usable(self, row, days):
+        """从存储的预测中取出明天起的 days 天，返回 (预测, 是否需要重新计算)
+
+        没有预测或已没有未来的日期时预测为None；超过 max_age 秒或剩余天数不足时仍返回已有的部分。
+        返回的天数可能少于 days（模型受历史数据长度限制），调用方应把实际天数告知请求方。
+        """
+        if row is None:
+            return None, True
+        today = datetime.now().strftime('%Y-%m-%d')
+        forecast = [day for day in json.loads(row.payload) if day['date'] > today]
+        age = datetime.now() - row.generated_at
+        # 数据不足导致预测天数少于请求时，超过 refresh_interval 后重新计算（数据可能已经增加）
+        stale = age > timedelta(seconds=self.max_age) \
+            or len(forecast) < min(days, row.horizon) \
+            or (row.horizon < min(days, self.horizon) and age > timedelta(seconds=self.refresh_interval))
+        return forecast[:days] or None, stale
+
+    def _serve(self, row, days):
+        """返回 (预测, 是否加入预计算队列, 是否仍在等待计算)
+
+        没有预测行或已有预测全部过期时仍在等待；数据不足时保存的空预测返回 (None, ...) 但不在等待。
+        """
+        forecast, stale = self._usable(row, days)
+        pending = forecast is None and (row is None or row.horizon > 0)
+        return forecast, stale, pending
+
+    def schedule(self, cities, session=None):
+        """把城市写入 ForecastQueue 表，由守护进程或 flask precompute-forecasts 尽快计算（不受 refresh_interval 限制）
+
+        同一进程 queue_interval 秒内对同一城市只写入一次。
+        """
+        now = time.monotonic()
+        with self._lock:
+            cities = [city for city in dict.fromkeys(cities)
+                      if now - self._queued_at.get(city, float('-inf')) >= self.queue_interval]
+            self._queued_at.update((city, now) for city in cities)
+        if not cities:
+            return
+        session = session or db.session
+        stmt = build_upsert(session, ForecastQueue.__table__, ('requested_at',), ('city',))
+        requested_at = datetime.now()
+        session.execute(stmt, [{'city': city, 'requested_at': requested_at} for city in cities])
+        session.commit()
+
+    def get(self, city, days=7, session=None):
+        """读取城市未来 days 天的预测，数据不足时返回None，还没有预测时抛出 ForecastPending"""
+        session = session or db.session
+        row = session.execute(
+            db.select(Forecast.generated_at, Forecast.horizon, Forecast.payload).where(Forecast.city == city)
+        ).first()
+        forecast, stale, pending = self._serve(row, days)
+        if stale:
+            self.schedule([city], session)
+        if pending:
+            raise ForecastPending(city)
+        return forecast
+
+    def get_many(self, cities, days=7, session=None):
+        """一次查询读取多个城市的预测，返回 {城市: 预测}，数据不足或还没有预测的城市不包含在结果中"""
+        session = session or db.session
+        rows = {row.city: row for row in session.execute(
+            db.select(Forecast.city, Forecast.generated_at, Forecast.horizon, Forecast.payload)
+            .where(Forecast.city.in_(list(cities)))
+        )}
+
+        result, stale_cities = {}, []
+        for city in cities:
+            forecast, stale, _ = self._serve(rows.get(city), days)
+            if stale:
+                stale_cities.append(city)
+            if forecast:
+                result[city] = forecast
+        if stale_cities:
+            self.schedule(stale_cities, session)
+        return result
+
+    def precompute(self, cities, session=None):
+        """依次计算并保存各城市的预测，返回 (成功的城市数, 每个城市的耗时)
+
+        开始前把这些城市移出 ForecastQueue（计算失败的城市等下次请求再入队，不会反复重试）。
+        """
+        session = session or db.session
+        cities = list(cities)
+        session.execute(db.delete(ForecastQueue).where(ForecastQueue.city.in_(cities)))
+        session.commit()
+        timings = {}
+        succeeded = 0
+        for city in cities:
+            start_time = time.perf_counter()
+            try:
+                if self.compute(city, session):
+                    succeeded += 1
+            except Exception as e:
+                logger.error(f"预计算{city}的预测失败: {str(e)}")
+                session.rollback()
+            timings[city] = time.perf_counter() - start_time
+        return succeeded, timings
+
+    def mark_pending(self, rows, session=None):
+        """记录有新数据的城市，可注册为 IngestWriter 的写入回调"""
+        with self._lock:
+            self._pending.update(row['city'] for row in rows)
+
+    def refresh_pending(self, session=None):
+        """预计算 ForecastQueue 中请求的城市，以及有新数据且距上次计算超过 refresh_interval 秒的城市
+
+        每次最多 batch_size 个，队列中的城市按请求时间优先。
+        """
+        session = session or db.session
+        due = list(session.execute(
+            db.select(ForecastQueue.city).order_by(ForecastQueue.requested_at).limit(self.batch_size)
+        ).scalars())
+        now = time.monotonic()
+        with self._lock:
+            ready = [city for city in self._pending if city not in due
+                     and now - self._refreshed_at.get(city, float('-inf')) >= self.refresh_interval]
+            ready = sorted(ready, key=lambda city: self._refreshed_at.get(city, float('-inf')))
+            due += ready[:self.batch_size - len(due)]
+            self._pending.difference_update(due)
+        if not due:
+            return 0
+
+        start_time = time.time()
+        succeeded, _ = self.precompute(due, session)
+        logger.info(f"预计算{succeeded}/{len(due)}个城市的预测，耗时{time.time() - start_time:.2f}秒")
+        return succeeded
+
+    def start_worker(self, app, interval=1.0):
+        """启动后台预计算线程（每个进程最多一个），每隔 interval 秒处理一批待预计算的城市
+
+        只由采集守护进程启动，训练不阻塞采集循环（租约续期、到期采集）；Web 进程只写入 ForecastQueue。
+        """
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker_stop = threading.Event()
+            self._worker = threading.Thread(target=self._run_worker, args=(app, interval, self._worker_stop),
+                                            name='forecast-precompute', daemon=True)
+            self._worker.start()
+
+    def stop_worker(self, timeout=None):
+        """停止后台预计算线程，等待当前这批城市计算完成（最多 timeout 秒）"""
+        with self._lock:
+            worker, stop = self._worker, self._worker_stop
+            self._worker = None
+        if worker is not None:
+            stop.set()
+            worker.join(timeout)
+
+    def _run_worker(self, app, interval, stop):
+        while not stop.wait(interval):
+            try:
+                with app.app_context():
+                    self.refresh_pending()
+            except Exception as e:
+                logger.error(f"后台预计算失败: {str(e)}")
+
+
+# 进程级共享的预测结果存储
+forecast_store = ForecastStore()
@@ -0,0 +1,237 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from app.extensions import db
+from app.models import WeatherData
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 写入 WeatherData 表的字段
+INGEST_COLUMNS = ('city', 'temperature', 'humidity', 'wind_speed', 'timestamp')
+# 冲突时更新的字段
+UPSERT_COLUMNS = ('temperature', 'humidity', 'wind_speed')
+
+_EPOCH = datetime(1970, 1, 1)
+
+# 每次成功写入后调用的回调，参数为本次写入的行和所用的会话
+_flush_listeners = []
+
+
+def register_flush_listener(listener):
+    """注册写入回调，用于在数据入库后更新快照、汇总表等派生数据"""
+    if listener not in _flush_listeners:
+        _flush_listeners.append(listener)
+
+
+def bucket_timestamp(timestamp, bucket_seconds):
+    """将时间戳向下取整到所在时间桶的起点，同一城市同一时间桶内只保留一条数据"""
+    seconds = int((timestamp - _EPOCH).total_seconds())
+    if bucket_seconds > 1:
+        seconds -= seconds % bucket_seconds
+    return _EPOCH + timedelta(seconds=seconds)
+
+
+def build_upsert(session, table=None, update_columns=UPSERT_COLUMNS, index_elements=('city', 'timestamp')):
+    """按数据库方言构造唯一索引 index_elements 冲突时更新的批量插入语句，默认写入 WeatherData 表"""
+    table = WeatherData.__table__ if table is None else table
+    dialect = session.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        stmt = mysql.insert(table)
+        return stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in update_columns})
+    if dialect in ('sqlite', 'postgresql'):
+        stmt = (sqlite if dialect == 'sqlite' else postgresql).insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=list(index_elements),
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+    return table.insert()
+
+
+class IngestWriter:
+    """天气数据缓冲批量写入器
+
+    累积统一格式的观测数据，缓冲数量达到 batch_size 或距上次写入超过 flush_interval 秒时，
+    通过 SQLAlchemy Core 以多行 INSERT 一次性写入并提交，避免每条数据一个事务。
+    时间戳按 bucket_seconds 取整，(city, timestamp) 冲突时更新已有数据，重复写入是幂等的。
+    """
+
+    def __init__(self, batch_size=1000, flush_interval=5.0, bucket_seconds=600, session=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.bucket_seconds = bucket_seconds
+        self.session = session
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+        # 写入统计
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.flush_count = 0
+        self.flush_seconds = 0.0
+        self.last_flush_latency = 0.0
+        self._started_at = time.monotonic()
+
+    @classmethod
+    def from_config(cls, config, session=None):
+        """根据应用配置创建写入器"""
+        return cls(
+            batch_size=config.get('INGEST_BATCH_SIZE', 1000),
+            flush_interval=config.get('INGEST_FLUSH_INTERVAL', 5.0),
+            bucket_seconds=config.get('WEATHER_DEDUP_BUCKET_SECONDS', 600),
+            session=session
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def _normalize(self, record):
+        row = {column: record[column] for column in INGEST_COLUMNS}
+        row['timestamp'] = bucket_timestamp(row['timestamp'], self.bucket_seconds)
+        return row
+
+    def add(self, record):
+        """添加一条观测数据，达到阈值时自动写入"""
+        with self._lock:
+            self._buffer.append(self._normalize(record))
+        self.flush_if_due()
+
+    def add_many(self, records):
+        """添加多条观测数据，达到阈值时自动写入"""
+        with self._lock:
+            self._buffer.extend(self._normalize(record) for record in records)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """缓冲数量或时间达到阈值时写入，返回写入的行数"""
+        with self._lock:
+            due = len(self._buffer) >= self.batch_size \
+                or (self._buffer and time.monotonic() - self._last_flush >= self.flush_interval)
+        return self.flush() if due else 0
+
+    def flush(self):
+        """立即写入缓冲中的全部数据，返回写入的行数，失败返回0"""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+
+        if not rows:
+            return 0
+
+        # 同一批次内的重复数据只保留最后一条
+        rows = list({(row['city'], row['timestamp']): row for row in rows}.values())
+
+        session = self.session or db.session
+        start_time = time.monotonic()
+        try:
+            stmt = build_upsert(session)
+            for i in range(0, len(rows), self.batch_size):
+                session.execute(stmt, rows[i:i + self.batch_size])
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            self.rows_failed += len(rows)
+            logger.error(f"批量写入{len(rows)}条数据失败: {str(e)}")
+            return 0
+
+        latency = time.monotonic() - start_time
+        self.rows_written += len(rows)
+        self.flush_count += 1
+        self.flush_seconds += latency
+        self.last_flush_latency = latency
+        logger.info(f"批量写入{len(rows)}条数据，耗时{latency:.3f}秒")
+
+        for listener in _flush_listeners:
+            try:
+                listener(rows, session)
+            except Exception as e:
+                logger.error(f"写入回调执行失败: {str(e)}")
+        return len(rows)
+
+    @property
+    def pending(self):
+        """缓冲中尚未写入的行数"""
+        return len(self._buffer)
+
+    def stats(self):
+        """返回写入统计：总行数、写入速率和每次写入的延迟"""
+        elapsed = time.monotonic() - self._started_at
+        return {
+            'rows_written': self.rows_written,
+            'rows_failed': self.rows_failed,
+            'rows_pending': self.pending,
+            'flush_count': self.flush_count,
+            'rows_per_sec': round(self.rows_written / self.flush_seconds, 1) if self.flush_seconds else 0.0,
+            'wall_rows_per_sec': round(self.rows_written / elapsed, 1) if elapsed else 0.0,
+            'avg_flush_latency': round(self.flush_seconds / self.flush_count, 4) if self.flush_count else 0.0,
+            'last_flush_latency': round(self.last_flush_latency, 4)
+        }
+
+
+def compact_weather_data(bucket_seconds=600, chunk_size=1000, session=None):
+    """清理已有的重复数据：同一城市同一时间桶内只保留最新的一条，并将其时间戳取整到桶起点
+
+    按 (city, timestamp, id) 键集分页扫描，每页读取 chunk_size 行后立即删除和更新并提交，
+    内存占用只与 chunk_size 有关，返回 (删除行数, 更新行数)。
+    """
+    session = session or db.session
+    table = WeatherData.__table__
+    stmt = table.update().where(table.c.id == bindparam('row_id')).values(timestamp=bindparam('bucket'))
+
+    def apply(duplicates, updates):
+        # 先删除重复数据，再把保留的一条取整，避免与同一时间桶内尚未删除的数据冲突
+        if duplicates:
+            session.execute(table.delete().where(table.c.id.in_(duplicates)))
+        if updates:
+            session.execute(stmt, updates)
+        session.commit()
+
+    # 按 (city, timestamp) 排序后同一时间桶的数据相邻，只需记住上一条（跨页保留）
+    deleted = updated = 0
+    previous_key, previous = None, None
+    after = None
+    while True:
+        query = db.select(table.c.id, table.c.city, table.c.timestamp) \
+            .order_by(table.c.city, table.c.timestamp, table.c.id).limit(chunk_size)
+        if after is not None:
+            city, timestamp, row_id = after
+            query = query.where(db.or_(
+                table.c.city > city,
+                db.and_(table.c.city == city, table.c.timestamp > timestamp),
+                db.and_(table.c.city == city, table.c.timestamp == timestamp, table.c.id > row_id)
+            ))
+        rows = session.execute(query).all()
+        if not rows:
+            break
+
+        duplicates, updates = [], []
+        for row_id, city, timestamp in rows:
+            key = (city, bucket_timestamp(timestamp, bucket_seconds))
+            if key == previous_key:
+                duplicates.append(previous[0])
+            elif previous and previous[1] != previous_key[1]:
+                updates.append({'row_id': previous[0], 'bucket': previous_key[1]})
+            previous_key, previous = key, (row_id, timestamp)
+        # 已取整或删除的行都排在游标之前，不影响后续分页
+        after = tuple(rows[-1][1:]) + (rows[-1][0],)
+        apply(duplicates, updates)
+        deleted += len(duplicates)
+        updated += len(updates)
+
+    if previous and previous[1] != previous_key[1]:
+        apply([], [{'row_id': previous[0], 'bucket': previous_key[1]}])
+        updated += 1
+
+    logger.info(f"清理重复数据完成：删除{deleted}条，时间戳取整{updated}条")
+    return deleted, updated
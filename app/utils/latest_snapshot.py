@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from app.extensions import db
+from app.models import WeatherData
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 最新观测数据，字段与 WeatherData 一致，模板中可以直接按属性访问
+Observation = namedtuple('Observation', ('city', 'temperature', 'humidity', 'wind_speed', 'timestamp'))
+
+
+class LatestSnapshot:
+    """每个城市最新观测数据的进程内快照
+
+    一次分组取最大值的查询加载所有城市的最新数据，本进程写入数据后由写入器直接更新，
+    首页、仪表盘等页面读取快照，不再逐城市查询数据库。其他进程（如采集守护进程）写入的数据
+    在 ttl 秒后重新加载时可见。
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._loaded_at = None
+
+    def configure(self, config):
+        """根据应用配置设置过期时间"""
+        self.ttl = config.get('LATEST_SNAPSHOT_TTL', self.ttl)
+
+    def load(self):
+        """一次查询加载所有城市的最新观测"""
+        newest = db.session.query(
+            WeatherData.city, db.func.max(WeatherData.timestamp).label('timestamp')
+        ).group_by(WeatherData.city).subquery()
+
+        rows = db.session.query(
+            WeatherData.city, WeatherData.temperature, WeatherData.humidity,
+            WeatherData.wind_speed, WeatherData.timestamp
+        ).join(newest, db.and_(
+            WeatherData.city == newest.c.city, WeatherData.timestamp == newest.c.timestamp
+        )).all()
+
+        with self._lock:
+            self._latest = {row.city: Observation(*row) for row in rows}
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """清空快照，下次访问时重新加载（用于删除或批量修改数据之后）"""
+        with self._lock:
+            self._loaded_at = None
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+            try:
+                self.load()
+            except Exception as e:
+                logger.error(f"加载最新数据快照失败: {str(e)}")
+
+    def update(self, rows, session=None):
+        """写入数据后更新快照，rows 为统一格式的观测字典"""
+        with self._lock:
+            for row in rows:
+                current = self._latest.get(row['city'])
+                if current is None or row['timestamp'] >= current.timestamp:
+                    self._latest[row['city']] = Observation(**{field: row[field] for field in Observation._fields})
+
+    def get(self, city):
+        """返回城市的最新观测，没有数据时返回None"""
+        self._ensure_loaded()
+        return self._latest.get(city)
+
+    def latest(self):
+        """返回所有城市中最新的一条观测"""
+        self._ensure_loaded()
+        return max(self._latest.values(), key=lambda obs: obs.timestamp, default=None)
+
+
+# 进程级共享的最新数据快照
+latest_snapshot = LatestSnapshot()
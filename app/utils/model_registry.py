@@ -0,0 +1,277 @@
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import joblib
+
+from app.extensions import db
+from app.models import WeatherData, WeatherDaily
+from app.utils.advanced_predictor import AdvancedPredictor
+from app.utils.single_flight import SingleFlight
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ModelEntry:
+    """一个城市已训练的预测器及其训练时的数据版本
+
+    trained_at 为最近一次训练（包括增量更新）的时间，refit_at 为最近一次完整训练的时间，
+    replaced_trees 为完整训练之后增量更新累计替换的树数量。
+    """
+
+    __slots__ = ('predictor', 'fingerprint', 'trained_at', 'checked_at', 'refit_at', 'replaced_trees')
+
+    def __init__(self, predictor, fingerprint, trained_at, checked_at=None, refit_at=None, replaced_trees=0):
+        self.predictor = predictor
+        self.fingerprint = fingerprint
+        self.trained_at = trained_at
+        self.checked_at = checked_at
+        self.refit_at = refit_at or trained_at
+        self.replaced_trees = replaced_trees
+
+
+class ModelRegistry:
+    """按城市持久化的预测模型仓库
+
+    训练好的预测器用 joblib 保存到 {model_dir}/<城市>.joblib，并记录训练时的数据版本
+    （训练窗口内的观测条数和最新日期）。内存中按 LRU 保留最多 cache_size 个城市的模型。
+    只有新增观测达到 stale_rows 条、出现新的一天或模型超过 max_age 秒时才重新训练，
+    其余请求只做推理；其他进程训练保存的模型会从磁盘加载，不重复训练。
+    重新训练时，距上次完整训练不到 full_refit_interval 秒、且累计替换的树不超过 max_replaced_fraction 的模型
+    只用上次训练以来的新数据增量更新，否则完整训练。
+
+    同一城市的并发请求只检查/训练一次，相同 (城市, 天数, 数据版本) 的并发预测共享一次推理结果；
+    每个进程同时训练的模型不超过 max_training 个，等待超过 training_wait 秒时使用旧模型（没有则返回None）。
+    """
+
+    def __init__(self, model_dir='models', cache_size=32, stale_rows=144, max_age=86400,
+                 check_interval=60, training_days=90, max_training=1, training_wait=30,
+                 full_refit_interval=604800, max_replaced_fraction=0.5):
+        self.model_dir = model_dir
+        self.cache_size = cache_size
+        self.stale_rows = stale_rows
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self.training_days = training_days
+        self.max_training = max_training
+        self.training_wait = training_wait
+        self.full_refit_interval = full_refit_interval
+        self.max_replaced_fraction = max_replaced_fraction
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._flights = SingleFlight()
+        self._training_slots = threading.BoundedSemaphore(max_training)
+        self._training = 0
+        self._rejected = 0
+
+    def configure(self, config):
+        """根据应用配置设置模型目录、缓存大小和重新训练的阈值（会清空内存缓存）"""
+        with self._lock:
+            self.model_dir = config.get('MODEL_DIR', self.model_dir)
+            self.cache_size = config.get('MODEL_CACHE_SIZE', self.cache_size)
+            self.stale_rows = config.get('MODEL_STALE_ROWS', self.stale_rows)
+            self.max_age = config.get('MODEL_MAX_AGE', self.max_age)
+            self.check_interval = config.get('MODEL_CHECK_INTERVAL', self.check_interval)
+            self.training_days = config.get('PREDICTOR_TRAINING_DAYS', self.training_days)
+            self.max_training = config.get('MODEL_MAX_CONCURRENT_TRAINING', self.max_training)
+            self.training_wait = config.get('MODEL_TRAINING_WAIT', self.training_wait)
+            self.full_refit_interval = config.get('MODEL_FULL_REFIT_INTERVAL', self.full_refit_interval)
+            self.max_replaced_fraction = config.get('MODEL_MAX_REPLACED_FRACTION', self.max_replaced_fraction)
+            self._training_slots = threading.BoundedSemaphore(self.max_training)
+            self._cache = OrderedDict()
+
+    def model_path(self, city):
+        return os.path.join(self.model_dir, f"{quote(city, safe='')}.joblib")
+
+    def fingerprint(self, city, session=None):
+        """城市训练数据的版本：(观测条数, 最新日期)，优先读取天汇总"""
+        session = session or db.session
+        start_date = datetime.now() - timedelta(days=self.training_days)
+        observations, last_day = session.query(
+            db.func.sum(WeatherDaily.count), db.func.max(WeatherDaily.timestamp)
+        ).filter(WeatherDaily.city == city, WeatherDaily.timestamp >= start_date).one()
+
+        if observations is None:
+            observations, last_day = session.query(
+                db.func.count(WeatherData.id), db.func.max(WeatherData.timestamp)
+            ).filter(WeatherData.city == city, WeatherData.timestamp >= start_date).one()
+
+        last_day = last_day.strftime('%Y-%m-%d') if last_day else None
+        return int(observations or 0), last_day
+
+    def is_stale(self, entry, fingerprint):
+        """模型是否需要重新训练"""
+        observations, last_day = fingerprint
+        trained_observations, trained_last_day = entry.fingerprint
+        return last_day != trained_last_day \
+            or abs(observations - trained_observations) >= self.stale_rows \
+            or time.time() - entry.trained_at >= self.max_age
+
+    def _remember(self, city, entry):
+        with self._lock:
+            self._cache[city] = entry
+            self._cache.move_to_end(city)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _load(self, city):
+        path = self.model_path(city)
+        if not os.path.exists(path):
+            return None
+        try:
+            saved = joblib.load(path)
+            if saved.get('version') != AdvancedPredictor.MODEL_VERSION:
+                logger.info(f"{city}的模型版本已过时，重新训练")
+                return None
+            return ModelEntry(saved['predictor'], tuple(saved['fingerprint']), saved['trained_at'],
+                              refit_at=saved.get('refit_at'), replaced_trees=saved.get('replaced_trees', 0))
+        except Exception as e:
+            logger.error(f"加载{city}的模型失败: {str(e)}")
+            return None
+
+    def _save(self, city, entry):
+        os.makedirs(self.model_dir, exist_ok=True)
+        path = self.model_path(city)
+        tmp_path = f'{path}.tmp'
+        joblib.dump({
+            'version': AdvancedPredictor.MODEL_VERSION,
+            'predictor': entry.predictor,
+            'fingerprint': entry.fingerprint,
+            'trained_at': entry.trained_at,
+            'refit_at': entry.refit_at,
+            'replaced_trees': entry.replaced_trees
+        }, tmp_path)
+        os.replace(tmp_path, path)
+
+    def train(self, city, fingerprint=None, base=None):
+        """训练并保存城市的模型，数据不足或等待训练名额超时时返回None
+
+        传入旧模型 base 且可以增量更新（见 _can_update）时只用新数据更新。
+        """
+        fingerprint = fingerprint or self.fingerprint(city)
+        # configure() 会替换信号量，释放时必须使用获取时的同一个对象
+        slots = self._training_slots
+        if not slots.acquire(timeout=self.training_wait):
+            with self._lock:
+                self._rejected += 1
+            logger.warning(f"同时训练的模型已达上限({self.max_training})，{city}本次不训练")
+            return None
+        try:
+            with self._lock:
+                self._training += 1
+            return self._train(city, fingerprint, base)
+        finally:
+            with self._lock:
+                self._training -= 1
+            slots.release()
+
+    def _can_update(self, base, now):
+        """距完整训练不到 full_refit_interval 秒，且再替换一批树后累计不超过总数的 max_replaced_fraction"""
+        if base is None or base.fingerprint[1] is None or now - base.refit_at >= self.full_refit_interval:
+            return False
+        predictor = base.predictor
+        trees = predictor.models[0][1].n_estimators
+        return base.replaced_trees + predictor.update_trees <= trees * self.max_replaced_fraction
+
+    def _train(self, city, fingerprint, base=None):
+        start_time = time.time()
+        if self._can_update(base, start_time):
+            # 在副本上更新，正在使用旧模型推理的请求不受影响
+            predictor = copy.deepcopy(base.predictor)
+            if predictor.update_model(base.fingerprint[1]):
+                entry = ModelEntry(predictor, fingerprint, time.time(), time.monotonic(), refit_at=base.refit_at,
+                                   replaced_trees=base.replaced_trees + predictor.update_trees)
+                return self._store(city, entry, '增量更新', start_time)
+
+        predictor = AdvancedPredictor(city)
+        if not predictor.train_model():
+            return None
+        entry = ModelEntry(predictor, fingerprint, time.time(), time.monotonic())
+        return self._store(city, entry, '训练', start_time)
+
+    def _store(self, city, entry, mode, start_time):
+        try:
+            self._save(city, entry)
+        except Exception as e:
+            logger.error(f"保存{city}的模型失败: {str(e)}")
+        self._remember(city, entry)
+        logger.info(f"{city}模型{mode}完成，耗时{time.time() - start_time:.2f}秒，数据版本{entry.fingerprint}")
+        return entry
+
+    def entry(self, city):
+        """返回城市可直接用于推理的 ModelEntry，数据不足无法训练时返回None"""
+        with self._lock:
+            entry = self._cache.get(city)
+            if entry is not None:
+                self._cache.move_to_end(city)
+
+        # 距上次检查不到 check_interval 秒时直接使用内存中的模型
+        if entry is not None and time.monotonic() - entry.checked_at < self.check_interval:
+            return entry
+
+        # 同一城市的并发请求只检查/训练一次
+        return self._flights.do(('model', city), self._refresh, city, entry)
+
+    def _refresh(self, city, entry):
+        fingerprint = self.fingerprint(city)
+        if entry is None or self.is_stale(entry, fingerprint):
+            # 内存中没有或已过期时，先看磁盘上的模型（可能由其他进程训练）
+            saved = self._load(city)
+            if saved is not None and not self.is_stale(saved, fingerprint):
+                entry = saved
+            else:
+                # 训练失败或名额已满时继续使用旧模型
+                entry = self.train(city, fingerprint, base=saved or entry) or saved or entry
+                if entry is None:
+                    return None
+
+        entry.checked_at = time.monotonic()
+        self._remember(city, entry)
+        return entry
+
+    def get(self, city):
+        """返回城市可直接用于推理的预测器，数据不足无法训练时返回None"""
+        entry = self.entry(city)
+        return entry.predictor if entry is not None else None
+
+    def forecast(self, city, days=7):
+        """返回城市未来 days 天的预测，数据不足时返回None
+
+        相同城市、天数和模型数据版本的并发请求（如同一页面的温度/湿度/风速趋势）共享一次推理。
+        """
+        entry = self.entry(city)
+        if entry is None:
+            return None
+        key = ('forecast', city, days, entry.fingerprint, entry.trained_at)
+        return self._flights.do(key, entry.predictor.forecast, days)
+
+    def stats(self):
+        """内存中的模型数、正在训练的模型数和请求合并情况"""
+        with self._lock:
+            stats = {
+                'cached_models': len(self._cache),
+                'training': self._training,
+                'max_concurrent_training': self.max_training,
+                'training_rejected': self._rejected,
+            }
+        stats.update(self._flights.stats())
+        return stats
+
+    def invalidate(self, city=None):
+        """删除内存中的模型（city 为空时全部删除），下次访问时重新检查"""
+        with self._lock:
+            if city is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(city, None)
+
+
+# 进程级共享的模型仓库
+model_registry = ModelRegistry()
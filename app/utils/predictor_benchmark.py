@@ -0,0 +1,74 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.utils.advanced_predictor import AdvancedPredictor, build_lag_features
+from app.utils.recent_buffer import VALUE_COLUMNS
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def synthetic_daily(days=90, seed=0):
+    """生成带季节变化和噪声的逐日数据，返回 (values, timestamps)"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(days)
+    values = np.column_stack([
+        20 + 8 * np.sin(2 * np.pi * t / 365) + rng.normal(0, 2, days),
+        60 + 15 * np.sin(2 * np.pi * t / 30) + rng.normal(0, 5, days),
+        np.clip(3 + rng.normal(0, 1, days), 0, None),
+    ])
+    start = np.datetime64(datetime.now() - timedelta(days=days), 'D')
+    return values, (start + t).astype('datetime64[s]')
+
+
+def _measure(layout, n_jobs, X, y, lags, repeats, steps):
+    fit_times, predict_times = [], []
+    for _ in range(repeats):
+        predictor = AdvancedPredictor('benchmark', lags=lags, layout=layout, n_jobs=n_jobs)
+        start_time = time.perf_counter()
+        predictor.fit(X, y)
+        fit_times.append(time.perf_counter() - start_time)
+
+        # 与 forecast 相同：每次预测一行
+        start_time = time.perf_counter()
+        for i in range(steps):
+            predictor.predict_features(X[i % len(X)])
+        predict_times.append((time.perf_counter() - start_time) / steps)
+    return predictor, min(fit_times), min(predict_times)
+
+
+def run_predictor_benchmark(days=90, lags=7, horizon=7, repeats=3, steps=7, n_jobs=None):
+    """对比三个独立模型（单线程，原实现）与一个多输出模型的训练和推理耗时，返回统计结果字典
+
+    同时统计多输出模型用最近一周的新样本增量更新（PREDICTOR_UPDATE_TREES 棵新树）的耗时。
+
+    使用合成数据直接预测未来 horizon 天，最后 20% 的样本作为验证集比较两种布局的平均绝对误差。
+    """
+    values, timestamps = synthetic_daily(days)
+    X, y = build_lag_features(values, timestamps, lags, horizon)
+    split = int(len(X) * 0.8)
+
+    result = {'samples': len(X), 'features': X.shape[1], 'horizon': horizon}
+    for name, layout, jobs in (('separate', 'separate', 1), ('joint', 'joint', n_jobs)):
+        predictor, fit_seconds, predict_seconds = _measure(layout, jobs, X[:split], y[:split], lags, repeats, steps)
+        predicted = predictor.predict_features(X[split:]).reshape(-1, len(VALUE_COLUMNS))
+        error = np.abs(predicted - y[split:].reshape(-1, len(VALUE_COLUMNS))).mean(axis=0)
+        result.update({
+            f'{name}_n_jobs': predictor.n_jobs,
+            f'{name}_fit_ms': round(fit_seconds * 1000, 1),
+            f'{name}_predict_step_ms': round(predict_seconds * 1000, 2),
+            f'{name}_mae': [round(float(value), 2) for value in error],
+        })
+
+    # 增量更新（warm start）的耗时，与完整训练对比
+    start_time = time.perf_counter()
+    predictor.update_arrays(values, timestamps, timestamps[-7])
+    result['joint_update_ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+
+    result['fit_speedup'] = round(result['separate_fit_ms'] / result['joint_fit_ms'], 2)
+    result['predict_speedup'] = round(result['separate_predict_step_ms'] / result['joint_predict_step_ms'], 2)
+    return result
@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import deque
+
+# 远程数据源列表（默认优先级顺序）
+PROVIDERS = ('openweathermap', 'weatherbit')
+
+
+class CircuitBreaker:
+    """单个数据源的熔断器
+
+    closed: 正常放行；open: 冷却期内拒绝请求；half_open: 冷却结束后只放行一个探测请求，
+    探测成功则关闭熔断，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, cooldown=30):
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.probing = False
+
+    def allow_request(self, now):
+        """判断当前是否允许发送请求"""
+        if self.state == self.OPEN and now - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self.probing = False
+
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def is_available(self, now):
+        """不改变状态地判断数据源是否可被选择"""
+        if self.state == self.OPEN:
+            return now - self.opened_at >= self.cooldown
+        return not (self.state == self.HALF_OPEN and self.probing)
+
+    def open(self, now):
+        self.state = self.OPEN
+        self.opened_at = now
+        self.probing = False
+
+    def close(self):
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.probing = False
+
+
+class ProviderRouter:
+    """基于健康评分的数据源路由
+
+    为每个数据源记录最近 window_size 次请求的延迟和成功与否，错误率超过阈值时打开熔断器，
+    并按 平均延迟 × (1 + 错误率 × 惩罚系数) 从低到高排序，优先使用最健康的数据源。
+    超过 sample_ttl 秒的样本会被丢弃，长期未被选中的数据源因此有机会重新参与评分。
+    """
+
+    def __init__(self, providers=PROVIDERS, window_size=50, error_threshold=0.5,
+                 min_requests=5, cooldown=30, sample_ttl=300, error_penalty=10):
+        self.providers = list(providers)
+        self.window_size = window_size
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.sample_ttl = sample_ttl
+        self.error_penalty = error_penalty
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._samples = {p: deque(maxlen=self.window_size) for p in self.providers}
+        self._breakers = {p: CircuitBreaker(self.cooldown) for p in self.providers}
+        self._totals = {p: {'requests': 0, 'failures': 0, 'opened': 0} for p in self.providers}
+
+    def configure(self, config):
+        """根据应用配置重新设置路由参数（会清空已有统计）"""
+        with self._lock:
+            self.window_size = config.get('PROVIDER_WINDOW_SIZE', self.window_size)
+            self.error_threshold = config.get('PROVIDER_ERROR_THRESHOLD', self.error_threshold)
+            self.min_requests = config.get('PROVIDER_MIN_REQUESTS', self.min_requests)
+            self.cooldown = config.get('PROVIDER_COOLDOWN', self.cooldown)
+            self.sample_ttl = config.get('PROVIDER_SAMPLE_TTL', self.sample_ttl)
+            self._reset()
+
+    def _prune(self, provider, now):
+        samples = self._samples[provider]
+        while samples and now - samples[0][0] > self.sample_ttl:
+            samples.popleft()
+
+    def _error_rate(self, provider):
+        samples = self._samples[provider]
+        if not samples:
+            return 0.0
+        return sum(1 for _, _, ok in samples if not ok) / len(samples)
+
+    def _avg_latency(self, provider):
+        samples = self._samples[provider]
+        if not samples:
+            return 0.0
+        return sum(latency for _, latency, _ in samples) / len(samples)
+
+    def _score(self, provider):
+        return self._avg_latency(provider) * (1 + self._error_rate(provider) * self.error_penalty) \
+            + self._error_rate(provider)
+
+    def ranked(self):
+        """返回当前可用的数据源，按健康评分从优到劣排序"""
+        now = time.monotonic()
+        with self._lock:
+            for provider in self.providers:
+                self._prune(provider, now)
+            available = [p for p in self.providers if self._breakers[p].is_available(now)]
+            # 评分相同时保持默认优先级
+            return sorted(available, key=lambda p: (self._score(p), self.providers.index(p)))
+
+    def allow(self, provider):
+        """请求前调用，熔断打开或半开探测已在进行时返回False"""
+        with self._lock:
+            return self._breakers[provider].allow_request(time.monotonic())
+
+    def release(self, provider):
+        """请求被取消而没有结果时调用，释放半开状态下的探测名额"""
+        with self._lock:
+            breaker = self._breakers[provider]
+            if breaker.state == CircuitBreaker.HALF_OPEN:
+                breaker.probing = False
+
+    def record(self, provider, latency, success):
+        """记录一次请求结果并更新熔断状态"""
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._breakers[provider]
+            self._samples[provider].append((now, latency, success))
+            self._prune(provider, now)
+            totals = self._totals[provider]
+            totals['requests'] += 1
+            if not success:
+                totals['failures'] += 1
+
+            if breaker.state == CircuitBreaker.HALF_OPEN:
+                if success:
+                    breaker.close()
+                    self._samples[provider].clear()
+                else:
+                    breaker.open(now)
+                    totals['opened'] += 1
+            elif breaker.state == CircuitBreaker.CLOSED \
+                    and len(self._samples[provider]) >= self.min_requests \
+                    and self._error_rate(provider) >= self.error_threshold:
+                breaker.open(now)
+                totals['opened'] += 1
+
+    def snapshot(self):
+        """返回各数据源的健康状态，便于排查"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for provider in self.providers:
+                self._prune(provider, now)
+                breaker = self._breakers[provider]
+                result[provider] = {
+                    'state': breaker.state,
+                    'error_rate': round(self._error_rate(provider), 3),
+                    'avg_latency': round(self._avg_latency(provider), 3),
+                    'score': round(self._score(provider), 3),
+                    'window': len(self._samples[provider]),
+                    'requests': self._totals[provider]['requests'],
+                    'failures': self._totals[provider]['failures'],
+                    'times_opened': self._totals[provider]['opened'],
+                    'retry_in': round(max(0.0, breaker.cooldown - (now - breaker.opened_at)), 1)
+                    if breaker.state == CircuitBreaker.OPEN else 0.0
+                }
+            return result
+
+
+# 进程级共享的路由实例
+provider_router = ProviderRouter()
@@ -0,0 +1,134 @@
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class ProviderStubServer:
+    """本地数据源模拟服务器
+
+    模拟 OpenWeatherMap（/openweathermap/weather、/openweathermap/group）和
+    Weatherbit（/weatherbit/current）的JSON格式，延迟、错误率和超时比例可配置，
+    用于离线测试和采集性能基准。
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, latency_jitter=0.02,
+                 error_rate=0.0, timeout_rate=0.0, timeout_seconds=30):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_urls(self):
+        """各数据源的接口地址，对应 WeatherService.base_urls"""
+        return {
+            'openweathermap': f"{self.base_url}/openweathermap",
+            'weatherbit': f"{self.base_url}/weatherbit"
+        }
+
+    def start(self):
+        """在后台线程中启动服务器"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """在当前线程中运行服务器，直到 Ctrl+C"""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @staticmethod
+    def _observation(city_id):
+        """按城市ID生成稳定且带少量波动的观测值"""
+        rng = random.Random(city_id)
+        return {
+            'temp': round(rng.uniform(-5, 32) + random.uniform(-1, 1), 2),
+            'humidity': round(rng.uniform(30, 90), 1),
+            'wind': round(rng.uniform(0.5, 8), 2)
+        }
+
+    def _openweathermap_item(self, city_id):
+        obs = self._observation(city_id)
+        return {
+            'id': city_id,
+            'name': f"city-{city_id}",
+            'main': {'temp': obs['temp'], 'humidity': obs['humidity']},
+            'wind': {'speed': obs['wind']},
+            'dt': int(time.time())
+        }
+
+    def respond(self, path, query):
+        """返回 (状态码, JSON)；找不到接口时返回404"""
+        ids = [int(i) for i in query.get('id', query.get('city_id', ['0']))[0].split(',') if i]
+
+        if path == '/openweathermap/weather':
+            return 200, self._openweathermap_item(ids[0])
+        if path == '/openweathermap/group':
+            return 200, {'cnt': len(ids), 'list': [self._openweathermap_item(i) for i in ids]}
+        if path == '/weatherbit/current':
+            obs = self._observation(ids[0])
+            return 200, {'count': 1, 'data': [{
+                'city_id': str(ids[0]),
+                'temp': obs['temp'],
+                'rh': obs['humidity'],
+                'wind_spd': obs['wind']
+            }]}
+        return 404, {'error': 'not found'}
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub._lock:
+                    stub.request_count += 1
+
+                roll = random.random()
+                if roll < stub.timeout_rate:
+                    # 模拟超时：长时间不返回
+                    time.sleep(stub.timeout_seconds)
+                    return
+
+                time.sleep(max(0.0, stub.latency + random.uniform(-stub.latency_jitter, stub.latency_jitter)))
+                if roll < stub.timeout_rate + stub.error_rate:
+                    status, payload = 500, {'cod': 500, 'message': 'stub error'}
+                else:
+                    url = urlparse(self.path)
+                    status, payload = stub.respond(url.path, parse_qs(url.query))
+
+                body = json.dumps(payload).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
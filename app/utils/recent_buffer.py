@@ -0,0 +1,303 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.extensions import db
+from app.models import WeatherData
+from app.utils.change_feed import decode_feed_cursor, encode_feed_cursor, read_changes, safe_head_id
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 缓存的观测字段
+VALUE_COLUMNS = ('temperature', 'humidity', 'wind_speed')
+
+
+def daily_means(series):
+    """把按时间升序的列数据 {'timestamp': ..., 'temperature': ..., ...} 按天聚合为每天的平均值
+
+    返回同样结构的字典，timestamp 为当天零点。
+    """
+    if not len(series['timestamp']):
+        return series
+
+    day_index = series['timestamp'].astype('datetime64[D]')
+    starts = np.flatnonzero(np.r_[True, day_index[1:] != day_index[:-1]])
+    counts = np.diff(np.r_[starts, len(day_index)])
+    daily = {'timestamp': day_index[starts].astype('datetime64[s]')}
+    daily.update({column: np.add.reduceat(series[column], starts) / counts for column in VALUE_COLUMNS})
+    return daily
+
+
+class CityColumns:
+    """单个城市的列式环形缓冲
+
+    每列是一段连续的 NumPy 数组，数据按时间升序存放在 [start, end) 区间，读取时复制所需的连续区间。
+    超过 capacity 条时丢弃最旧的数据；写到数组末尾时把有效数据整体移回开头，
+    预留 capacity / 4 的空间使移动的开销均摊到每次追加上。
+    """
+
+    __slots__ = ('capacity', 'timestamps', 'values', 'start', 'end')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        size = capacity + max(capacity // 4, 1)
+        self.timestamps = np.empty(size, dtype='datetime64[s]')
+        self.values = {column: np.empty(size, dtype=np.float64) for column in VALUE_COLUMNS}
+        self.start = self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + sum(array.nbytes for array in self.values.values())
+
+    def _compact(self):
+        size = len(self)
+        self.timestamps[:size] = self.timestamps[self.start:self.end]
+        for array in self.values.values():
+            array[:size] = array[self.start:self.end]
+        self.start, self.end = 0, size
+
+    def _rewrite(self, timestamps, values):
+        """用按时间排序的完整数据替换缓冲内容，只保留最新的 capacity 条"""
+        keep = slice(max(len(timestamps) - self.capacity, 0), None)
+        timestamps = timestamps[keep]
+        self.start, self.end = 0, len(timestamps)
+        self.timestamps[:self.end] = timestamps
+        for column in VALUE_COLUMNS:
+            self.values[column][:self.end] = values[column][keep]
+
+    def extend(self, timestamps, values):
+        """批量追加按时间升序排列的数据（用于加载）"""
+        if len(self) and len(timestamps) and timestamps[0] <= self.timestamps[self.end - 1]:
+            merged = np.concatenate([self.timestamps[self.start:self.end], timestamps])
+            order = np.argsort(merged, kind='stable')
+            # 时间戳相同时保留后写入的数据
+            unique = np.ones(len(order), dtype=bool)
+            unique[:-1] = merged[order][1:] != merged[order][:-1]
+            order = order[unique]
+            self._rewrite(merged[order], {
+                column: np.concatenate([self.values[column][self.start:self.end], values[column]])[order]
+                for column in VALUE_COLUMNS
+            })
+            return
+
+        for i in range(0, len(timestamps), self.capacity):
+            self._append_sorted(timestamps[i:i + self.capacity], {
+                column: values[column][i:i + self.capacity] for column in VALUE_COLUMNS
+            })
+
+    def _append_sorted(self, timestamps, values):
+        count = len(timestamps)
+        if self.end + count > len(self.timestamps):
+            # 先丢弃超出容量的旧数据，再移回数组开头
+            self.start = max(self.start, self.end + count - self.capacity)
+            self._compact()
+        self.timestamps[self.end:self.end + count] = timestamps
+        for column in VALUE_COLUMNS:
+            self.values[column][self.end:self.end + count] = values[column]
+        self.end += count
+        self.start = max(self.start, self.end - self.capacity)
+
+    def upsert(self, timestamp, values):
+        """写入一条数据：时间最新时直接追加，时间戳已存在时原地更新，迟到的数据按时间插入"""
+        timestamp = np.datetime64(timestamp, 's')
+        if not len(self) or timestamp > self.timestamps[self.end - 1]:
+            self._append_sorted(np.array([timestamp]), {column: [values[column]] for column in VALUE_COLUMNS})
+            return
+
+        index = self.start + int(np.searchsorted(self.timestamps[self.start:self.end], timestamp))
+        if index < self.end and self.timestamps[index] == timestamp:
+            for column in VALUE_COLUMNS:
+                self.values[column][index] = values[column]
+        elif index > self.start or len(self) < self.capacity:
+            self.extend(np.array([timestamp]), {column: np.array([values[column]]) for column in VALUE_COLUMNS})
+
+    def view(self, since=None):
+        """返回 since 之后的数据，每列是一段连续数组的副本，不受之后写入的影响"""
+        start = self.start
+        if since is not None:
+            start += int(np.searchsorted(self.timestamps[self.start:self.end], np.datetime64(since, 's')))
+        series = {'timestamp': self.timestamps[start:self.end].copy()}
+        series.update({column: array[start:self.end].copy() for column, array in self.values.items()})
+        return series
+
+
+class RecentBuffer:
+    """最近观测数据的进程内列式缓存
+
+    为每个城市保存最近 days 天（最多 capacity 条）的观测数据，启动时一次查询加载，
+    写入器写入数据后直接追加，其他进程写入的数据每隔 refresh_interval 秒按主键增量同步
+（与增量变更接口相同，只同步写入超过 lag 秒的数据，较晚提交的数据不会被跳过）。
+    历史数据接口和预测器在缓存覆盖的范围内直接读取 NumPy 数组，不访问数据库。
+    内存上限为 城市数 × capacity × 1.25 × 32 字节，可通过 stats() 查看实际占用。
+    """
+
+    def __init__(self, days=30, capacity=4320, refresh_interval=30, lag=10):
+        self.days = days
+        self.capacity = capacity
+        self.refresh_interval = refresh_interval
+        self.lag = lag
+        self._lock = threading.Lock()
+        self._cities = {}
+        self._synced_id = 0
+        self._checked_at = None
+
+    def configure(self, config):
+        """根据应用配置设置缓存窗口、容量和同步间隔（会清空已有数据）"""
+        with self._lock:
+            self.days = config.get('RECENT_BUFFER_DAYS', self.days)
+            self.capacity = config.get('RECENT_BUFFER_CAPACITY', self.capacity)
+            self.refresh_interval = config.get('RECENT_BUFFER_REFRESH_INTERVAL', self.refresh_interval)
+            self.lag = config.get('CHANGE_FEED_LAG', self.lag)
+            self._cities = {}
+            self._synced_id = 0
+            self._checked_at = None
+
+    def _fetch(self, session, since):
+        """按 (city, timestamp) 顺序查询 since 之后的数据，逐个城市产出列数组"""
+        table = WeatherData.__table__
+        rows = session.execute(
+            db.select(table.c.city, table.c.timestamp, *(table.c[column] for column in VALUE_COLUMNS))
+            .where(table.c.timestamp >= since)
+            .order_by(table.c.city, table.c.timestamp)
+            .execution_options(yield_per=10000)
+        )
+
+        city, chunk = None, []
+        for row in rows:
+            if row[0] != city and chunk:
+                yield city, self._to_columns(chunk)
+                chunk = []
+            city = row[0]
+            chunk.append(row)
+        if chunk:
+            yield city, self._to_columns(chunk)
+
+    @staticmethod
+    def _to_columns(rows):
+        timestamps = np.array([row[1] for row in rows], dtype='datetime64[s]')
+        values = {column: np.array([row[i + 2] for row in rows], dtype=np.float64)
+                  for i, column in enumerate(VALUE_COLUMNS)}
+        return timestamps, values
+
+    def _merge(self, fetched):
+        for city, (timestamps, values) in fetched:
+            if city not in self._cities:
+                self._cities[city] = CityColumns(self.capacity)
+            self._cities[city].extend(timestamps, values)
+
+    def load(self, session=None):
+        """从数据库加载所有城市最近 days 天的数据"""
+        session = session or db.session
+        start_time = time.time()
+        with self._lock:
+            self._cities = {}
+            # 先取同步位置再查询，不大于它的数据都已包含在本次查询中
+            self._synced_id = safe_head_id(session, self.lag)
+            self._merge(self._fetch(session, datetime.now() - timedelta(days=self.days)))
+            self._checked_at = time.monotonic()
+        logger.info(f"最近观测缓存已加载: {len(self._cities)}个城市，{sum(map(len, self._cities.values()))}条数据，"
+                    f"占用{self.memory_usage() / 1024 / 1024:.1f}MB，耗时{time.time() - start_time:.2f}秒")
+
+    def refresh(self, session=None, batch_size=10000):
+        """增量同步其他进程写入的数据（从已同步的主键开始，已有的时间桶按时间戳覆盖）
+
+        按主键而不是观测时间同步，时间戳较早但提交较晚的数据也能同步到。
+        """
+        session = session or db.session
+        cutoff = datetime.now() - timedelta(days=self.days)
+        with self._lock:
+            cursor = encode_feed_cursor(self._synced_id)
+            has_more = True
+            while has_more:
+                rows, cursor, has_more = read_changes(cursor, batch_size, session, self.lag)
+                for row in rows:
+                    if row.timestamp < cutoff:
+                        continue
+                    if row.city not in self._cities:
+                        self._cities[row.city] = CityColumns(self.capacity)
+                    self._cities[row.city].upsert(row.timestamp, row._mapping)
+            self._synced_id = decode_feed_cursor(cursor)
+            self._checked_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+            return
+        try:
+            if self._checked_at is None:
+                self.load()
+            else:
+                self.refresh()
+        except Exception as e:
+            logger.error(f"同步最近观测缓存失败: {str(e)}")
+            self._checked_at = now
+
+    def update(self, rows, session=None):
+        """写入数据后追加到缓存，可注册为 IngestWriter 的写入回调"""
+        if self._checked_at is None:
+            return
+        cutoff = datetime.now() - timedelta(days=self.days)
+        with self._lock:
+            for row in rows:
+                if row['timestamp'] < cutoff:
+                    continue
+                if row['city'] not in self._cities:
+                    self._cities[row['city']] = CityColumns(self.capacity)
+                self._cities[row['city']].upsert(row['timestamp'], row)
+
+    def covers(self, days):
+        """缓存窗口是否覆盖最近 days 天"""
+        return days <= self.days
+
+    def series(self, city, days=None):
+        """返回城市最近 days 天的列数据 {'timestamp': ..., 'temperature': ..., ...}
+
+        超出缓存窗口或没有数据时返回None，调用方应回退到数据库查询。
+        """
+        days = self.days if days is None else days
+        if not self.covers(days):
+            return None
+        self._ensure_loaded()
+        with self._lock:
+            columns = self._cities.get(city)
+            if columns is None or not len(columns):
+                return None
+            since = datetime.now() - timedelta(days=days)
+            # 缓冲已满且最旧的数据晚于查询起点，说明容量不足以覆盖该范围
+            if len(columns) >= columns.capacity and columns.timestamps[columns.start] > np.datetime64(since, 's'):
+                return None
+            return columns.view(since)
+
+    def daily(self, city, days=None):
+        """按天聚合最近 days 天的数据，返回每天的平均值（timestamp 为当天零点）"""
+        series = self.series(city, days)
+        if series is None or not len(series['timestamp']):
+            return None
+        return daily_means(series)
+
+    def memory_usage(self):
+        """缓存占用的字节数"""
+        return sum(columns.nbytes for columns in self._cities.values())
+
+    def stats(self):
+        """返回缓存的城市数、数据条数和内存占用"""
+        return {
+            'cities': len(self._cities),
+            'points': sum(map(len, self._cities.values())),
+            'days': self.days,
+            'capacity_per_city': self.capacity,
+            'memory_bytes': self.memory_usage(),
+            'synced_id': self._synced_id
+        }
+
+
+# 进程级共享的最近观测缓存
+recent_buffer = RecentBuffer()
@@ -0,0 +1,168 @@
+import logging
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+from urllib.parse import quote, unquote
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.extensions import db
+from app.models import WeatherData
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 归档文件的字段，保留原始 id 以便与热表数据合并去重
+ARCHIVE_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('city', pa.string()),
+    ('temperature', pa.float64()),
+    ('humidity', pa.float64()),
+    ('wind_speed', pa.float64()),
+    ('timestamp', pa.timestamp('us')),
+])
+
+# 归档数据行，字段与 WeatherData 一致
+ArchivedObservation = namedtuple('ArchivedObservation', ARCHIVE_SCHEMA.names)
+
+
+def month_start(timestamp):
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(timestamp):
+    return (month_start(timestamp) + timedelta(days=32)).replace(day=1)
+
+
+class WeatherArchive:
+    """WeatherData 冷数据的 Parquet 归档
+
+    超过保留期的数据按 城市/月份 写入 {root}/city=<城市>/month=<YYYY-MM>/data.parquet（压缩存储），
+    写入成功后再从热表删除，中途失败重新执行即可（按 id 去重，不会重复归档）。
+    读取时只打开与查询时间范围重叠的月份文件，并使用内存映射。
+    """
+
+    FILENAME = 'data.parquet'
+
+    def __init__(self, root='archive', retention_days=180, compression='zstd'):
+        self.root = root
+        self.retention_days = retention_days
+        self.compression = compression
+
+    def configure(self, config):
+        """根据应用配置设置归档目录、保留天数和压缩算法"""
+        self.root = config.get('ARCHIVE_DIR', self.root)
+        self.retention_days = config.get('WEATHER_RETENTION_DAYS', self.retention_days)
+        self.compression = config.get('ARCHIVE_COMPRESSION', self.compression)
+
+    def city_dir(self, city):
+        """城市的归档目录，城市名经过URL编码以保证是合法的目录名"""
+        return os.path.join(self.root, f"city={quote(city, safe='')}")
+
+    def partition_path(self, city, month):
+        """城市某月的归档文件路径"""
+        return os.path.join(self.city_dir(city), f"month={month.strftime('%Y-%m')}", self.FILENAME)
+
+    def cities(self):
+        """已有归档数据的城市"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(unquote(name[len('city='):]) for name in os.listdir(self.root) if name.startswith('city='))
+
+    def months(self, city):
+        """城市已归档的月份（每月第一天零点），按时间升序"""
+        city_dir = self.city_dir(city)
+        if not os.path.isdir(city_dir):
+            return []
+        return sorted(datetime.strptime(name[len('month='):], '%Y-%m')
+                      for name in os.listdir(city_dir) if name.startswith('month='))
+
+    def _write_partition(self, city, month, rows):
+        """将一个城市一个月的数据合并进归档文件，先写临时文件再原子替换"""
+        path = self.partition_path(city, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        table = pa.Table.from_pylist(rows, schema=ARCHIVE_SCHEMA)
+        if os.path.exists(path):
+            table = pa.concat_tables([pq.read_table(path, schema=ARCHIVE_SCHEMA), table])
+
+        # 按 id 去重（重复执行归档时同一行可能再次写入），按时间排序
+        ids = table.column('id').to_pylist()
+        keep = sorted({row_id: index for index, row_id in enumerate(ids)}.values(),
+                      key=lambda index: table.column('timestamp')[index].as_py())
+        table = table.take(pa.array(keep, type=pa.int64()))
+
+        tmp_path = f'{path}.tmp'
+        pq.write_table(table, tmp_path, compression=self.compression)
+        os.replace(tmp_path, path)
+
+    def archive(self, cutoff=None, chunk_size=50000, session=None):
+        """将 cutoff 之前的数据移入归档，默认 cutoff 为 retention_days 天前的零点，返回归档的行数
+
+        逐个城市、每次 chunk_size 行处理，写入归档文件后再删除热表中的数据并提交。
+        """
+        session = session or db.session
+        if cutoff is None:
+            cutoff = datetime.now() - timedelta(days=self.retention_days)
+        # 按天对齐，同一天的数据不会分散在热表和归档两边，天汇总可以从热表重建
+        cutoff = cutoff.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        table = WeatherData.__table__
+        cities = session.execute(
+            db.select(table.c.city).where(table.c.timestamp < cutoff).distinct()
+        ).scalars().all()
+
+        archived = 0
+        for city in cities:
+            while True:
+                rows = session.execute(
+                    db.select(*(table.c[name] for name in ARCHIVE_SCHEMA.names))
+                    .where(table.c.city == city, table.c.timestamp < cutoff)
+                    .order_by(table.c.timestamp)
+                    .limit(chunk_size)
+                ).mappings().all()
+                if not rows:
+                    break
+
+                months = {}
+                for row in rows:
+                    months.setdefault(month_start(row['timestamp']), []).append(dict(row))
+                for month, month_rows in months.items():
+                    self._write_partition(city, month, month_rows)
+
+                ids = [row['id'] for row in rows]
+                for i in range(0, len(ids), 1000):
+                    session.execute(table.delete().where(table.c.id.in_(ids[i:i + 1000])))
+                session.commit()
+                archived += len(rows)
+
+            logger.info(f"{city}: {cutoff:%Y-%m-%d} 之前的数据已归档")
+
+        logger.info(f"归档完成：共{archived}条数据移入 {self.root}")
+        return archived
+
+    def read(self, city, start_date, end_date):
+        """读取城市在时间范围内的归档数据，按时间升序返回 ArchivedObservation 列表"""
+        tables = []
+        month = month_start(start_date)
+        while month <= end_date:
+            path = self.partition_path(city, month)
+            if os.path.exists(path):
+                tables.append(pq.read_table(
+                    path, schema=ARCHIVE_SCHEMA, memory_map=True,
+                    filters=[('timestamp', '>=', start_date), ('timestamp', '<=', end_date)]
+                ))
+            month = next_month(month)
+
+        if not tables:
+            return []
+
+        table = pa.concat_tables(tables)
+        columns = [table.column(name).to_pylist() for name in ARCHIVE_SCHEMA.names]
+        return sorted((ArchivedObservation(*values) for values in zip(*columns)), key=lambda obs: obs.timestamp)
+
+
+# 进程级共享的归档实例
+weather_archive = WeatherArchive()
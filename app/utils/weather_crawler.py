@@ -1,45 +1,48 @@
 import logging
-import random
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-from app.models import WeatherData
-from app.extensions import db
+from flask import current_app, has_app_context
+from app.utils.ingest_writer import IngestWriter
+from app.utils.city_registry import city_registry
+from app.utils.latest_snapshot import latest_snapshot
+from app.utils.provider_router import provider_router
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 对冲请求使用的共享线程池
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='weather-hedge')
+
 
 class WeatherService:
-    def __init__(self):
-        # 支持的API服务列表
-        self.api_services = [
-            self._openweathermap_api,
-            self._weatherbit_api,
-            self._local_fallback
-        ]
-
-        # 城市ID映射
-        self.city_ids = {
-            'Beijing': {
-                'openweathermap': 1816670,
-                'weatherbit': 1816670
-            },
-            'Shanghai': {
-                'openweathermap': 1796236,
-                'weatherbit': 1796236
-            },
-            'Guangzhou': {
-                'openweathermap': 1809858,
-                'weatherbit': 1809858
-            },
-            'Shenzhen': {
-                'openweathermap': 1795565,
-                'weatherbit': 1795565
-            }
+    # 支持批量(group)查询的数据源及单次请求的最大城市数
+    BATCH_PROVIDERS = {'openweathermap': 20}
+
+    def __init__(self, deadline=None, hedge_delay=None, batch_size=None):
+        # 单次获取的总时限(秒)，以及对冲请求的触发延迟(秒，0表示关闭)
+        config = current_app.config if has_app_context() else {}
+        self.deadline = deadline or config.get('CRAWL_DEADLINE', 10)
+        self.hedge_delay = config.get('CRAWL_HEDGE_DELAY', 0) if hedge_delay is None else hedge_delay
+        # 批量查询时每批的城市数，0表示关闭批量查询
+        self.batch_size = config.get('CRAWL_BATCH_SIZE', 20) if batch_size is None else batch_size
+        # 数据源接口地址，可指向本地模拟服务器
+        self.base_urls = {
+            'openweathermap': config.get('OPENWEATHERMAP_BASE_URL', 'https://api.openweathermap.org/data/2.5'),
+            'weatherbit': config.get('WEATHERBIT_BASE_URL', 'https://api.weatherbit.io/v2.0')
+        }
+
+        # 支持的API服务列表（本地后备不参与路由，远程全部失败后使用）
+        self.api_services = {
+            'openweathermap': self._openweathermap_api,
+            'weatherbit': self._weatherbit_api
         }
 
+        # 城市ID映射，来自进程级城市索引
+        self.city_ids = city_registry.provider_ids()
+
         # API密钥
         self.api_keys = {
             'openweathermap': 'cb9902cd516183ee3e8ebe75f5e76df5',
@@ -47,123 +50,235 @@ class WeatherService:
         }
 
     def get_weather_data(self, city):
-        """获取指定城市天气数据"""
+        """获取指定城市天气数据
+
+        整次获取受 deadline 总时限约束，超时后直接使用本地后备数据。
+        """
         if city not in self.city_ids:
             return None
 
-        # 随机选择一个API服务
-        api_service = random.choice(self.api_services)
+        # 按健康评分排序，熔断中的数据源直接跳过
+        providers = provider_router.ranked()
+        expires_at = time.monotonic() + self.deadline
 
-        try:
-            # 尝试获取数据
-            return api_service(city)
-        except Exception as e:
-            logger.error(f"API服务调用失败: {str(e)}")
-            return None
+        if self.hedge_delay and len(providers) > 1:
+            data = self._hedged_fetch(providers, city, expires_at)
+        else:
+            data = self._chained_fetch(providers, city, expires_at)
 
-    def _openweathermap_api(self, city):
-        """使用OpenWeatherMap API获取天气数据"""
-        city_id = self.city_ids[city]['openweathermap']
-        api_key = self.api_keys['openweathermap']
-        url = f"https://api.openweathermap.org/data/2.5/weather?id={city_id}&appid={api_key}&units=metric"
+        return data or self._local_fallback(city)
+
+    def _chained_fetch(self, providers, city, expires_at):
+        """依次尝试各数据源，剩余时间在未尝试的数据源之间平均分配"""
+        for index, provider in enumerate(providers):
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"获取{city}数据超出时限，停止尝试远程数据源")
+                break
 
-        # 重试机制
-        max_retries = 3
-        for attempt in range(max_retries):
             try:
-                response = requests.get(url, timeout=(3.05, 15))  # 连接超时3秒，读取超时15秒
-                data = response.json()
+                data = self.api_services[provider](city, time.monotonic() + remaining / (len(providers) - index))
+                if data:
+                    return data
+            except Exception as e:
+                logger.error(f"API服务调用失败: {str(e)}")
 
-                # 检查返回数据是否有效
-                if 'main' in data and 'wind' in data:
-                    return {
-                        'city': city,
-                        'temperature': data['main']['temp'],
-                        'humidity': data['main']['humidity'],
-                        'wind_speed': data['wind']['speed'],
-                        'timestamp': datetime.now(),
-                        'source': 'openweathermap'
-                    }
-                else:
-                    logger.warning(f"OpenWeatherMap API返回无效数据: {data}")
-                    # 尝试下一个API
-                    return self._weatherbit_api(city)
+        return None
 
-            except requests.exceptions.Timeout:
-                if attempt < max_retries - 1:
-                    logger.warning(f"OpenWeatherMap API请求超时，重试 {attempt + 1}/{max_retries}")
-                    time.sleep(0.5)  # 等待0.5秒后重试
-                    continue
-                else:
-                    logger.error(f"OpenWeatherMap API请求超时，放弃重试")
-                    # 尝试下一个API
-                    return self._weatherbit_api(city)
-            except Exception as e:
-                logger.error(f"OpenWeatherMap API错误: {str(e)}")
-                # 尝试下一个API
-                return self._weatherbit_api(city)
+    def _hedged_fetch(self, providers, city, expires_at):
+        """对冲请求：当前请求在 hedge_delay 内没有返回有效数据时，并行请求下一个数据源，先返回的有效结果胜出"""
+        queue = iter(providers)
+        pending = set()
+
+        def launch():
+            provider = next(queue, None)
+            if provider:
+                pending.add(_hedge_executor.submit(self.api_services[provider], city, expires_at))
+
+        launch()
+        while pending:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"获取{city}数据超出时限，停止等待对冲请求")
+                break
+
+            done, pending = wait(pending, timeout=min(self.hedge_delay, remaining), return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    data = future.result()
+                except Exception as e:
+                    logger.error(f"API服务调用失败: {str(e)}")
+                    data = None
+                if data:
+                    return data
+
+            launch()
 
         return None
 
-    def _weatherbit_api(self, city):
-        """使用Weatherbit API获取天气数据"""
-        city_id = self.city_ids[city]['weatherbit']
-        api_key = self.api_keys['weatherbit']
-        url = f"https://api.weatherbit.io/v2.0/current?city_id={city_id}&key={api_key}"
+    def get_weather_data_batch(self, cities):
+        """批量获取多个城市天气数据，返回 {城市: 数据}
+
+        N个城市按 batch_size 分组，每组只发一次 group 请求；批量请求失败或缺失的城市
+        回退到单城市获取（包含完整的数据源链和本地后备）。
+        """
+        cities = [city for city in cities if city in self.city_ids]
+        results = {}
+
+        provider = next((p for p in provider_router.ranked() if p in self.BATCH_PROVIDERS), None)
+        if provider and self.batch_size:
+            batchable = [city for city in cities if self.city_ids[city].get(provider)]
+            for batch in self.split_batches(provider, batchable):
+                results.update(self._request_batch(provider, batch))
+
+        for city in cities:
+            if city not in results:
+                results[city] = self.get_weather_data(city)
+
+        return results
+
+    def split_batches(self, provider, cities, batch_size=None):
+        """按批量大小切分城市列表，不超过数据源允许的上限"""
+        size = min(batch_size or self.batch_size, self.BATCH_PROVIDERS[provider])
+        return [cities[i:i + size] for i in range(0, len(cities), size)]
+
+    def _request_batch(self, provider, cities):
+        """发送一次批量请求，返回成功解析的 {城市: 数据}，失败返回空字典"""
+        if not provider_router.allow(provider):
+            return {}
+
+        start_time = time.monotonic()
+        try:
+            response = requests.get(self.build_batch_url(provider, cities),
+                                    timeout=(3.05, min(15, self.deadline)))
+            results = self.parse_batch_response(provider, cities, response.json())
+            provider_router.record(provider, time.monotonic() - start_time, bool(results))
+            if len(results) < len(cities):
+                logger.warning(f"{provider} 批量请求缺少{len(cities) - len(results)}个城市的数据")
+            return results
+        except Exception as e:
+            provider_router.record(provider, time.monotonic() - start_time, False)
+            logger.error(f"{provider} 批量请求失败: {str(e)}")
+            return {}
+
+    def build_batch_url(self, provider, cities):
+        """构造批量(group)请求URL"""
+        city_ids = ','.join(str(self.city_ids[city][provider]) for city in cities)
+        api_key = self.api_keys[provider]
+        return f"{self.base_urls[provider]}/group?id={city_ids}&appid={api_key}&units=metric"
+
+    def parse_batch_response(self, provider, cities, data):
+        """按城市ID将批量返回结果解析为 {城市: 统一格式数据}"""
+        by_id = {self.city_ids[city][provider]: city for city in cities}
+        results = {}
+        for item in data.get('list', []):
+            city = by_id.get(item.get('id'))
+            parsed = self.parse_response(provider, city, item) if city else None
+            if parsed:
+                results[city] = parsed
+        return results
+
+    def build_url(self, provider, city):
+        """构造指定数据源的请求URL"""
+        city_id = self.city_ids[city][provider]
+        api_key = self.api_keys[provider]
+        if provider == 'openweathermap':
+            return f"{self.base_urls[provider]}/weather?id={city_id}&appid={api_key}&units=metric"
+        return f"{self.base_urls[provider]}/current?city_id={city_id}&key={api_key}"
+
+    def parse_response(self, provider, city, data):
+        """将数据源返回的JSON解析为统一格式，无效数据返回None"""
+        if provider == 'openweathermap':
+            if 'main' in data and 'wind' in data:
+                return {
+                    'city': city,
+                    'temperature': data['main']['temp'],
+                    'humidity': data['main']['humidity'],
+                    'wind_speed': data['wind']['speed'],
+                    'timestamp': datetime.now(),
+                    'source': 'openweathermap'
+                }
+        elif 'data' in data and len(data['data']) > 0:
+            return {
+                'city': city,
+                'temperature': data['data'][0]['temp'],
+                'humidity': data['data'][0]['rh'],
+                'wind_speed': data['data'][0]['wind_spd'],
+                'timestamp': datetime.now(),
+                'source': 'weatherbit'
+            }
+        return None
+
+    def _request_provider(self, provider, city, max_retries, expires_at=None):
+        """请求单个数据源，超时重试，结果计入路由统计；失败返回None
+
+        expires_at 为该数据源可用时间的截止点(time.monotonic)，请求超时和重试都不会越过它。
+        """
+        if not self.city_ids[city].get(provider):
+            return None
+
+        url = self.build_url(provider, city)
 
-        # 重试机制
-        max_retries = 2
         for attempt in range(max_retries):
+            remaining = 15 if expires_at is None else expires_at - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"{provider} 时间预算已用完: {city}")
+                return None
+
+            if not provider_router.allow(provider):
+                logger.warning(f"{provider} 熔断中，跳过: {city}")
+                return None
+
+            start_time = time.monotonic()
             try:
-                response = requests.get(url, timeout=(3.05, 15))  # 连接超时3秒，读取超时15秒
-                data = response.json()
+                # 连接超时最多3秒，读取超时不超过剩余预算（默认15秒）
+                response = requests.get(url, timeout=(min(3.05, remaining), min(15, remaining)))
+                data = self.parse_response(provider, city, response.json())
+                provider_router.record(provider, time.monotonic() - start_time, bool(data))
 
                 # 检查返回数据是否有效
-                if 'data' in data and len(data['data']) > 0:
-                    return {
-                        'city': city,
-                        'temperature': data['data'][0]['temp'],
-                        'humidity': data['data'][0]['rh'],
-                        'wind_speed': data['data'][0]['wind_spd'],
-                        'timestamp': datetime.now(),
-                        'source': 'weatherbit'
-                    }
-                else:
-                    logger.warning(f"Weatherbit API返回无效数据: {data}")
-                    # 使用本地后备
-                    return self._local_fallback(city)
+                if not data:
+                    logger.warning(f"{provider} API返回无效数据: {city}")
+                return data
 
             except requests.exceptions.Timeout:
+                provider_router.record(provider, time.monotonic() - start_time, False)
                 if attempt < max_retries - 1:
-                    logger.warning(f"Weatherbit API请求超时，重试 {attempt + 1}/{max_retries}")
-                    time.sleep(0.5)  # 等待0.5秒后重试
-                    continue
+                    logger.warning(f"{provider} API请求超时，重试 {attempt + 1}/{max_retries}")
+                    if expires_at is None or expires_at - time.monotonic() > 0.5:
+                        time.sleep(0.5)  # 等待0.5秒后重试
                 else:
-                    logger.error(f"Weatherbit API请求超时，放弃重试")
-                    # 使用本地后备
-                    return self._local_fallback(city)
+                    logger.error(f"{provider} API请求超时，放弃重试")
             except Exception as e:
-                logger.error(f"Weatherbit API错误: {str(e)}")
-                # 使用本地后备
-                return self._local_fallback(city)
+                provider_router.record(provider, time.monotonic() - start_time, False)
+                logger.error(f"{provider} API错误: {str(e)}")
+                return None
 
-        return self._local_fallback(city)
+        return None
+
+    def _openweathermap_api(self, city, expires_at=None):
+        """使用OpenWeatherMap API获取天气数据"""
+        return self._request_provider('openweathermap', city, max_retries=3, expires_at=expires_at)
+
+    def _weatherbit_api(self, city, expires_at=None):
+        """使用Weatherbit API获取天气数据"""
+        return self._request_provider('weatherbit', city, max_retries=2, expires_at=expires_at)
 
     def _local_fallback(self, city):
         """本地后备数据源 - 使用最近的数据"""
         logger.warning(f"使用本地后备数据源: {city}")
         try:
             # 获取最近的数据
-            latest_data = WeatherData.query.filter_by(city=city).order_by(
-                WeatherData.timestamp.desc()).first()
+            latest_data = latest_snapshot.get(city)
 
             if latest_data:
+                # 保留原始观测时间，重复写入时按 (city, timestamp) 去重，不会产生新数据
                 return {
                     'city': city,
                     'temperature': latest_data.temperature,
                     'humidity': latest_data.humidity,
                     'wind_speed': latest_data.wind_speed,
-                    'timestamp': datetime.now(),
+                    'timestamp': latest_data.timestamp,
                     'source': 'local_fallback'
                 }
         except Exception as e:
@@ -181,22 +296,20 @@ class WeatherService:
 
     def save_to_db(self, data):
         """保存天气数据到数据库"""
-        try:
-            # 创建新记录
-            new_data = WeatherData(
-                city=data['city'],
-                temperature=data['temperature'],
-                humidity=data['humidity'],
-                wind_speed=data['wind_speed'],
-                timestamp=data['timestamp']
-            )
-
-            # 使用全局db
-            db.session.add(new_data)
-            db.session.commit()
-            logger.info(f"成功保存{data['city']}数据到数据库")
+        return self.save_many_to_db([data])
+
+    def save_many_to_db(self, records, writer=None):
+        """批量保存天气数据，一次多行写入；传入 writer 时只加入其缓冲，由调用方决定写入时机"""
+        records = [record for record in records if record]
+        if writer is not None:
+            writer.add_many(records)
             return True
-        except Exception as e:
-            logger.error(f"保存{data['city']}数据失败: {str(e)}")
-            db.session.rollback()
-            return False
\ No newline at end of file
+
+        writer = IngestWriter.from_config(current_app.config) if has_app_context() else IngestWriter()
+        writer.add_many(records)
+        writer.flush()
+        if writer.rows_failed:
+            return False
+
+        logger.info(f"成功保存{len(records)}条数据到数据库: {', '.join(sorted({r['city'] for r in records}))}")
+        return True
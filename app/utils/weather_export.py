@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+from datetime import datetime
+from itertools import islice
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.utils.weather_rollups import iter_history
+
+# 导出的字段
+EXPORT_COLUMNS = ('city', 'timestamp', 'temperature', 'humidity', 'wind_speed')
+
+# 支持的导出格式：MIME 类型和文件扩展名
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+EXPORT_SCHEMA = pa.schema([
+    ('city', pa.string()),
+    ('timestamp', pa.timestamp('us')),
+    ('temperature', pa.float64()),
+    ('humidity', pa.float64()),
+    ('wind_speed', pa.float64()),
+])
+
+
+def iter_export_chunks(cities, start_date, end_date, chunk_size=10000):
+    """逐个城市按时间顺序读取数据（包括归档），每次产出最多 chunk_size 行"""
+    for city in cities:
+        rows = iter_history(city, start_date, end_date, 'raw', chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+
+def _csv_stream(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('city', 'date', 'time', 'temperature', 'humidity', 'wind_speed'))
+    for chunk in chunks:
+        for item in chunk:
+            writer.writerow((item.city, item.timestamp.strftime('%Y-%m-%d'), item.timestamp.strftime('%H:%M:%S'),
+                             item.temperature, item.humidity, item.wind_speed))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_stream(chunks):
+    for chunk in chunks:
+        yield ''.join(json.dumps({
+            'city': item.city,
+            'timestamp': item.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+            'temperature': item.temperature,
+            'humidity': item.humidity,
+            'wind_speed': item.wind_speed
+        }, ensure_ascii=False) + '\n' for item in chunk)
+
+
+class _ChunkSink(io.RawIOBase):
+    """供 ParquetWriter 写入的输出流，写入的字节暂存到下次 drain() 时取走"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+def _parquet_stream(chunks, compression='zstd'):
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, EXPORT_SCHEMA, compression=compression)
+    try:
+        # 每个数据块写成一个 row group，写完立即发送
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pydict(
+                {column: [getattr(item, column) for item in chunk] for column in EXPORT_COLUMNS},
+                schema=EXPORT_SCHEMA
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def stream_export(fmt, cities, start_date=None, end_date=None, chunk_size=10000, compression='zstd'):
+    """按格式流式导出天气数据，返回逐块产出字符串/字节的生成器
+
+    数据从服务端游标分块读取，每块编码后立即输出，内存占用与导出的行数无关。
+    """
+    chunks = iter_export_chunks(cities, start_date or datetime(1970, 1, 1), end_date or datetime.now(), chunk_size)
+    if fmt == 'csv':
+        return _csv_stream(chunks)
+    if fmt == 'ndjson':
+        return _ndjson_stream(chunks)
+    if fmt == 'parquet':
+        return _parquet_stream(chunks, compression)
+    raise ValueError(f"不支持的导出格式: {fmt}")
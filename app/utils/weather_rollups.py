@@ -0,0 +1,298 @@
+import base64
+import logging
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.models import WeatherData, WeatherHourly, WeatherDaily
+from app.utils.ingest_writer import build_upsert
+from app.utils.weather_archive import weather_archive, next_month
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 需要汇总的观测字段
+ROLLUP_FIELDS = ('temperature', 'humidity', 'wind_speed')
+# 冲突时更新的字段
+ROLLUP_COLUMNS = ('count',) + tuple(
+    column for field in ROLLUP_FIELDS for column in (field, f'{field}_min', f'{field}_max'))
+
+
+def hour_bucket(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(timestamp):
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# 各分辨率的汇总表、时间桶函数和时间桶长度
+RESOLUTIONS = {
+    'hour': (WeatherHourly, hour_bucket, timedelta(hours=1)),
+    'day': (WeatherDaily, day_bucket, timedelta(days=1)),
+}
+
+
+def _raw_select():
+    """原始数据按汇总行的格式查询：每条数据计数为1，平均/最小/最大值都是观测值本身"""
+    c = WeatherData.__table__.c
+    columns = [c.city, c.timestamp, db.literal(1)]
+    for field in ROLLUP_FIELDS:
+        columns += [c[field], c[field], c[field]]
+    return db.select(*columns), c
+
+
+def _rollup_select(model):
+    c = model.__table__.c
+    columns = [c.city, c.timestamp, c['count']]
+    for field in ROLLUP_FIELDS:
+        columns += [c[field], c[f'{field}_min'], c[f'{field}_max']]
+    return db.select(*columns), c
+
+
+def _aggregate(rows, bucket_fn):
+    """对按 (city, timestamp) 排序的输入流式聚合，逐个产出时间桶的汇总行
+
+    输入可以是原始数据或更细粒度的汇总行，平均值按条数加权合并。
+    """
+    key, count, sums, mins, maxs = None, 0, None, None, None
+
+    def finish():
+        row = {'city': key[0], 'timestamp': key[1], 'count': count}
+        for i, field in enumerate(ROLLUP_FIELDS):
+            row[field] = sums[i] / count
+            row[f'{field}_min'] = mins[i]
+            row[f'{field}_max'] = maxs[i]
+        return row
+
+    for city, timestamp, row_count, *values in rows:
+        row_key = (city, bucket_fn(timestamp))
+        if row_key != key:
+            if key is not None:
+                yield finish()
+            key, count = row_key, 0
+            sums, mins, maxs = [0.0] * len(ROLLUP_FIELDS), [None] * len(ROLLUP_FIELDS), [None] * len(ROLLUP_FIELDS)
+
+        count += row_count
+        for i in range(len(ROLLUP_FIELDS)):
+            avg, low, high = values[i * 3:i * 3 + 3]
+            sums[i] += avg * row_count
+            mins[i] = low if mins[i] is None else min(mins[i], low)
+            maxs[i] = high if maxs[i] is None else max(maxs[i], high)
+
+    if key is not None:
+        yield finish()
+
+
+def _write(session, model, rows, chunk_size=1000):
+    """将汇总行批量 upsert 到汇总表，返回行数"""
+    stmt = build_upsert(session, model.__table__, ROLLUP_COLUMNS)
+    written = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            session.execute(stmt, chunk)
+            written += len(chunk)
+            chunk = []
+    if chunk:
+        session.execute(stmt, chunk)
+        written += len(chunk)
+    return written
+
+
+def _bucket_ranges(keys, span):
+    """把 (城市, 时间桶) 按连续的时间桶合并为区间，返回 [(起点, 终点, 涉及的城市)]"""
+    cities_by_bucket = {}
+    for city, bucket in keys:
+        cities_by_bucket.setdefault(bucket, set()).add(city)
+
+    ranges = []
+    for bucket in sorted(cities_by_bucket):
+        if ranges and ranges[-1][1] == bucket:
+            ranges[-1][1] = bucket + span
+            ranges[-1][2].update(cities_by_bucket[bucket])
+        else:
+            ranges.append([bucket, bucket + span, set(cities_by_bucket[bucket])])
+    return ranges
+
+
+def _recompute(session, source, model, bucket_fn, span, keys, city_chunk=500, batch_size=10000):
+    """从下一级数据重新计算指定的 (城市, 时间桶)，返回写入的行数
+
+    只查询写入触及的连续时间桶区间内、触及该区间的城市，迟到的单条数据不会让整批城市读取更长的范围；
+    下一级数据分批读取，内存中只保留触及的时间桶的汇总行。
+    """
+    if not keys:
+        return 0
+
+    select, c = source
+    written = 0
+    for start, end, cities in _bucket_ranges(keys, span):
+        cities = sorted(cities)
+        for i in range(0, len(cities), city_chunk):
+            rows = session.execute(
+                select.where(c.city.in_(cities[i:i + city_chunk]), c.timestamp >= start, c.timestamp < end)
+                .order_by(c.city, c.timestamp)
+                .execution_options(yield_per=batch_size)
+            )
+            # 读完再写入，避免在流式读取的同一连接上执行写入
+            rollups = [row for row in _aggregate(rows, bucket_fn) if (row['city'], row['timestamp']) in keys]
+            written += _write(session, model, rollups)
+    return written
+
+
+def refresh_rollups(rows, session=None):
+    """写入原始数据后更新受影响时间桶的汇总
+
+    小时汇总从原始数据重新计算，天汇总再从小时汇总重新计算，只涉及本次写入触及的时间桶，
+    重复写入和更新都能得到正确结果。可注册为 IngestWriter 的写入回调。
+    """
+    session = session or db.session
+    hours = {(row['city'], hour_bucket(row['timestamp'])) for row in rows}
+    days = {(city, day_bucket(bucket)) for city, bucket in hours}
+    try:
+        _recompute(session, _raw_select(), WeatherHourly, hour_bucket, timedelta(hours=1), hours)
+        _recompute(session, _rollup_select(WeatherHourly), WeatherDaily, day_bucket, timedelta(days=1), days)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"更新汇总数据失败(可执行 flask rebuild-rollups 修复): {str(e)}")
+
+
+def rebuild_rollups(start=None, session=None):
+    """从热表原始数据重建汇总表，返回 (小时汇总行数, 天汇总行数)
+
+    start 为空时从热表最早的数据开始重建，已归档时间段的汇总保持不变。
+    逐个城市读取和写入，内存占用只与单个城市的数据量有关。
+    """
+    session = session or db.session
+    if start is None:
+        start = session.query(db.func.min(WeatherData.timestamp)).scalar()
+    if start is not None:
+        start = day_bucket(start)
+
+    counts = []
+    for source, model, bucket_fn in (
+        (_raw_select(), WeatherHourly, hour_bucket),
+        (_rollup_select(WeatherHourly), WeatherDaily, day_bucket),
+    ):
+        table = model.__table__
+        delete = table.delete()
+        select, c = source
+        if start is not None:
+            delete = delete.where(table.c.timestamp >= start)
+            select = select.where(c.timestamp >= start)
+        session.execute(delete)
+
+        written = 0
+        cities = session.execute(db.select(c.city).distinct()).scalars().all()
+        for city in cities:
+            rows = session.execute(select.where(c.city == city).order_by(c.timestamp)).all()
+            written += _write(session, model, _aggregate(rows, bucket_fn))
+        counts.append(written)
+
+    session.commit()
+    logger.info(f"重建汇总数据完成：小时汇总{counts[0]}条，天汇总{counts[1]}条")
+    return tuple(counts)
+
+
+def choose_resolution(days):
+    """根据查询的时间跨度选择分辨率：2天以内用原始数据，31天以内用小时汇总，更长用天汇总"""
+    if days <= 2:
+        return 'raw'
+    if days <= 31:
+        return 'hour'
+    return 'day'
+
+
+def has_rollups(city, start_date, end_date, resolution, session=None):
+    """汇总表在该时间范围内是否有城市的数据（汇总尚未生成或回填时为False）"""
+    session = session or db.session
+    model = RESOLUTIONS[resolution][0]
+    return session.execute(
+        db.select(model.id).where(model.city == city, model.timestamp.between(start_date, end_date)).limit(1)
+    ).first() is not None
+
+
+def query_history(city, start_date, end_date, resolution='raw', session=None):
+    """按分辨率查询城市的历史数据，结果按时间升序
+
+    raw 返回原始数据，查询范围涉及已归档的时间段时合并热表和 Parquet 归档中的数据。
+    """
+    session = session or db.session
+    model = WeatherData if resolution == 'raw' else RESOLUTIONS[resolution][0]
+    data = session.query(model).filter(
+        model.city == city,
+        model.timestamp.between(start_date, end_date)
+    ).order_by(model.timestamp.asc()).all()
+
+    if resolution != 'raw' or (data and data[0].timestamp <= start_date):
+        return data
+
+    archived = weather_archive.read(city, start_date, end_date)
+    if not archived:
+        return data
+    hot_ids = {item.id for item in data}
+    return sorted([item for item in archived if item.id not in hot_ids] + data, key=lambda item: item.timestamp)
+
+
+def encode_cursor(item):
+    """将一行数据的 (timestamp, id) 编码为不透明的分页游标"""
+    key = f"{item.timestamp.strftime('%Y-%m-%dT%H:%M:%S')}|{item.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """解析分页游标，返回 (timestamp, id)，格式错误时抛出 ValueError"""
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S'), int(row_id)
+    except Exception:
+        raise ValueError(f"无效的分页游标: {cursor}")
+
+
+def iter_history(city, start_date, end_date, resolution='raw', after=None, chunk_size=1000, session=None):
+    """按 (timestamp, id) 顺序逐行产出城市的历史数据，内存占用与时间范围无关
+
+    after 为 (timestamp, id) 时只返回其后的数据（键集分页）。热表数据通过服务端游标分批读取；
+    raw 分辨率下先逐月读取 Parquet 归档，再读取热表。
+    """
+    session = session or db.session
+    model = WeatherData if resolution == 'raw' else RESOLUTIONS[resolution][0]
+    table = model.__table__
+
+    if after is not None:
+        start_date = max(start_date, after[0])
+
+    def is_after(item):
+        return after is None or (item.timestamp, item.id) > after
+
+    hot_start = None
+    if resolution == 'raw':
+        hot_start = session.query(db.func.min(table.c.timestamp)).filter(table.c.city == city).scalar()
+        # 查询起点早于热表最早的数据时，先逐个读取范围内的归档月份
+        if hot_start is None or start_date < hot_start:
+            archive_end = end_date if hot_start is None else min(end_date, hot_start)
+            for month in weather_archive.months(city):
+                if month > archive_end or next_month(month) <= start_date:
+                    continue
+                month_range = (max(month, start_date), min(next_month(month) - timedelta(microseconds=1), archive_end))
+                for item in weather_archive.read(city, *month_range):
+                    if is_after(item) and (hot_start is None or item.timestamp < hot_start):
+                        yield item
+
+    stmt = db.select(table).where(table.c.city == city, table.c.timestamp.between(start_date, end_date))
+    if after is not None:
+        stmt = stmt.where(db.or_(
+            table.c.timestamp > after[0],
+            db.and_(table.c.timestamp == after[0], table.c.id > after[1])
+        ))
+    rows = session.execute(
+        stmt.order_by(table.c.timestamp, table.c.id).execution_options(yield_per=chunk_size)
+    )
+    try:
+        for item in rows:
+            yield item
+    finally:
+        rows.close()
@@ -1,7 +1,8 @@
 import random
 from datetime import datetime, timedelta
 from app import create_app, db
-from app.models import WeatherData
+from app.utils.city_registry import city_registry
+from app.utils.ingest_writer import IngestWriter
 
 
 def generate_test_data():
@@ -9,29 +10,26 @@ def generate_test_data():
     app = create_app()
 
     with app.app_context():
-        cities = ['Beijing', 'Shanghai', 'Guangzhou', 'Shenzhen']
+        cities = city_registry.names()
 
         print("开始生成测试数据...")
 
-        for city in cities:
-            for i in range(7):  # 生成7天的数据
-                day = datetime.now() - timedelta(days=6 - i)
-
-                # 创建多个时间点的数据
-                for hour in [8, 12, 16, 20]:
-                    timestamp = day.replace(hour=hour, minute=0, second=0)
-
-                    data = WeatherData(
-                        city=city,
-                        temperature=20 + i + random.uniform(-2, 2),
-                        humidity=60 - i * 5 + random.uniform(-5, 5),
-                        wind_speed=random.uniform(1.0, 5.0),
-                        timestamp=timestamp
-                    )
-                    db.session.add(data)
-
-        db.session.commit()
-        print("测试数据生成完成！共添加", len(cities) * 7 * 4, "条记录")
+        with IngestWriter.from_config(app.config) as writer:
+            for city in cities:
+                for i in range(7):  # 生成7天的数据
+                    day = datetime.now() - timedelta(days=6 - i)
+
+                    # 创建多个时间点的数据
+                    for hour in [8, 12, 16, 20]:
+                        writer.add({
+                            'city': city,
+                            'temperature': 20 + i + random.uniform(-2, 2),
+                            'humidity': 60 - i * 5 + random.uniform(-5, 5),
+                            'wind_speed': random.uniform(1.0, 5.0),
+                            'timestamp': day.replace(hour=hour, minute=0, second=0)
+                        })
+
+        print("测试数据生成完成！共添加", writer.rows_written, "条记录")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,29 @@
+"""add forecast_queue table
+
+Revision ID: 4e7b1c90d5a3
+Revises: a6e2d94c17b8
+Create Date: 2025-09-26 11:20:04.381562
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e7b1c90d5a3'
+down_revision = 'a6e2d94c17b8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Web 进程把缺少或过期预测的城市写入此表，由采集守护进程或 flask precompute-forecasts 计算
+    op.create_table('forecast_queue',
+    sa.Column('city', sa.String(length=100), nullable=False),
+    sa.Column('requested_at', sa.DateTime(), nullable=False, comment='最近一次请求时间'),
+    sa.PrimaryKeyConstraint('city')
+    )
+
+
+def downgrade():
+    op.drop_table('forecast_queue')
@@ -0,0 +1,29 @@
+"""unique city/time bucket index
+
+Revision ID: 7d3e51a0c4b2
+Revises: 2c5b70b0d0fd
+Create Date: 2025-09-02 10:12:45.118203
+
+升级前请先执行 `flask compact-weather-data` 清理已有的重复数据，否则唯一索引创建会失败。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3e51a0c4b2'
+down_revision = '2c5b70b0d0fd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('weather_data', schema=None) as batch_op:
+        batch_op.drop_index('idx_city_time')
+        batch_op.create_index('idx_city_time', ['city', 'timestamp'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('weather_data', schema=None) as batch_op:
+        batch_op.drop_index('idx_city_time')
+        batch_op.create_index('idx_city_time', ['city', 'timestamp'], unique=False)
@@ -0,0 +1,28 @@
+"""add weather_data.ingested_at
+
+Revision ID: a6e2d94c17b8
+Revises: f3b8c2e6a971
+Create Date: 2025-09-22 15:08:37.514209
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6e2d94c17b8'
+down_revision = 'f3b8c2e6a971'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 已有数据取迁移时间，之后由数据库在插入时填写
+    with op.batch_alter_table('weather_data', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ingested_at', sa.DateTime(), server_default=sa.func.now(), nullable=False,
+                                      comment='写入时间'))
+
+
+def downgrade():
+    with op.batch_alter_table('weather_data', schema=None) as batch_op:
+        batch_op.drop_column('ingested_at')
@@ -0,0 +1,48 @@
+"""add city table
+
+Revision ID: b5c08e9f2a17
+Revises: 7d3e51a0c4b2
+Create Date: 2025-09-04 15:40:21.553017
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5c08e9f2a17'
+down_revision = '7d3e51a0c4b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    city = op.create_table('city',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False, comment='城市名称'),
+    sa.Column('openweathermap_id', sa.Integer(), nullable=True, comment='OpenWeatherMap 城市ID'),
+    sa.Column('weatherbit_id', sa.Integer(), nullable=True, comment='Weatherbit 城市ID'),
+    sa.Column('latitude', sa.Float(), nullable=True, comment='纬度'),
+    sa.Column('longitude', sa.Float(), nullable=True, comment='经度'),
+    sa.Column('active', sa.Boolean(), nullable=False, server_default=sa.true(), comment='是否启用'),
+    sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.func.current_timestamp(),
+              comment='最后修改时间'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+
+    # 写入原先硬编码的城市
+    op.bulk_insert(city, [
+        {'name': 'Beijing', 'openweathermap_id': 1816670, 'weatherbit_id': 1816670,
+         'latitude': 39.9042, 'longitude': 116.4074},
+        {'name': 'Shanghai', 'openweathermap_id': 1796236, 'weatherbit_id': 1796236,
+         'latitude': 31.2304, 'longitude': 121.4737},
+        {'name': 'Guangzhou', 'openweathermap_id': 1809858, 'weatherbit_id': 1809858,
+         'latitude': 23.1291, 'longitude': 113.2644},
+        {'name': 'Shenzhen', 'openweathermap_id': 1795565, 'weatherbit_id': 1795565,
+         'latitude': 22.5431, 'longitude': 114.0579},
+    ])
+
+
+def downgrade():
+    op.drop_table('city')
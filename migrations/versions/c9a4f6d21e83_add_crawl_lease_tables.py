@@ -0,0 +1,35 @@
+"""add crawl lease tables
+
+Revision ID: c9a4f6d21e83
+Revises: b5c08e9f2a17
+Create Date: 2025-09-08 11:05:37.902164
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9a4f6d21e83'
+down_revision = 'b5c08e9f2a17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('crawl_worker',
+    sa.Column('id', sa.String(length=64), nullable=False, comment='采集进程标识'),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=False, comment='最近心跳时间'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('crawl_lease',
+    sa.Column('partition', sa.Integer(), autoincrement=False, nullable=False, comment='城市分区'),
+    sa.Column('owner', sa.String(length=64), nullable=True, comment='持有租约的进程'),
+    sa.Column('expires_at', sa.DateTime(), nullable=True, comment='租约到期时间'),
+    sa.PrimaryKeyConstraint('partition')
+    )
+
+
+def downgrade():
+    op.drop_table('crawl_lease')
+    op.drop_table('crawl_worker')
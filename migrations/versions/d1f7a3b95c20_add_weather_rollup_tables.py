@@ -0,0 +1,50 @@
+"""add weather rollup tables
+
+Revision ID: d1f7a3b95c20
+Revises: c9a4f6d21e83
+Create Date: 2025-09-10 15:21:08.417356
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1f7a3b95c20'
+down_revision = 'c9a4f6d21e83'
+branch_labels = None
+depends_on = None
+
+
+def _rollup_columns():
+    return [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('city', sa.String(length=100), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False, comment='时间桶起点'),
+        sa.Column('count', sa.Integer(), nullable=False, comment='原始数据条数'),
+        sa.Column('temperature', sa.Float(), nullable=False, comment='平均温度'),
+        sa.Column('temperature_min', sa.Float(), nullable=False),
+        sa.Column('temperature_max', sa.Float(), nullable=False),
+        sa.Column('humidity', sa.Float(), nullable=False, comment='平均湿度'),
+        sa.Column('humidity_min', sa.Float(), nullable=False),
+        sa.Column('humidity_max', sa.Float(), nullable=False),
+        sa.Column('wind_speed', sa.Float(), nullable=False, comment='平均风速'),
+        sa.Column('wind_speed_min', sa.Float(), nullable=False),
+        sa.Column('wind_speed_max', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    ]
+
+
+def upgrade():
+    op.create_table('weather_hourly', *_rollup_columns())
+    op.create_index('idx_hourly_city_time', 'weather_hourly', ['city', 'timestamp'], unique=True)
+    op.create_table('weather_daily', *_rollup_columns())
+    op.create_index('idx_daily_city_time', 'weather_daily', ['city', 'timestamp'], unique=True)
+    # 已有数据需执行 flask rebuild-rollups 生成汇总
+
+
+def downgrade():
+    op.drop_index('idx_daily_city_time', table_name='weather_daily')
+    op.drop_table('weather_daily')
+    op.drop_index('idx_hourly_city_time', table_name='weather_hourly')
+    op.drop_table('weather_hourly')
@@ -0,0 +1,34 @@
+"""add forecast table
+
+Revision ID: f3b8c2e6a971
+Revises: d1f7a3b95c20
+Create Date: 2025-09-16 10:42:51.263718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b8c2e6a971'
+down_revision = 'd1f7a3b95c20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('forecast',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('city', sa.String(length=100), nullable=False),
+    sa.Column('generated_at', sa.DateTime(), nullable=False, comment='预测生成时间'),
+    sa.Column('horizon', sa.Integer(), nullable=False, comment='预测天数'),
+    sa.Column('payload', sa.Text(), nullable=False, comment='按天排列的预测结果(JSON)'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_forecast_city', 'forecast', ['city'], unique=True)
+    # 已有城市的预测可执行 flask precompute-forecasts 生成
+
+
+def downgrade():
+    op.drop_index('idx_forecast_city', table_name='forecast')
+    op.drop_table('forecast')
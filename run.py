@@ -2,10 +2,13 @@ import os
 import threading
 import time
 import webbrowser
+from datetime import datetime
 
 from app import create_app
 from app.extensions import db
-from app.models import User, WeatherData
+from app.models import User
+from app.utils.city_registry import city_registry
+from app.utils.ingest_writer import IngestWriter
 
 app = create_app()
 
@@ -21,18 +24,20 @@ def init_db():
         test_user.set_password('test123')
         db.session.add(test_user)
 
+        db.session.commit()
+
         # 添加测试天气数据
-        cities = ['Beijing', 'Shanghai', 'Guangzhou', 'Shenzhen']
-        for city in cities:
-            data = WeatherData(
-                city=city,
-                temperature=25.5,
-                humidity=60.0,
-                wind_speed=3.2
-            )
-            db.session.add(data)
+        cities = city_registry.names()
+        with IngestWriter.from_config(app.config) as writer:
+            for city in cities:
+                writer.add({
+                    'city': city,
+                    'temperature': 25.5,
+                    'humidity': 60.0,
+                    'wind_speed': 3.2,
+                    'timestamp': datetime.now()
+                })
 
-        db.session.commit()
         print("数据库已初始化")
 
 def open_browser():
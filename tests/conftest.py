@@ -0,0 +1,23 @@
+import pytest
+
+from config import Config
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """使用临时 SQLite 数据库的应用，表由 create_all 创建"""
+    monkeypatch.setattr(Config, 'SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'weather.db'}")
+    monkeypatch.setattr(Config, 'SQLALCHEMY_ENGINE_OPTIONS', {})
+    monkeypatch.setattr(Config, 'MODEL_DIR', str(tmp_path / 'models'))
+    monkeypatch.setattr(Config, 'ARCHIVE_DIR', str(tmp_path / 'archive'))
+    monkeypatch.chdir(tmp_path)
+
+    from app import create_app
+    from app.extensions import db
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
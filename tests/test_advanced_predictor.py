@@ -0,0 +1,23 @@
+import numpy as np
+
+from app.utils.advanced_predictor import AdvancedPredictor, build_lag_features
+from app.utils.predictor_benchmark import synthetic_daily
+
+
+def _mae(predictor, X, y):
+    return np.abs(predictor.predict_features(X).reshape(len(X), -1) - y).mean()
+
+
+def test_daily_updates_do_not_degrade_accuracy():
+    values, timestamps = synthetic_daily(240)
+    predictor = AdvancedPredictor('synthetic', n_jobs=1, max_horizon=7)
+    assert predictor.train_arrays(values[:120], timestamps[:120])
+    X, y = build_lag_features(values[160:], timestamps[160:], predictor.lags, predictor.horizon)
+    before = _mae(predictor, X, y)
+
+    # 每天入库后增量更新一次，每次只有一个新样本；40次后所有树都已被替换过
+    for day in range(120, 160):
+        assert predictor.update_arrays(values[:day + 1], timestamps[:day + 1], timestamps[day])
+    assert predictor.update_arrays(values[:160], timestamps[:160], timestamps[159] + np.timedelta64(1, 'D')) is False
+
+    assert _mae(predictor, X, y) <= before * 1.05
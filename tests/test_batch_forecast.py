@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.extensions import db
+from app.models import WeatherData
+from app.utils.advanced_predictor import AdvancedPredictor
+from app.utils.batch_forecast import load_training_arrays
+from app.utils.model_registry import model_registry
+from app.utils.recent_buffer import VALUE_COLUMNS
+
+
+def test_raw_fallback_matches_single_city_loader(app):
+    # 没有天汇总时（未执行 rebuild-rollups）按原始数据每天聚合
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=5)
+    db.session.execute(WeatherData.__table__.insert(), [
+        {'city': 'Beijing', 'temperature': float(i % 7), 'humidity': 50.0 + i % 3, 'wind_speed': 2.0,
+         'timestamp': start + timedelta(hours=4 * i)}
+        for i in range(30)
+    ])
+    db.session.commit()
+
+    values, timestamps, segments = load_training_arrays(['Beijing', 'Nowhere'], training_days=90)
+    assert set(segments) == {'Beijing'}
+    begin, end, fingerprint = segments['Beijing']
+    assert fingerprint == model_registry.fingerprint('Beijing')
+
+    daily = AdvancedPredictor('Beijing', training_days=90)._load_daily(90)
+    assert end - begin == len(daily['timestamp']) == 5
+    np.testing.assert_array_equal(timestamps[begin:end], daily['timestamp'])
+    np.testing.assert_allclose(values[begin:end], np.column_stack([daily[column] for column in VALUE_COLUMNS]))
@@ -0,0 +1,78 @@
+import time
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import WeatherData
+from app.utils.change_feed import decode_feed_cursor, head_cursor, read_changes
+
+LAG = 2
+
+
+def _insert(session, ids, city):
+    session.add_all(WeatherData(id=i, city=city, temperature=20.0, humidity=50.0, wind_speed=3.0,
+                                timestamp=datetime(2025, 9, 1, 0, i)) for i in ids)
+    session.flush()
+
+
+def test_interleaved_writers_are_not_skipped(app):
+    # 写入方 A 先分配到 1-5，写入方 B 后分配到 6-10，但 B 先提交
+    writer_a = Session(db.engine)
+    writer_b = Session(db.engine)
+    _insert(writer_b, range(6, 11), 'Beijing')
+    writer_b.commit()
+
+    # 此时读取只看到 B 的数据，游标不能越过 A 尚未可见的 id
+    rows, cursor, has_more = read_changes(None, 100, lag=LAG)
+    assert rows == []
+    assert decode_feed_cursor(cursor) == 0
+    assert decode_feed_cursor(head_cursor(lag=LAG)) == 0
+
+    _insert(writer_a, range(1, 6), 'Shanghai')
+    writer_a.commit()
+    db.session.commit()
+    time.sleep(LAG + 1.1)
+
+    rows, cursor, has_more = read_changes(cursor, 100, lag=LAG)
+    assert [row.id for row in rows] == list(range(1, 11))
+    assert decode_feed_cursor(cursor) == 10
+    assert not has_more
+    assert decode_feed_cursor(head_cursor(lag=LAG)) == 10
+
+    writer_a.close()
+    writer_b.close()
+
+
+def test_without_lag_the_late_commit_is_skipped(app):
+    # 对照：不等待时游标直接越过 A 的 id，A 提交后再也读不到
+    writer_a = Session(db.engine)
+    writer_b = Session(db.engine)
+    _insert(writer_b, range(6, 11), 'Beijing')
+    writer_b.commit()
+
+    rows, cursor, _ = read_changes(None, 100, lag=-60)
+    assert [row.id for row in rows] == list(range(6, 11))
+
+    _insert(writer_a, range(1, 6), 'Shanghai')
+    writer_a.commit()
+    db.session.commit()
+
+    rows, cursor, _ = read_changes(cursor, 100, lag=-60)
+    assert rows == []
+
+    writer_a.close()
+    writer_b.close()
+
+
+def test_pages_stop_at_limit(app):
+    _insert(db.session, range(1, 8), 'Beijing')
+    db.session.commit()
+    time.sleep(LAG + 1.1)
+
+    rows, cursor, has_more = read_changes(None, 3, lag=LAG)
+    assert [row.id for row in rows] == [1, 2, 3]
+    assert has_more
+    rows, cursor, has_more = read_changes(cursor, 10, lag=LAG)
+    assert [row.id for row in rows] == [4, 5, 6, 7]
+    assert not has_more
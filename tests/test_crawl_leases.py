@@ -0,0 +1,109 @@
+import time
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.models import CrawlLease
+from app.utils.crawl_engine import AsyncCrawlEngine
+from app.utils.crawl_leases import LeaseManager, partition_of
+from app.utils.crawl_scheduler import CrawlScheduler
+
+PARTITIONS = 8
+CITIES = [f'city-{i}' for i in range(200)]
+
+
+def _manager(worker_id, lease_ttl=30):
+    # 每个进程使用独立的会话，和多个采集进程共用一个数据库的情形相同
+    manager = LeaseManager(worker_id, partitions=PARTITIONS, lease_ttl=lease_ttl, session=Session(db.engine))
+    manager.ensure_partitions()
+    return manager
+
+
+def _assert_disjoint(*managers):
+    # 按 owns() 判断，已过续约截止时间的进程不再持有分区
+    assert {partition_of(city, PARTITIONS) for city in CITIES} == set(range(PARTITIONS))
+    for city in CITIES:
+        assert sum(manager.owns(city) for manager in managers) <= 1
+
+
+def test_single_worker_owns_all_partitions(app):
+    a = _manager('a')
+    assert a.rebalance() == set(range(PARTITIONS))
+    assert all(a.owns(city) for city in CITIES)
+
+
+def test_rebalance_when_a_worker_joins(app):
+    a, b, c = _manager('a'), _manager('b'), _manager('c')
+    a.rebalance()
+
+    # 新进程加入时所有分区都已被持有，等待已有进程让出
+    assert b.rebalance() == set()
+    _assert_disjoint(a, b)
+
+    assert len(a.rebalance()) == PARTITIONS // 2
+    assert len(b.rebalance()) == PARTITIONS // 2
+    _assert_disjoint(a, b)
+    assert a.owned | b.owned == set(range(PARTITIONS))
+
+    # 第三个进程加入，公平份额为 ceil(8 / 3) = 3
+    c.rebalance()
+    a.rebalance()
+    b.rebalance()
+    c.rebalance()
+    _assert_disjoint(a, b, c)
+    assert a.owned | b.owned | c.owned == set(range(PARTITIONS))
+    assert max(len(m.owned) for m in (a, b, c)) <= 3
+
+
+def test_takeover_after_expiry(app):
+    a, b = _manager('a', lease_ttl=1), _manager('b', lease_ttl=1)
+    a.rebalance()
+    assert b.rebalance() == set()
+
+    # a 停止续约（例如进程卡住），租约过期后 b 接管全部分区
+    time.sleep(2.5)
+    assert not any(a.owns(city) for city in CITIES)
+    assert b.rebalance() == set(range(PARTITIONS))
+    _assert_disjoint(a, b)
+
+    # a 恢复后续约失败，不会与 b 重复采集
+    assert a.rebalance() == set()
+    _assert_disjoint(a, b)
+    assert all(b.owns(city) for city in CITIES)
+
+
+def test_release_all_hands_partitions_over(app):
+    a, b = _manager('a'), _manager('b')
+    a.rebalance()
+    b.rebalance()
+    a.release_all()
+    assert not any(a.owns(city) for city in CITIES)
+    assert b.rebalance() == set(range(PARTITIONS))
+
+
+def test_cycle_skips_partitions_lost_mid_crawl(app, monkeypatch):
+    a, b = _manager('a'), _manager('b')
+    a.rebalance()
+    app.config['CRAWL_CONCURRENCY'] = 50
+    scheduler = CrawlScheduler(app.config, lease_manager=a)
+    batches = []
+
+    def crawl(engine, cities, writer=None):
+        batches.append(list(cities))
+        if len(batches) == 1:
+            # 第一批耗时超过租约有效期：a 的租约过期，b 接管一半分区
+            with Session(db.engine) as session:
+                session.execute(db.update(CrawlLease).values(expires_at=datetime(2000, 1, 1)))
+                session.commit()
+            b.rebalance()
+            scheduler._rebalanced_at -= a.lease_ttl
+        return [{'city': city, 'status': 'success'} for city in cities]
+
+    monkeypatch.setattr(AsyncCrawlEngine, 'crawl', crawl)
+    scheduler.run_cycle(CITIES)
+
+    assert len(batches[0]) == 50 and b.owned
+    for batch in batches[1:]:
+        assert not any(b.owns(city) for city in batch)
+    _assert_disjoint(a, b)
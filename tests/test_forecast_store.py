@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.extensions import db
+from app.models import Forecast, ForecastQueue
+from app.utils.forecast_store import ForecastPending, forecast_store
+
+
+def _queued():
+    return set(db.session.execute(db.select(ForecastQueue.city)).scalars())
+
+
+def test_miss_is_queued_instead_of_computed(app):
+    with pytest.raises(ForecastPending):
+        forecast_store.get('Beijing')
+    assert _queued() == {'Beijing'}
+    assert db.session.execute(db.select(Forecast.id)).first() is None
+
+    # 没有数据的城市计算后保存空预测，之后的请求直接返回数据不足而不再入队
+    assert forecast_store.refresh_pending() == 0
+    assert _queued() == set()
+    assert forecast_store.get('Beijing') is None
+    assert _queued() == set()
+
+
+def test_stale_forecast_is_served_and_queued(app):
+    tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    forecast_store.save('Beijing', [{'date': tomorrow, 'temperature': 20.0, 'humidity': 50.0, 'wind_speed': 2.0}])
+    db.session.execute(db.update(Forecast).values(generated_at=datetime.now() - timedelta(days=1)))
+    db.session.commit()
+
+    forecast = forecast_store.get_many(['Beijing', 'Shanghai'], days=1)
+    assert [day['date'] for day in forecast['Beijing']] == [tomorrow]
+    assert 'Shanghai' not in forecast
+    assert _queued() == {'Beijing', 'Shanghai'}
@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.models import WeatherData
+from app.utils.ingest_writer import compact_weather_data
+
+
+def test_compact_keeps_latest_row_per_bucket_across_pages(app):
+    base = datetime(2025, 9, 1)
+    offsets = [0, 1, 4, 9, 10, 13, 25, 31, 32, 33]  # 分钟
+    rows = [WeatherData(city=city, temperature=float(minute), humidity=50.0, wind_speed=2.0,
+                        timestamp=base + timedelta(minutes=minute))
+            for city in ('Beijing', 'Shanghai') for minute in offsets]
+    db.session.add_all(rows)
+    db.session.commit()
+
+    # 每页 3 行，同一时间桶的数据跨页也能合并
+    deleted, updated = compact_weather_data(bucket_seconds=600, chunk_size=3)
+
+    remaining = sorted((row.city, row.timestamp, row.temperature) for row in WeatherData.query.all())
+    expected = [(city, base + timedelta(minutes=bucket), float(latest))
+                for city in ('Beijing', 'Shanghai')
+                for bucket, latest in ((0, 9), (10, 13), (20, 25), (30, 33))]
+    assert remaining == expected
+    assert deleted == 2 * 6
+    assert updated == 2 * 4
+    assert compact_weather_data(bucket_seconds=600, chunk_size=3) == (0, 0)
@@ -0,0 +1,39 @@
+import time
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.models import WeatherData
+from app.utils.recent_buffer import RecentBuffer
+
+
+def _add(city, timestamp, temperature):
+    db.session.add(WeatherData(city=city, timestamp=timestamp, temperature=temperature,
+                               humidity=50.0, wind_speed=3.0))
+    db.session.commit()
+
+
+def test_refresh_picks_up_late_rows_with_earlier_timestamps(app):
+    buffer = RecentBuffer(days=7, capacity=100, lag=1)
+    now = datetime.now().replace(microsecond=0)
+    _add('Beijing', now - timedelta(hours=1), 20.0)
+    time.sleep(2.1)
+    buffer.load()
+    assert list(buffer.series('Beijing')['temperature']) == [20.0]
+
+    # 其他进程较晚提交了一条观测时间更早的数据
+    _add('Beijing', now - timedelta(hours=3), 18.0)
+    _add('Shanghai', now - timedelta(hours=2), 25.0)
+    time.sleep(2.1)
+    buffer.refresh()
+
+    assert list(buffer.series('Beijing')['temperature']) == [18.0, 20.0]
+    assert list(buffer.series('Shanghai')['temperature']) == [25.0]
+    assert buffer.stats()['synced_id'] == 3
+
+
+def test_series_days_zero_is_an_empty_range(app):
+    buffer = RecentBuffer(days=7, capacity=100, lag=0)
+    _add('Beijing', datetime.now() - timedelta(hours=1), 20.0)
+    buffer.load()
+    assert len(buffer.series('Beijing')['timestamp']) == 1
+    assert len(buffer.series('Beijing', 0)['timestamp']) == 0
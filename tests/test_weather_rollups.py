@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.models import WeatherDaily, WeatherHourly
+from app.utils.ingest_writer import IngestWriter
+from app.utils.weather_rollups import _bucket_ranges, rebuild_rollups
+
+HOUR = timedelta(hours=1)
+
+
+def _snapshot(model):
+    return sorted((row.city, row.timestamp, row.count, round(row.temperature, 6), row.temperature_min,
+                   row.temperature_max) for row in model.query.all())
+
+
+def test_bucket_ranges_follow_touched_buckets():
+    base = datetime(2025, 9, 1)
+    keys = {('a', base), ('a', base + HOUR), ('b', base + HOUR), ('b', base - 48 * HOUR)}
+    assert _bucket_ranges(keys, HOUR) == [
+        [base - 48 * HOUR, base - 47 * HOUR, {'b'}],
+        [base, base + 2 * HOUR, {'a', 'b'}],
+    ]
+
+
+def test_incremental_rollups_match_rebuild_with_late_rows(app):
+    writer = IngestWriter.from_config(app.config)
+    base = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=3)
+    for step in range(36):
+        for city in ('Beijing', 'Shanghai'):
+            writer.add({'city': city, 'temperature': 10.0 + step, 'humidity': 50.0, 'wind_speed': 2.0,
+                        'timestamp': base + timedelta(minutes=20 * step)})
+        if step % 6 == 5:
+            writer.flush()
+    # 迟到的数据：一个城市两天前的时间桶
+    writer.add({'city': 'Beijing', 'temperature': -5.0, 'humidity': 40.0, 'wind_speed': 1.0,
+                'timestamp': base - timedelta(days=2)})
+    writer.flush()
+
+    hourly, daily = _snapshot(WeatherHourly), _snapshot(WeatherDaily)
+    assert any(row[2] == 1 and row[3] == -5.0 for row in hourly)
+    rebuild_rollups()
+    assert _snapshot(WeatherHourly) == hourly
+    assert _snapshot(WeatherDaily) == daily